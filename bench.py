@@ -0,0 +1,297 @@
+import argparse
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+# Qt has to be told before it is imported that there is no display
+os.environ.setdefault("QT_QPA_PLATFORM", "offscreen")
+
+import pymysql
+from PyQt5.QtCore import QEventLoop, QSettings, QT_VERSION_STR, PYQT_VERSION_STR
+from PyQt5.QtWidgets import QApplication
+
+import main
+
+# Headless benchmarks for the browse, refresh and edit paths of main.py. The window runs under the offscreen Qt
+# platform against a scratch database on a local MySQL/MariaDB server, which is filled with synthetic tables the
+# first time. Every measurement reports wall time, statements sent to the server (from main.query_log),
+# bytes received and how much the RSS grew, and the whole run is written as JSON so that two runs can be compared
+# with --compare.
+#
+#   python bench.py --user root --password secret --output before.json
+#   python bench.py --user root --password secret --output after.json --compare before.json
+
+SEED_BATCH_SIZE = 5000
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark SQL_Browser against a local MySQL/MariaDB server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", default="")
+    parser.add_argument("--database", default="sql_browser_bench",
+                        help="scratch database, created and filled if missing")
+    parser.add_argument("--sizes", default="10000,100000,1000000", help="row counts of the large tables")
+    parser.add_argument("--tables", type=int, default=500, help="number of small tables for the table tree")
+    parser.add_argument("--repeat", type=int, default=5, help="runs per measurement")
+    parser.add_argument("--timeout", type=float, default=600, help="seconds to wait for one action")
+    parser.add_argument("--output", default="bench-results.json")
+    parser.add_argument("--compare", help="earlier results file to print the differences against")
+    parser.add_argument("--typed-fetch", action="store_true",
+                        help="let pymysql convert every value in the grid, as before values were decoded lazily")
+    return parser.parse_args()
+
+
+def rss_kb():
+    # Current resident set size from /proc where it exists
+    try:
+        with open("/proc/self/statm") as file:
+            return int(file.read().split()[1]) * os.sysconf("SC_PAGE_SIZE") // 1024
+    except (OSError, ValueError, AttributeError):
+        return None
+
+
+def peak_rss_kb():
+    # Highest RSS of the whole run so far; it never goes down, so it only says something about the run as a whole
+    try:
+        import resource
+    except ImportError:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak // 1024 if sys.platform == "darwin" else peak
+
+
+def seed(args, sizes):
+    connection = pymysql.connect(host=args.host, user=args.user, password=args.password, autocommit=True)
+    cursor = connection.cursor()
+    cursor.execute(f"CREATE DATABASE IF NOT EXISTS {main.quote_ident(args.database)}")
+    cursor.execute(f"USE {main.quote_ident(args.database)}")
+    for size in sizes:
+        table_name = f"bench_rows_{size}"
+        cursor.execute(f"CREATE TABLE IF NOT EXISTS {main.quote_ident(table_name)} ("
+                       "id INT PRIMARY KEY, name VARCHAR(64), amount DECIMAL(12, 2), created DATETIME, "
+                       "note VARCHAR(255), KEY name_index (name))")
+        cursor.execute(f"SELECT COUNT(*) FROM {main.quote_ident(table_name)}")
+        existing = cursor.fetchone()[0]
+        if existing == size:
+            continue
+        print(f"Seeding {table_name} with {size} rows")
+        cursor.execute(f"TRUNCATE TABLE {main.quote_ident(table_name)}")
+        for start in range(0, size, SEED_BATCH_SIZE):
+            rows = [(i, f"name {i % 997}", (i * 37) % 100000 / 100, "2020-01-01 00:00:00", f"note for row {i}")
+                    for i in range(start + 1, min(start + SEED_BATCH_SIZE, size) + 1)]
+            cursor.executemany(f"INSERT INTO {main.quote_ident(table_name)} VALUES (%s, %s, %s, %s, %s)", rows)
+    cursor.execute("SELECT COUNT(*) FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s "
+                   "AND TABLE_NAME LIKE 'bench\\_small\\_%%'", (args.database,))
+    if cursor.fetchone()[0] < args.tables:
+        print(f"Creating {args.tables} small tables")
+        for i in range(args.tables):
+            table_name = f"bench_small_{i:04d}"
+            cursor.execute(f"CREATE TABLE IF NOT EXISTS {main.quote_ident(table_name)} "
+                           "(id INT PRIMARY KEY, value VARCHAR(32))")
+            cursor.execute(f"INSERT IGNORE INTO {main.quote_ident(table_name)} VALUES (1, 'a'), (2, 'b'), (3, 'c')")
+    cursor.execute("SELECT VERSION()")
+    version = cursor.fetchone()[0]
+    connection.close()
+    return version
+
+
+class Bench:
+    def __init__(self, args):
+        self.args = args
+        self.app = QApplication.instance() or QApplication(sys.argv)
+        # The window's settings (pool sizes, paged mode, the result cache budget, the advisor workload...) would
+        # otherwise be read from and written to the user's own. They go to a scratch directory under a name of
+        # their own instead, starting out empty on every run; the name keeps them apart where the native format
+        # ignores the path, i.e. the Windows registry.
+        self.settings_directory = tempfile.TemporaryDirectory(prefix="sql_browser_bench_")
+        for settings_format in (QSettings.NativeFormat, QSettings.IniFormat):
+            QSettings.setPath(settings_format, QSettings.UserScope, self.settings_directory.name)
+        main.SETTINGS_NAME = "SQL_Browser_bench"
+        QSettings(main.SETTINGS_NAME, main.SETTINGS_NAME).clear()
+        # No prompts: the connection comes from the command line and errors are printed
+        profile = {"host": args.host, "user": args.user, "password": args.password, "db": args.database}
+        main.load_profiles = lambda settings: {"bench": profile}
+        main.startup_message = lambda: None
+        main.show_error_message = lambda message: print(f"Error: {message}")
+        main.show_success_message = lambda message: None
+        self.results = []
+        # Startup runs once: from building the window to the table tree of the connected database
+        self.window = None
+        self.measure("startup", None, self.start, repeat=1)
+        self.window.timer.stop()
+        self.window.raw_fetch_action.setChecked(not args.typed_fetch)
+
+    def start(self):
+        self.window = main.MainWindow("bench")
+        self.window.show()
+
+    def wait_idle(self):
+        # Runs the event loop until no job is left, including the ones started from other jobs' callbacks
+        deadline = time.monotonic() + self.args.timeout
+        executor = self.window.executor
+        while True:
+            self.app.processEvents(QEventLoop.AllEvents, 20)
+            if not executor.running(include_background=True) and not executor.busy():
+                self.app.processEvents()
+                if not executor.running(include_background=True):
+                    break
+            if time.monotonic() > deadline:
+                raise TimeoutError("benchmark action did not finish in time")
+            time.sleep(0.001)
+        self.window.timer.stop()
+
+    def measure(self, action, table_name, fn, repeat=None, setup=None):
+        times = []
+        statements = []
+        received = []
+        grown = []
+        for _ in range(repeat or self.args.repeat):
+            if setup is not None:
+                setup()
+                self.wait_idle()
+            before = main.query_log.snapshot()
+            rss_before = rss_kb()
+            started = time.perf_counter()
+            fn()
+            self.wait_idle()
+            times.append(time.perf_counter() - started)
+            rss_after = rss_kb()
+            after = main.query_log.snapshot()
+            statements.append(after["statements"] - before["statements"])
+            received.append(sum(totals["bytes"] for totals in after["shapes"]) -
+                            sum(totals["bytes"] for totals in before["shapes"]))
+            if rss_before is not None and rss_after is not None:
+                grown.append(rss_after - rss_before)
+        result = {
+            "action": action,
+            "table": table_name,
+            "seconds": statistics.median(times),
+            "min_seconds": min(times),
+            "runs": times,
+            "statements": statistics.median(statements),
+            "bytes": statistics.median(received),
+            "rss_kb": rss_kb(),
+            # RSS after the action minus before it, which memory freed in between can make negative
+            "rss_delta_kb": statistics.median(grown) if grown else None,
+        }
+        self.results.append(result)
+        rss_text = f"RSS {result['rss_delta_kb']:+.0f} kB" if grown else ""
+        print(f"{action:<22} {table_name or '':<22} {result['seconds'] * 1000:10.1f} ms "
+              f"{result['statements']:6} stmts {result['bytes']:12} bytes  {rss_text}")
+        return result
+
+    def open_table(self, table_name):
+        if self.window.tree_model.table_item(main.db, table_name) is None:
+            raise RuntimeError(f"{table_name} is not in the table tree")
+        self.window.select_table(table_name)
+        self.window.table_model.clear()
+        self.window.show_table_values(table_name)
+        self.wait_idle()
+        # Time to first paint includes drawing the first screen of rows
+        self.window.value_table.viewport().repaint()
+
+    def run(self, sizes):
+        window = self.window
+        self.measure("populate_table_tree", None, window.populate_table_tree)
+        for size in sizes:
+            table_name = f"bench_rows_{size}"
+            self.measure("first_paint", table_name, lambda: self.open_table(table_name))
+            self.measure("fetch_more", table_name, lambda: window.table_model.fetchMore(main.QModelIndex()),
+                         setup=lambda: self.open_table(table_name))
+            self.open_table(table_name)
+            self.measure("refresh_tick_idle", table_name, window.poll_table_changes)
+            self.measure("refresh_tick_changed", table_name, window.poll_table_changes,
+                         setup=lambda: self.touch_row(table_name))
+            self.measure("refresh_table", table_name, window.refresh_table)
+            self.measure("cell_edit", table_name, lambda: self.edit_cell(table_name))
+            # Reading the whole table with and without converting every value, independent of --typed-fetch
+            self.measure("fetch_all_typed", table_name, lambda: self.fetch_all(table_name, False))
+            self.measure("fetch_all_raw", table_name, lambda: self.fetch_all(table_name, True))
+
+    def fetch_all(self, table_name, raw):
+        if raw:
+            connect = lambda: self.window.open_connection(raw=True)
+        else:
+            connect = self.window.open_connection
+        sql, params = main.select_query(table_name, order_columns=["id"])
+        stream = main.ResultStream(connect, sql, params, decode_columns=["id"])
+        stream.open()
+        while not stream.exhausted:
+            stream.fetch(main.FETCH_BLOCK_SIZE)
+
+    def touch_row(self, table_name):
+        # A change made by someone else, for the refresh tick to find
+        def touch(connection, job):
+            connection.cursor().execute(f"UPDATE {main.quote_ident(table_name)} SET amount = amount + 1 "
+                                        "WHERE id = 2")
+
+        # UPDATE_TIME has one second resolution, so wait for it to move on before the tick
+        self.window.run_query("Touching a row", touch)
+        self.wait_idle()
+        time.sleep(1.1)
+
+    def edit_cell(self, table_name):
+        model = self.window.table_model
+        column = model.column_index("name")
+        model.setData(model.index(0, column), f"edited {time.time()}")
+        self.window.apply_changes()
+
+    def save(self, server_version):
+        try:
+            commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                    cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+        except OSError:
+            commit = None
+        document = {
+            "created": time.time(),
+            "commit": commit,
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "qt": QT_VERSION_STR,
+            "pyqt": PYQT_VERSION_STR,
+            "pymysql": pymysql.__version__,
+            "server": server_version,
+            "repeat": self.args.repeat,
+            "typed_fetch": self.args.typed_fetch,
+            "pool": self.window.executor.stats(),
+            "peak_rss_kb": peak_rss_kb(),
+            "results": self.results,
+        }
+        with open(self.args.output, "w") as file:
+            json.dump(document, file, indent=1)
+        return document
+
+
+def compare(current, path):
+    with open(path) as file:
+        previous = json.load(file)
+    earlier = {(result["action"], result["table"]): result for result in previous["results"]}
+    print(f"\nCompared with {path} ({previous.get('commit') or 'unknown commit'}):")
+    for result in current["results"]:
+        old = earlier.get((result["action"], result["table"]))
+        if old is None:
+            continue
+        change = (result["seconds"] - old["seconds"]) / old["seconds"] * 100 if old["seconds"] else 0
+        print(f"{result['action']:<22} {result['table'] or '':<22} {old['seconds'] * 1000:10.1f} ms -> "
+              f"{result['seconds'] * 1000:10.1f} ms ({change:+.1f}%), "
+              f"{old['statements']} -> {result['statements']} stmts")
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    sizes = [int(size) for size in args.sizes.split(",") if size]
+    server_version = seed(args, sizes)
+    bench = Bench(args)
+    bench.run(sizes)
+    document = bench.save(server_version)
+    bench.window.close()
+    print(f"Results written to {args.output}")
+    if args.compare:
+        compare(document, args.compare)
@@ -0,0 +1,323 @@
+import argparse
+import getpass
+import json
+import os
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+import pymysql
+
+from engine import connect, query_log, QueryCancelled, SchemaCache, read_schema_tables, count_rows, select_query, \
+    export_result, EXPORT_CHUNK_SIZE, detect_delimiter, read_file_header, match_import_columns, \
+    import_delimited_file, load_data_local_infile, local_infile_enabled, IMPORT_BATCH_SIZE, compare_tables, \
+    DIFF_CHUNK_SIZE, DIFF_WORKERS
+
+# Runs the browser's bulk operations without a display, for scheduled jobs. Every table or file is one task, and
+# tasks run in parallel on --workers threads with a connection each. Progress goes to stderr and a JSON summary
+# with rows, bytes and timing per task to stdout, or to --summary. The exit status is 0 when everything
+# succeeded, 1 when diff found differences and 2 when a task failed or was interrupted.
+#
+#   python cli.py --user root --database shop count
+#   python cli.py --user root --database shop export --output-dir dumps --format jsonl --gzip orders customers
+#   python cli.py --user root --database shop import --table orders orders.csv
+#   python cli.py --user root --database shop diff --target-host replica orders customers
+#
+# The password is read from --password, the MYSQL_PWD environment variable or a prompt, in that order.
+
+WORKERS = 4
+
+EXIT_DIFFERENCES = 1
+EXIT_FAILED = 2
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk operations on a MySQL/MariaDB database without the window")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--user", default="root")
+    parser.add_argument("--password", help="defaults to MYSQL_PWD, or a prompt when that is not set either")
+    parser.add_argument("--database", required=True)
+    parser.add_argument("--workers", type=int, default=WORKERS, help="tables or files handled at the same time")
+    parser.add_argument("--summary", default="-", help="file the JSON summary is written to, - for stdout")
+    parser.add_argument("--quiet", action="store_true", help="no progress on stderr")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    count = commands.add_parser("count", help="exact row counts")
+    count.add_argument("tables", nargs="*", help="all tables of the database when none are given")
+
+    export = commands.add_parser("export", help="stream tables to CSV, TSV or JSON Lines files")
+    export.add_argument("tables", nargs="*", help="all tables of the database when none are given")
+    export.add_argument("--output-dir", default=".")
+    export.add_argument("--format", choices=["csv", "tsv", "jsonl"], default="csv")
+    export.add_argument("--gzip", action="store_true")
+    export.add_argument("--chunk-size", type=int, default=EXPORT_CHUNK_SIZE)
+
+    import_ = commands.add_parser("import", help="load CSV/TSV files into tables")
+    import_.add_argument("files", nargs="+")
+    import_.add_argument("--table", help="target table, by default the file name without its extensions")
+    import_.add_argument("--delimiter", help="detected from the file when not given")
+    import_.add_argument("--no-header", action="store_true", help="the first row is data, mapped by position")
+    import_.add_argument("--batch-size", type=int, default=IMPORT_BATCH_SIZE)
+    import_.add_argument("--start-row", type=int, default=0, help="data row to resume from")
+    import_.add_argument("--keep-empty", action="store_true", help="import empty values as empty strings")
+    import_.add_argument("--load-data", action="store_true", help="use LOAD DATA LOCAL INFILE")
+
+    diff = commands.add_parser("diff", help="compare tables with the same tables elsewhere by chunk checksums")
+    diff.add_argument("tables", nargs="+")
+    diff.add_argument("--target-host", help="defaults to --host")
+    diff.add_argument("--target-user", help="defaults to --user")
+    diff.add_argument("--target-password", help="defaults to the source password")
+    diff.add_argument("--target-database", help="defaults to --database")
+    diff.add_argument("--target-table", help="name of the other table, when comparing a single one")
+    diff.add_argument("--chunk-size", type=int, default=DIFF_CHUNK_SIZE)
+    diff.add_argument("--diff-workers", type=int, default=DIFF_WORKERS, help="connections per side per table")
+
+    args = parser.parse_args(argv)
+    if args.command == "import" and args.table and len(args.files) > 1:
+        parser.error("--table can only be used with a single file")
+    if args.command == "diff" and args.target_table and len(args.tables) > 1:
+        parser.error("--target-table can only be used with a single table")
+    if args.password is None:
+        args.password = os.environ.get("MYSQL_PWD")
+    if args.password is None:
+        args.password = getpass.getpass(f"Password for {args.user}@{args.host}: ") if sys.stdin.isatty() else ""
+    return args
+
+
+class Task:
+    # One table or file. Passed to the engine functions as their job, so it carries the cancelled flag and the
+    # progress they report, and it opens the task's connections so the bytes they read can be added up.
+    def __init__(self, name, fn, log):
+        self.name = name
+        self.fn = fn
+        self.log = log
+        self.cancelled = False
+        self.rows = 0
+        self.done = None
+        self.total = None
+        self.connections = []
+        self.result = {"name": name, "status": "pending"}
+
+    def connect(self, *details, **options):
+        connection = connect(*details, **options)
+        self.connections.append(connection)
+        return connection
+
+    def report(self, rows, done=None, total=None):
+        self.rows = rows
+        self.done = done
+        self.total = total
+
+    def run(self, feature):
+        query_log.set_feature(feature)
+        started = time.perf_counter()
+        try:
+            if self.cancelled:
+                raise QueryCancelled()
+            self.result["status"] = "ok"
+            self.result.update(self.fn(self))
+        except QueryCancelled:
+            self.result["status"] = "cancelled"
+        except Exception as e:
+            self.result.update(status="failed", error=str(e))
+        finally:
+            for connection in self.connections:
+                try:
+                    connection.close()
+                except pymysql.Error:
+                    pass
+        seconds = time.perf_counter() - started
+        rows = self.result.setdefault("rows", self.rows)
+        self.result["seconds"] = seconds
+        self.result["bytes"] = sum(getattr(connection, "bytes_received", 0) for connection in self.connections)
+        self.result["rows_per_second"] = rows / seconds if seconds else None
+        message = f"{self.name}: {self.result['status']}, {rows} rows in {seconds:.1f} s"
+        if "error" in self.result:
+            message += f": {self.result['error']}"
+        self.log(message)
+        return self.result
+
+
+def table_names(args):
+    if args.tables:
+        return args.tables
+    connection = connect(args.host, args.user, args.password, args.database)
+    try:
+        return [row[0] for row in read_schema_tables(connection.cursor(), args.database) if row[5] == "BASE TABLE"]
+    finally:
+        connection.close()
+
+
+def count_tasks(args, log):
+    def count(table_name):
+        def run(task):
+            connection = task.connect(args.host, args.user, args.password, args.database)
+            return {"rows": count_rows(connection.cursor(), table_name)}
+        return run
+
+    return [Task(table_name, count(table_name), log) for table_name in table_names(args)]
+
+
+def export_tasks(args, log):
+    os.makedirs(args.output_dir, exist_ok=True)
+    extension = "." + args.format + (".gz" if args.gzip else "")
+
+    def export(table_name):
+        path = os.path.join(args.output_dir, table_name + extension)
+
+        def run(task):
+            sql, params = select_query(table_name)
+            rows = export_result(lambda: task.connect(args.host, args.user, args.password, args.database), sql,
+                                 params, path, args.chunk_size, task)
+            return {"rows": rows, "path": path, "file_bytes": os.path.getsize(path)}
+        return run
+
+    return [Task(table_name, export(table_name), log) for table_name in table_names(args)]
+
+
+def import_tasks(args, log):
+    schema_cache = SchemaCache()
+
+    def load(path, table_name):
+        def run(task):
+            connection = task.connect(args.host, args.user, args.password, args.database,
+                                      local_infile=args.load_data)
+            cursor = connection.cursor()
+            table_columns = list(schema_cache.get(cursor, table_name).columns)
+            if not table_columns:
+                raise ValueError(f"Table '{table_name}' does not exist.")
+            delimiter = args.delimiter or detect_delimiter(path)
+            file_columns = read_file_header(path, delimiter)
+            mapping = match_import_columns(file_columns, table_columns, not args.no_header)
+            if not mapping:
+                raise ValueError("No file columns match the table's columns.")
+            result = {"table": table_name, "columns": [column_name for _, column_name in mapping],
+                      "file_bytes": os.path.getsize(path)}
+            if args.load_data:
+                if not local_infile_enabled(cursor):
+                    raise ValueError("The server has local_infile turned off.")
+                result["rows"] = load_data_local_infile(connection, path, table_name, mapping, len(file_columns),
+                                                        delimiter, not args.no_header, args.start_row,
+                                                        not args.keep_empty)
+                return result
+            try:
+                result["rows"] = import_delimited_file(connection, path, table_name, mapping, delimiter,
+                                                       not args.no_header, args.start_row, args.batch_size,
+                                                       not args.keep_empty, task)
+            finally:
+                # Batches are committed one by one, so a failed import can be resumed with --start-row
+                result["committed_rows"] = max(task.rows, args.start_row)
+            return result
+        return run
+
+    tasks = []
+    for path in args.files:
+        table_name = args.table or os.path.basename(path).split(".")[0]
+        tasks.append(Task(path, load(path, table_name), log))
+    return tasks
+
+
+def diff_tasks(args, log):
+    schema_cache = SchemaCache()
+    target = (args.target_host or args.host, args.target_user or args.user,
+              args.password if args.target_password is None else args.target_password,
+              args.target_database or args.database)
+    if target == (args.host, args.user, args.password, args.database) and not args.target_table:
+        raise ValueError("Nothing to compare: give a --target-host, --target-database or --target-table.")
+
+    def compare(table_name):
+        target_table = args.target_table or table_name
+
+        def run(task):
+            columns, skipped, result = compare_tables(
+                schema_cache, lambda: task.connect(args.host, args.user, args.password, args.database),
+                lambda: task.connect(*target), args.database, table_name, target[3], target_table,
+                args.chunk_size, args.diff_workers, task)
+            # Every connection diff_tables opens comes from task.connect, so the task counts the bytes
+            del result["bytes"]
+            result["target"] = f"{target[0]}: {target[3]}.{target_table}"
+            result["columns"] = columns
+            result["skipped_columns"] = sorted(set(skipped))
+            result["status"] = "differs" if result["mismatched"] else "ok"
+            return result
+        return run
+
+    return [Task(table_name, compare(table_name), log) for table_name in args.tables]
+
+
+COMMANDS = {
+    "count": count_tasks,
+    "export": export_tasks,
+    "import": import_tasks,
+    "diff": diff_tasks,
+}
+
+
+def run(args):
+    lock = threading.Lock()
+
+    def log(message):
+        if not args.quiet:
+            with lock:
+                print(message, file=sys.stderr, flush=True)
+
+    started = time.time()
+    tasks = COMMANDS[args.command](args, log)
+    interrupted = False
+    with ThreadPoolExecutor(max(1, args.workers)) as pool:
+        futures = [pool.submit(task.run, args.command) for task in tasks]
+        try:
+            for future in as_completed(futures):
+                future.result()
+        except KeyboardInterrupt:
+            # Running tasks stop at their next batch or chunk, queued ones do not start
+            interrupted = True
+            log("Interrupted, stopping")
+            for task in tasks:
+                task.cancelled = True
+    seconds = time.time() - started
+    results = [task.result for task in tasks]
+    rows = sum(result.get("rows") or 0 for result in results)
+    received = sum(result.get("bytes", 0) for result in results)
+    summary = {
+        "command": args.command,
+        "host": args.host,
+        "database": args.database,
+        "workers": args.workers,
+        "started": started,
+        "seconds": seconds,
+        "interrupted": interrupted,
+        "rows": rows,
+        "bytes": received,
+        "rows_per_second": rows / seconds if seconds else None,
+        "statements": query_log.snapshot()["statements"],
+        "tasks": results,
+    }
+    if any(result["status"] in ("failed", "cancelled", "pending") for result in results):
+        status = EXIT_FAILED
+    elif any(result["status"] == "differs" for result in results):
+        status = EXIT_DIFFERENCES
+    else:
+        status = 0
+    return summary, status
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    try:
+        summary, status = run(args)
+    except (pymysql.Error, OSError, ValueError) as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return EXIT_FAILED
+    if args.summary == "-":
+        json.dump(summary, sys.stdout, indent=1, default=str)
+        print()
+    else:
+        with open(args.summary, "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=1, default=str)
+    return status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,75 @@
+import time
+
+import pymysql
+import pymysql.connections
+import pymysql.converters
+import pymysql.cursors
+import pymysql.protocol
+from pymysql.constants import FIELD_TYPE
+
+from engine import InstrumentedCursorMixin, query_log
+
+# The pymysql classes and conversions engine.py connects with. Importing pymysql takes longer than anything
+# else the window needs before it can show, so engine.py only imports this module once it opens a connection.
+
+
+class InstrumentedConnection(pymysql.connections.Connection):
+    # Counts the bytes read from the server so statements can be charged for what they fetched
+    bytes_received = 0
+
+    def _read_packet(self, packet_type=pymysql.protocol.MysqlPacket):
+        packet = super()._read_packet(packet_type)
+        self.bytes_received += len(packet.get_all_data())
+        return packet
+
+
+class InstrumentedCursor(InstrumentedCursorMixin, pymysql.cursors.Cursor):
+    pass
+
+
+class InstrumentedSSCursor(InstrumentedCursorMixin, pymysql.cursors.SSCursor):
+    # An unbuffered cursor returns from execute() before the rows arrive, so fetches are timed as well
+    counts_rows_on_execute = False
+    log_entry = None
+
+    def _charge(self, started, received, rows):
+        if self.log_entry is not None:
+            query_log.add_fetch(self.log_entry, time.perf_counter() - started, rows,
+                                getattr(self.connection, "bytes_received", 0) - received)
+
+    def fetchone(self):
+        received = getattr(self.connection, "bytes_received", 0)
+        started = time.perf_counter()
+        row = super().fetchone()
+        self._charge(started, received, int(row is not None))
+        return row
+
+    def fetchmany(self, size=None):
+        received = getattr(self.connection, "bytes_received", 0)
+        started = time.perf_counter()
+        rows = super().fetchmany(size)
+        self._charge(started, received, len(rows))
+        return rows
+
+
+# Encoders without any decoders: with use_unicode=False as well, pymysql hands every value over as the bytes the
+# server sent. The grid only needs text, so converting each cell to int, Decimal or datetime first is wasted work.
+RAW_CONVERSIONS = {key: value for key, value in pymysql.converters.conversions.items() if not isinstance(key, int)}
+
+
+def column_decoders(fields, encoding):
+    # The (text encoding, converter) pymysql would have used for each column of a result, to decode raw values
+    # later on
+    decoders = []
+    for field in fields:
+        if field.type_code == FIELD_TYPE.JSON:
+            text_encoding = encoding
+        elif field.type_code in pymysql.connections.TEXT_TYPES:
+            text_encoding = None if field.charsetnr == 63 else encoding
+        else:
+            text_encoding = "ascii"
+        converter = pymysql.converters.decoders.get(field.type_code)
+        if converter is pymysql.converters.through:
+            converter = None
+        decoders.append((text_encoding, converter))
+    return decoders
@@ -0,0 +1,1722 @@
+import collections
+import datetime
+import decimal
+import io
+import itertools
+import os
+import re
+import threading
+import time
+
+# Database operations shared by the browser window (main.py) and the command line (cli.py). Nothing in here
+# imports Qt: long running functions take an optional job with a cancelled flag and a report(rows, done, total)
+# method, which main.QueryJob provides for the window and cli.Task for the command line. pymysql is only
+# imported where it is used (see driver.py), so the window can show before it is loaded.
+
+
+def quote_ident(name):
+    return "`" + str(name).replace("`", "``") + "`"
+
+
+# Slowest statements kept for the query log, and how many recent statements are kept overall
+QUERY_LOG_SLOW_ENTRIES = 500
+QUERY_LOG_RECENT_ENTRIES = 2000
+SLOW_QUERY_THRESHOLD = 200
+
+SHAPE_PATTERNS = [
+    (re.compile(r"'(?:[^'\\]|\\.|'')*'"), "?"),
+    (re.compile(r"\b\d+(?:\.\d+)?\b|%s"), "?"),
+    (re.compile(r"\(\s*\?(?:\s*,\s*\?)*\s*\)"), "(?+)"),
+    (re.compile(r"\(\?\+\)(?:\s*,\s*\(\?\+\))+"), "(?+), ..."),
+    (re.compile(r"(?:WHEN \? THEN \? ?)+"), "WHEN ? THEN ? ... "),
+    (re.compile(r"\s+"), " "),
+]
+
+
+def statement_shape(sql):
+    # The statement with its literals, parameters and value lists folded away, so that e.g. every page query
+    # of a table counts as the same statement
+    shape = sql
+    for pattern, replacement in SHAPE_PATTERNS:
+        shape = pattern.sub(replacement, shape)
+    return shape.strip()
+
+
+class QueryLog:
+    # Records every statement run through an instrumented cursor: text, parameters, time, rows, bytes read
+    # off the wire and the feature that ran it. Written from the worker threads, read from the GUI thread.
+    def __init__(self, slow_threshold=SLOW_QUERY_THRESHOLD):
+        self.lock = threading.Lock()
+        self.local = threading.local()
+        self.slow_threshold = slow_threshold
+        self.recent = collections.deque(maxlen=QUERY_LOG_RECENT_ENTRIES)
+        self.slow = collections.deque(maxlen=QUERY_LOG_SLOW_ENTRIES)
+        self.shapes = {}
+        self.statements = 0
+
+    def feature(self):
+        return getattr(self.local, "feature", "other")
+
+    def set_feature(self, feature):
+        self.local.feature = feature
+
+    def record(self, sql, params, seconds, rows, received, error=None):
+        if isinstance(sql, bytes):
+            sql = sql.decode("utf-8", "replace")
+        entry = {
+            "time": time.time(),
+            "feature": self.feature(),
+            "shape": statement_shape(sql[:4000]),
+            "sql": sql[:1000],
+            "params": repr(params)[:500] if params is not None else None,
+            "seconds": seconds,
+            "rows": rows,
+            "bytes": received,
+            "error": str(error) if error is not None else None,
+        }
+        with self.lock:
+            self.statements += 1
+            self.recent.append(entry)
+            totals = self.shapes.get((entry["feature"], entry["shape"]))
+            if totals is None:
+                totals = self.shapes[(entry["feature"], entry["shape"])] = {
+                    "feature": entry["feature"], "shape": entry["shape"], "count": 0, "errors": 0, "seconds": 0.0,
+                    "max_seconds": 0.0, "rows": 0, "bytes": 0}
+            entry["totals"] = totals
+            totals["count"] += 1
+            totals["errors"] += error is not None
+            self._add(totals, seconds, rows, received)
+            self._update(entry)
+        return entry
+
+    def add_fetch(self, entry, seconds, rows, received):
+        # Rows read later from an unbuffered cursor still count towards the statement that produced them
+        with self.lock:
+            entry["seconds"] += seconds
+            entry["rows"] += rows
+            entry["bytes"] += received
+            self._add(entry["totals"], seconds, rows, received)
+            self._update(entry)
+
+    def _add(self, totals, seconds, rows, received):
+        totals["seconds"] += seconds
+        totals["rows"] += rows
+        totals["bytes"] += received
+
+    def _update(self, entry):
+        totals = entry["totals"]
+        totals["max_seconds"] = max(totals["max_seconds"], entry["seconds"])
+        if "slow" not in entry and entry["seconds"] * 1000 >= self.slow_threshold:
+            entry["slow"] = True
+            self.slow.append(entry)
+
+    def set_slow_threshold(self, milliseconds):
+        with self.lock:
+            self.slow_threshold = milliseconds
+
+    def snapshot(self):
+        with self.lock:
+            # Statements under an earlier, higher threshold may still be among the recent ones
+            slow = {id(entry): entry for entry in itertools.chain(self.slow, self.recent)
+                    if entry["seconds"] * 1000 >= self.slow_threshold}
+            slow = [self._public(entry) for entry in slow.values()]
+            shapes = [dict(totals) for totals in self.shapes.values()]
+            recent = [self._public(entry) for entry in self.recent]
+            return {"statements": self.statements, "slow_threshold_ms": self.slow_threshold, "shapes": shapes,
+                    "slow": slow, "recent": recent}
+
+    def _public(self, entry):
+        return {key: value for key, value in entry.items() if key not in ("totals", "slow")}
+
+    def clear(self):
+        with self.lock:
+            self.recent.clear()
+            self.slow.clear()
+            self.shapes.clear()
+            self.statements = 0
+
+    def export(self, path):
+        import json
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(dict(self.snapshot(), exported_at=time.time()), file, indent=1)
+
+
+query_log = QueryLog()
+
+
+class InstrumentedCursorMixin:
+    counts_rows_on_execute = True
+
+    def execute(self, query, args=None):
+        connection = self.connection
+        received = getattr(connection, "bytes_received", 0)
+        started = time.perf_counter()
+        try:
+            result = super().execute(query, args)
+        except Exception as e:
+            query_log.record(query, args, time.perf_counter() - started, 0,
+                             getattr(connection, "bytes_received", 0) - received, e)
+            raise
+        rows = max(self.rowcount, 0) if self.counts_rows_on_execute else 0
+        self.log_entry = query_log.record(query, args, time.perf_counter() - started, rows,
+                                          getattr(connection, "bytes_received", 0) - received)
+        return result
+
+
+class QueryCancelled(Exception):
+    pass
+
+
+def connect(host, user, password, db, raw=False, **options):
+    # Autocommit keeps every read current; statements that change data open their own transaction. raw leaves
+    # values as the bytes the server sent (see driver.RAW_CONVERSIONS).
+    import driver
+    if raw:
+        options.update(use_unicode=False, conv=driver.RAW_CONVERSIONS)
+    connection = driver.InstrumentedConnection(host=host, user=user, password=password, db=db, autocommit=True,
+                                               cursorclass=driver.InstrumentedCursor, **options)
+    prepare_session(connection)
+    return connection
+
+
+def prepare_session(connection):
+    import pymysql
+    try:
+        # MySQL 8 caches information_schema.TABLES statistics for a day by default
+        connection.cursor().execute("SET SESSION information_schema_stats_expiry = 0")
+    except pymysql.Error:
+        pass
+
+
+def key_in_clause(key_columns, keys):
+    # "key IN (...)" over one or more key columns, with its parameters
+    if len(key_columns) == 1:
+        return f"{quote_ident(key_columns[0])} IN ({', '.join(['%s'] * len(keys))})", [key[0] for key in keys]
+    row_placeholder = "(" + ", ".join(["%s"] * len(key_columns)) + ")"
+    key_sql = ", ".join(quote_ident(key) for key in key_columns)
+    return f"({key_sql}) IN ({', '.join([row_placeholder] * len(keys))})", [value for key in keys for value in key]
+
+
+def key_case(key_columns, column_name, items):
+    # CASE expression that picks a new value for each key in items and keeps the column as is for any other row
+    params = []
+    if len(key_columns) == 1:
+        sql = f"CASE {quote_ident(key_columns[0])}"
+        for key, value in items:
+            sql += " WHEN %s THEN %s"
+            params.extend([key[0], value])
+    else:
+        sql = "CASE"
+        condition = " AND ".join(f"{quote_ident(key)} = %s" for key in key_columns)
+        for key, value in items:
+            sql += f" WHEN {condition} THEN %s"
+            params.extend(list(key) + [value])
+    sql += f" ELSE {quote_ident(column_name)} END"
+    return sql, params
+
+
+def flush_pending_changes(connection, changes, batch_size, job=None):
+    # Writes a set of staged edits in a single transaction, batch_size rows per statement
+    table_sql = quote_ident(changes["table_name"])
+    key_columns = changes["key_columns"]
+    cursor = connection.cursor()
+    done = 0
+    connection.begin()
+    try:
+        deletes = changes["deletes"]
+        for start in range(0, len(deletes), batch_size):
+            chunk = deletes[start:start + batch_size]
+            condition, params = key_in_clause(key_columns, chunk)
+            cursor.execute(f"DELETE FROM {table_sql} WHERE {condition}", params)
+            done += len(chunk)
+            if job is not None:
+                job.report(done)
+
+        # MySQL assigns SET columns left to right, so a key changed inside the batched UPDATE would change the key
+        # the CASE expressions after it match on. Key edits are written row by row once the other columns are.
+        updates = []
+        key_updates = []
+        for key, edits in changes["updates"].items():
+            other_edits = {column_name: value for column_name, value in edits.items()
+                           if column_name not in key_columns}
+            if other_edits:
+                updates.append((key, other_edits))
+            key_edits = {column_name: value for column_name, value in edits.items() if column_name in key_columns}
+            if key_edits:
+                key_updates.append((key, key_edits))
+        for start in range(0, len(updates), batch_size):
+            chunk = updates[start:start + batch_size]
+            column_names = []
+            for _, edits in chunk:
+                column_names.extend(column_name for column_name in edits if column_name not in column_names)
+            assignments = []
+            params = []
+            for column_name in column_names:
+                items = [(key, edits[column_name]) for key, edits in chunk if column_name in edits]
+                case_sql, case_params = key_case(key_columns, column_name, items)
+                assignments.append(f"{quote_ident(column_name)} = {case_sql}")
+                params.extend(case_params)
+            condition, condition_params = key_in_clause(key_columns, [key for key, _ in chunk])
+            cursor.execute(f"UPDATE {table_sql} SET {', '.join(assignments)} WHERE {condition}",
+                           params + condition_params)
+            done += len(chunk)
+            if job is not None:
+                job.report(done)
+
+        for key, edits in key_updates:
+            assignments = ", ".join(f"{quote_ident(column_name)} = %s" for column_name in edits)
+            condition, condition_params = key_in_clause(key_columns, [key])
+            cursor.execute(f"UPDATE {table_sql} SET {assignments} WHERE {condition}",
+                           list(edits.values()) + condition_params)
+            if len(edits) == len(changes["updates"][key]):
+                # Not counted with the batches above
+                done += 1
+            if job is not None:
+                job.report(done)
+
+        inserts = changes["inserts"]
+        if inserts:
+            column_sql = ", ".join(quote_ident(column_name) for column_name in changes["columns"])
+            placeholders = ", ".join(["%s"] * len(changes["columns"]))
+            sql = f"INSERT INTO {table_sql} ({column_sql}) VALUES ({placeholders})"
+            for start in range(0, len(inserts), batch_size):
+                chunk = inserts[start:start + batch_size]
+                # pymysql folds executemany on INSERT ... VALUES into multi-row statements
+                cursor.executemany(sql, chunk)
+                done += len(chunk)
+                if job is not None:
+                    job.report(done)
+        connection.commit()
+    except Exception:
+        connection.rollback()
+        raise
+    return done
+
+
+# Rows per page in paged browsing mode
+PAGE_SIZE = 500
+
+
+FILTER_OPERATORS = ["=", "!=", "<", "<=", ">", ">=", "LIKE", "NOT LIKE", "IS NULL", "IS NOT NULL"]
+
+
+def filter_clause(filters):
+    # filters is a list of (column, operator, value); returns the WHERE condition and its parameters
+    conditions = []
+    params = []
+    for column_name, operator, value in filters:
+        if operator not in FILTER_OPERATORS:
+            raise ValueError(f"Unknown filter operator: {operator}")
+        if operator in ("IS NULL", "IS NOT NULL"):
+            conditions.append(f"{quote_ident(column_name)} {operator}")
+        else:
+            conditions.append(f"{quote_ident(column_name)} {operator} %s")
+            params.append(value)
+    return " AND ".join(conditions), params
+
+
+def select_query(table_name, where_sql="", where_params=(), order_columns=(), descending=False, limit=None):
+    sql = f"SELECT * FROM {quote_ident(table_name)}"
+    if where_sql:
+        sql += f" WHERE {where_sql}"
+    if order_columns:
+        direction = " DESC" if descending else ""
+        sql += " ORDER BY " + ", ".join(f"{quote_ident(column_name)}{direction}" for column_name in order_columns)
+    if limit is not None:
+        sql += f" LIMIT {int(limit)}"
+    return sql, list(where_params)
+
+
+def continuation_query(table_name, key_columns, last_key, where_sql="", where_params=()):
+    # The rest of a key-ordered result after the row with last_key
+    if len(key_columns) == 1:
+        seek_sql = f"{quote_ident(key_columns[0])} > %s"
+    else:
+        seek_sql = f"({', '.join(quote_ident(key) for key in key_columns)}) > " \
+                   f"({', '.join(['%s'] * len(key_columns))})"
+    if where_sql:
+        seek_sql = f"({where_sql}) AND {seek_sql}"
+    return select_query(table_name, seek_sql, list(where_params) + list(last_key), key_columns)
+
+
+def seek_condition(columns, values, greater, inclusive, nullable_columns=()):
+    # "(columns) > (values)" (or <, or with equality when inclusive) in the order MySQL sorts rows, where NULL
+    # comes before any value. A row comparison is never true for NULLs, so columns that may hold them are
+    # compared one by one. Returns None when no row can match.
+    if not any(column_name in nullable_columns for column_name in columns):
+        column_sql = ", ".join(quote_ident(column_name) for column_name in columns)
+        comparison = (">" if greater else "<") + ("=" if inclusive else "")
+        return f"({column_sql}) {comparison} ({', '.join(['%s'] * len(columns))})", list(values)
+    column_sql = quote_ident(columns[0])
+    value = values[0]
+    if value is None:
+        # Only values come after NULL, and nothing before it
+        strict_sql, strict_params = (f"{column_sql} IS NOT NULL", []) if greater else (None, [])
+        tie_sql, tie_params = f"{column_sql} IS NULL", []
+    else:
+        strict_sql = f"{column_sql} > %s" if greater else f"{column_sql} < %s"
+        if not greater and columns[0] in nullable_columns:
+            strict_sql = f"({column_sql} IS NULL OR {strict_sql})"
+        strict_params = [value]
+        tie_sql, tie_params = f"{column_sql} = %s", [value]
+    if len(columns) == 1:
+        rest_sql, rest_params = ("1", []) if inclusive else (None, [])
+    else:
+        rest_sql, rest_params = seek_condition(columns[1:], values[1:], greater, inclusive, nullable_columns)
+    conditions = []
+    params = []
+    if strict_sql is not None:
+        conditions.append(strict_sql)
+        params += strict_params
+    if rest_sql is not None:
+        conditions.append(f"({tie_sql} AND {rest_sql})")
+        params += tie_params + rest_params
+    if not conditions:
+        return None, []
+    return f"({' OR '.join(conditions)})", params
+
+
+def keyset_page_query(table_name, order_columns, page_size, direction, boundary=None, descending=False,
+                      where_sql="", where_params=(), nullable_columns=()):
+    # Seek pagination: pages start from the last row seen instead of an OFFSET, so a page deep into a big table
+    # costs the same as the first one. order_columns must identify a row, i.e. end with the primary key.
+    # One row more than the page is asked for to tell whether another page follows.
+    # direction is one of first, next, prev, last or seek; next and prev continue from the boundary values
+    # and seek starts at them. Pages always come back in display order.
+    # nullable_columns names the order columns that may hold NULLs; they get seek conditions that place NULL
+    # first in ascending order and last in descending order, as MySQL sorts them.
+    table_sql = quote_ident(table_name)
+    forward = "DESC" if descending else "ASC"
+    backward = "ASC" if descending else "DESC"
+    limit = int(page_size) + 1
+
+    conditions = [where_sql] if where_sql else []
+    params = list(where_params)
+    if direction in ("next", "seek", "prev"):
+        greater = descending == (direction == "prev")
+        seek_sql, seek_params = seek_condition(list(order_columns), list(boundary), greater, direction == "seek",
+                                               nullable_columns)
+        conditions.append(seek_sql or "0")
+        params.extend(seek_params)
+    where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+
+    if direction in ("first", "next", "seek"):
+        order = ", ".join(f"{quote_ident(column_name)} {forward}" for column_name in order_columns)
+        return f"SELECT * FROM {table_sql}{where} ORDER BY {order} LIMIT {limit}", params
+
+    inner_order = ", ".join(f"{quote_ident(column_name)} {backward}" for column_name in order_columns)
+    outer_order = ", ".join(f"page.{quote_ident(column_name)} {forward}" for column_name in order_columns)
+    inner = f"SELECT * FROM {table_sql}{where} ORDER BY {inner_order} LIMIT {limit}"
+    return f"SELECT * FROM ({inner}) AS page ORDER BY {outer_order}", params
+
+
+def index_for_column(schema, column_name, equality_columns=()):
+    # Name of an index MySQL can use to find or order rows by column_name, given equality filters on
+    # equality_columns, or None when it has to scan
+    for index_name, columns in schema.indexes.items():
+        for indexed_column in columns:
+            if indexed_column == column_name:
+                return index_name
+            if indexed_column not in equality_columns:
+                break
+    return None
+
+
+def decode_value(value, decoder):
+    # Raw bytes to the Python value pymysql would have made; values that are not raw pass through
+    if type(value) is not bytes or decoder is None:
+        return value
+    text_encoding, converter = decoder
+    if text_encoding is not None:
+        value = value.decode(text_encoding)
+    return converter(value) if converter is not None else value
+
+
+class ResultStream:
+    # One unbuffered result set on a connection of its own. Only ever used from executor threads; the lock
+    # keeps a close from racing a fetch that is still reading.
+    def __init__(self, connect, sql, params=None, setup=(), decode_columns=()):
+        # setup statements run first on the same connection, e.g. the earlier statements of a console script.
+        # On a raw connection (see connect) the decode_columns are decoded as they are fetched, since
+        # rows are looked up by them; the rest stay bytes and decoders says how to decode them.
+        self.connect = connect
+        self.sql = sql
+        self.params = params
+        self.setup = setup
+        self.decode_columns = decode_columns
+        self.decoders = None
+        self.eager_decoders = []
+        self.affected_rows = None
+        self.lock = threading.Lock()
+        self.connection = None
+        self.cursor = None
+        self.columns = []
+        self.exhausted = False
+        self.closed = False
+
+    def open(self, job=None):
+        from driver import InstrumentedSSCursor, column_decoders
+        with self.lock:
+            if self.closed:
+                raise QueryCancelled()
+            self.connection = self.connect()
+            if job is not None:
+                job.connection_id = self.connection.thread_id()
+            self.cursor = self.connection.cursor(InstrumentedSSCursor)
+            for statement in self.setup:
+                self.cursor.execute(statement)
+                self.cursor.fetchall()
+            self.cursor.execute(self.sql, self.params)
+            if self.cursor.description is None:
+                self.affected_rows = self.cursor.rowcount
+                self.exhausted = True
+                self._close()
+                return []
+            self.columns = [desc[0] for desc in self.cursor.description]
+            fields = getattr(self.cursor._result, "fields", None) if hasattr(self.cursor, "_result") else None
+            if fields is not None and not self.connection.use_unicode:
+                self.decoders = column_decoders(fields, self.connection.encoding)
+                self.eager_decoders = [(i, self.decoders[i]) for i, column_name in enumerate(self.columns)
+                                       if column_name in self.decode_columns]
+            return self.columns
+
+    def fetch(self, count, job=None):
+        with self.lock:
+            if self.closed or self.exhausted:
+                return []
+            if job is not None:
+                job.connection_id = self.connection.thread_id()
+            rows = self.cursor.fetchmany(count)
+            if len(rows) < count:
+                self.exhausted = True
+                self._close()
+            if job is not None:
+                job.report(len(rows))
+            if self.eager_decoders:
+                eager_decoders = self.eager_decoders
+                decoded = []
+                for row in rows:
+                    row = list(row)
+                    for i, decoder in eager_decoders:
+                        row[i] = decode_value(row[i], decoder)
+                    decoded.append(tuple(row))
+                return decoded
+            return list(rows)
+
+    def close(self):
+        with self.lock:
+            self._close()
+
+    def _close(self):
+        # Closing an unbuffered cursor would read every remaining row off the wire, so the connection is
+        # dropped instead
+        import pymysql
+        self.closed = True
+        if self.connection is not None:
+            try:
+                self.connection.close()
+            except pymysql.Error:
+                pass
+            self.connection = None
+
+
+# Seconds a cached table definition is trusted for. DDL made through this app invalidates the cache right away,
+# the TTL only covers changes made by other clients.
+SCHEMA_CACHE_TTL = 300
+
+
+class TableSchema:
+    def __init__(self, table_name):
+        self.table_name = table_name
+        self.columns = []
+        self.column_types = {}
+        self.nullable = {}
+        self.collations = {}
+        self.primary_key = []
+        self.indexes = {}
+        self.unique_indexes = set()
+        self.loaded_at = time.monotonic()
+
+
+class SchemaCache:
+    # Column and index definitions per table, read from information_schema in one round trip. Shared between
+    # worker threads, hence the lock.
+    def __init__(self, ttl=SCHEMA_CACHE_TTL):
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.tables = {}
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, cursor, table_name):
+        with self.lock:
+            schema = self.tables.get(table_name)
+            if schema is not None and time.monotonic() - schema.loaded_at < self.ttl:
+                self.hits += 1
+                return schema
+            self.misses += 1
+        schema = self.load(cursor, table_name)
+        if schema.columns:
+            with self.lock:
+                self.tables[table_name] = schema
+        return schema
+
+    def load(self, cursor, table_name, schema_name=None):
+        # schema_name reads a table of some other database than the connection's, without caching it
+        schema_sql = "DATABASE()" if schema_name is None else "%s"
+        schema_params = () if schema_name is None else (schema_name,)
+        cursor.execute(f"SELECT 'C', COLUMN_NAME, ORDINAL_POSITION, COLUMN_TYPE, IS_NULLABLE, COLLATION_NAME "
+                       f"FROM information_schema.COLUMNS WHERE TABLE_SCHEMA = {schema_sql} AND TABLE_NAME = %s "
+                       f"UNION ALL "
+                       f"SELECT 'I', COLUMN_NAME, SEQ_IN_INDEX, INDEX_NAME, NON_UNIQUE, NULL "
+                       f"FROM information_schema.STATISTICS WHERE TABLE_SCHEMA = {schema_sql} AND TABLE_NAME = %s",
+                       schema_params + (table_name,) + schema_params + (table_name,))
+        schema = TableSchema(table_name)
+        columns = []
+        index_columns = {}
+        for kind, column_name, position, detail, flag, collation in cursor.fetchall():
+            if kind == 'C':
+                columns.append((position, column_name))
+                schema.column_types[column_name] = detail
+                schema.nullable[column_name] = flag == 'YES'
+                if collation is not None:
+                    schema.collations[column_name] = collation
+            else:
+                index_columns.setdefault(detail, []).append((position, column_name))
+                if str(flag) == '0':
+                    schema.unique_indexes.add(detail)
+        schema.columns = [column_name for _, column_name in sorted(columns)]
+        for index_name, parts in index_columns.items():
+            schema.indexes[index_name] = [column_name for _, column_name in sorted(parts)]
+        schema.primary_key = schema.indexes.get('PRIMARY', [])
+        return schema
+
+    def peek(self, table_name):
+        # Cached schema without going to the server, or None
+        with self.lock:
+            return self.tables.get(table_name)
+
+    def invalidate(self, *table_names):
+        # No names drops everything
+        with self.lock:
+            if not table_names:
+                self.tables.clear()
+            for table_name in table_names:
+                self.tables.pop(table_name, None)
+
+    def stats_text(self):
+        return f"Schema cache: {self.hits} hits, {self.misses} misses"
+
+
+# Server errors for an ALGORITHM or LOCK clause that cannot be used for the statement, or is not known at all
+DDL_UNSUPPORTED_ERRORS = {1800, 1845, 1846}
+
+# How often a running schema change is asked for its progress, in milliseconds
+DDL_PROGRESS_INTERVAL = 1000
+
+
+class CopyRebuildRequired(Exception):
+    pass
+
+
+def online_ddl(cursor, sql, allow_copy=False):
+    # Runs ALTER TABLE the least blocking way the server can: INSTANT, then INPLACE with LOCK=NONE. A change
+    # that can only be made by copying the table blocks writes until it is done, so it is only run with
+    # allow_copy. Returns the algorithm used, or None for statements that are not an ALTER TABLE.
+    import pymysql
+    if not re.match(r"\s*ALTER\s+TABLE\b", sql, re.IGNORECASE):
+        cursor.execute(sql)
+        return None
+    reason = None
+    for algorithm, clauses in (("INSTANT", ", ALGORITHM=INSTANT"), ("INPLACE", ", ALGORITHM=INPLACE, LOCK=NONE")):
+        try:
+            cursor.execute(sql + clauses)
+            return algorithm
+        except pymysql.MySQLError as e:
+            if not e.args or e.args[0] not in DDL_UNSUPPORTED_ERRORS:
+                raise
+            reason = e.args[1] if len(e.args) > 1 else str(e)
+    if not allow_copy:
+        raise CopyRebuildRequired(reason)
+    cursor.execute(sql + ", ALGORITHM=COPY")
+    return "COPY"
+
+
+def read_ddl_progress(cursor, connection_id):
+    # The stage a connection's statement is in, with how much of it is done, from performance_schema. Needs the
+    # stage/innodb/alter% instruments and the events_stages_current consumer to be enabled on the server.
+    cursor.execute("SELECT s.EVENT_NAME, s.WORK_COMPLETED, s.WORK_ESTIMATED "
+                   "FROM performance_schema.events_stages_current s "
+                   "JOIN performance_schema.threads t ON t.THREAD_ID = s.THREAD_ID "
+                   "WHERE t.PROCESSLIST_ID = %s", (connection_id,))
+    return cursor.fetchone()
+
+
+def read_schema_tables(cursor, schema_name):
+    # Estimated rows, data and index size and engine of every table in a schema, in one query. Browsing
+    # connections turn MySQL 8's statistics cache off, which would make this query open every table, so the
+    # default is put back while it runs.
+    import pymysql
+    try:
+        cursor.execute("SET SESSION information_schema_stats_expiry = DEFAULT")
+        reset = True
+    except pymysql.Error:
+        reset = False
+    try:
+        cursor.execute("SELECT TABLE_NAME, TABLE_ROWS, DATA_LENGTH, INDEX_LENGTH, ENGINE, TABLE_TYPE "
+                       "FROM information_schema.TABLES WHERE TABLE_SCHEMA = %s ORDER BY TABLE_NAME", (schema_name,))
+        return list(cursor.fetchall())
+    finally:
+        if reset:
+            cursor.execute("SET SESSION information_schema_stats_expiry = 0")
+
+
+def count_rows(cursor, table_name, where_sql="", where_params=()):
+    # Exact row count, which reads the whole table or index; read_schema_tables has the cheap estimates
+    sql = f"SELECT COUNT(*) FROM {quote_ident(table_name)}"
+    if where_sql:
+        sql += f" WHERE {where_sql}"
+    cursor.execute(sql, list(where_params))
+    return cursor.fetchone()[0]
+
+
+# Rows per INSERT batch, and per transaction, when importing files
+IMPORT_BATCH_SIZE = 5000
+
+
+# csv, gzip and json are only needed by imports and exports, so they are imported when first used to keep
+# startup short
+
+
+def detect_delimiter(path, sample_size=65536):
+    import csv
+    if path.lower().endswith((".tsv", ".tab")):
+        return "\t"
+    with open(path, newline="", encoding="utf-8-sig", errors="replace") as file:
+        sample = file.read(sample_size)
+    try:
+        return csv.Sniffer().sniff(sample, delimiters=",\t;|").delimiter
+    except csv.Error:
+        return ","
+
+
+def read_file_header(path, delimiter):
+    import csv
+    with open(path, newline="", encoding="utf-8-sig", errors="replace") as file:
+        return next(csv.reader(file, delimiter=delimiter), [])
+
+
+def match_import_columns(file_columns, table_columns, has_header):
+    # Default mapping of file columns to table columns: headers by name, ignoring case, or files without one
+    # by position. Returns (file column index, table column name) pairs like import_delimited_file takes.
+    lookup = {column_name.lower(): column_name for column_name in table_columns}
+    mapping = []
+    for index, file_column in enumerate(file_columns):
+        if has_header:
+            match = lookup.get(file_column.strip().lower())
+        else:
+            match = table_columns[index] if index < len(table_columns) else None
+        if match is not None:
+            mapping.append((index, match))
+    return mapping
+
+
+def local_infile_enabled(cursor):
+    cursor.execute("SHOW VARIABLES LIKE 'local_infile'")
+    variable = cursor.fetchone()
+    return variable is not None and str(variable[1]).upper() in ("ON", "1")
+
+
+def import_delimited_file(connection, path, table_name, mapping, delimiter=",", has_header=True, start_row=0,
+                          batch_size=IMPORT_BATCH_SIZE, empty_as_null=True, job=None):
+    # Streams a CSV/TSV file into a table. mapping is a list of (file column index, table column name).
+    # Only one batch is held in memory and every batch is committed on its own, so after a failure
+    # job.rows says which data row to resume from. Returns the number of rows written.
+    import csv
+    column_sql = ", ".join(quote_ident(column_name) for _, column_name in mapping)
+    placeholders = ", ".join(["%s"] * len(mapping))
+    sql = f"INSERT INTO {quote_ident(table_name)} ({column_sql}) VALUES ({placeholders})"
+    total = os.path.getsize(path)
+    committed = start_row
+    cursor = connection.cursor()
+
+    def write(batch):
+        connection.begin()
+        try:
+            # pymysql folds executemany on INSERT ... VALUES into multi-row statements
+            cursor.executemany(sql, batch)
+            connection.commit()
+        except Exception:
+            connection.rollback()
+            raise
+
+    with open(path, "rb") as raw:
+        text = io.TextIOWrapper(raw, encoding="utf-8-sig", newline="")
+        reader = csv.reader(text, delimiter=delimiter)
+        if has_header:
+            next(reader, None)
+        for _ in itertools.islice(reader, start_row):
+            pass
+        batch = []
+        for record in reader:
+            values = []
+            for index, _ in mapping:
+                value = record[index] if index < len(record) else None
+                values.append(None if empty_as_null and value == "" else value)
+            batch.append(values)
+            if len(batch) >= batch_size:
+                if job is not None and job.cancelled:
+                    raise QueryCancelled()
+                write(batch)
+                committed += len(batch)
+                batch = []
+                if job is not None:
+                    job.report(committed, raw.tell(), total)
+        if batch:
+            write(batch)
+            committed += len(batch)
+        if job is not None:
+            job.report(committed, total, total)
+    return committed - start_row
+
+
+def load_data_local_infile(connection, path, table_name, mapping, file_column_count, delimiter=",",
+                           has_header=True, start_row=0, empty_as_null=True):
+    # Lets the server parse the file itself, which is much faster than INSERTs but needs local_infile enabled
+    # on both ends and runs as one statement, so there is no progress and no resume point
+    targets = {index: column_name for index, column_name in mapping}
+    variables = []
+    assignments = []
+    for index in range(file_column_count):
+        column_name = targets.get(index)
+        if column_name is None:
+            variables.append(f"@skip{index}")
+        elif empty_as_null:
+            variables.append(f"@value{index}")
+            assignments.append(f"{quote_ident(column_name)} = NULLIF(@value{index}, '')")
+        else:
+            variables.append(quote_ident(column_name))
+    with open(path, "rb") as file:
+        line_end = "\r\n" if b"\r\n" in file.read(65536) else "\n"
+    sql = f"LOAD DATA LOCAL INFILE %s INTO TABLE {quote_ident(table_name)} CHARACTER SET utf8mb4 " \
+          f"FIELDS TERMINATED BY %s OPTIONALLY ENCLOSED BY '\"' ESCAPED BY '' LINES TERMINATED BY %s " \
+          f"IGNORE {int(start_row) + (1 if has_header else 0)} LINES ({', '.join(variables)})"
+    if assignments:
+        sql += " SET " + ", ".join(assignments)
+    cursor = connection.cursor()
+    cursor.execute(sql, (path, delimiter, line_end))
+    connection.commit()
+    return cursor.rowcount
+
+
+# Rows fetched from the server and written out per chunk when exporting
+EXPORT_CHUNK_SIZE = 5000
+
+
+def export_format(path):
+    name = path.lower()
+    if name.endswith(".gz"):
+        name = name[:-3]
+    if name.endswith(".jsonl") or name.endswith(".json"):
+        return "jsonl"
+    if name.endswith(".tsv") or name.endswith(".tab"):
+        return "tsv"
+    return "csv"
+
+
+def export_value(value):
+    if isinstance(value, (bytes, bytearray)):
+        try:
+            return bytes(value).decode("utf-8")
+        except UnicodeDecodeError:
+            return "0x" + bytes(value).hex()
+    if isinstance(value, (datetime.date, datetime.time, datetime.timedelta, decimal.Decimal)):
+        return str(value)
+    return value
+
+
+def export_result(connect, sql, params, path, chunk_size=EXPORT_CHUNK_SIZE, job=None):
+    # Streams a query result to a CSV, TSV or JSON Lines file, gzipped when the name ends in .gz. Rows come off
+    # an unbuffered cursor one chunk at a time and go straight to the file, so memory use does not depend on
+    # the size of the result. The file is written under a temporary name and only renamed into place once
+    # complete. Returns the number of rows written.
+    import csv
+    import gzip
+    import json
+    file_format = export_format(path)
+    partial_path = path + ".part"
+    stream = ResultStream(connect, sql, params)
+    written = 0
+    try:
+        columns = stream.open(job)
+        if path.lower().endswith(".gz"):
+            file = gzip.open(partial_path, "wt", encoding="utf-8", newline="")
+        else:
+            file = open(partial_path, "w", encoding="utf-8", newline="")
+        with file:
+            if file_format == "jsonl":
+                writer = None
+            else:
+                writer = csv.writer(file, delimiter="\t" if file_format == "tsv" else ",")
+                writer.writerow(columns)
+            while True:
+                if job is not None and job.cancelled:
+                    raise QueryCancelled()
+                rows = stream.fetch(chunk_size)
+                if not rows:
+                    break
+                if writer is not None:
+                    writer.writerows([export_value(value) for value in row] for row in rows)
+                else:
+                    file.writelines(json.dumps(dict(zip(columns, map(export_value, row))), ensure_ascii=False,
+                                               default=str) + "\n" for row in rows)
+                written += len(rows)
+                if job is not None:
+                    job.report(written)
+        os.replace(partial_path, path)
+    except BaseException:
+        stream.close()
+        try:
+            os.remove(partial_path)
+        except OSError:
+            pass
+        raise
+    return written
+
+
+# Rows per chunk whose checksums are compared first, chunks small enough to be compared row by row, connections
+# per side, and how many differing rows are listed at most
+DIFF_CHUNK_SIZE = 10000
+DIFF_LEAF_SIZE = 1000
+DIFF_WORKERS = 4
+DIFF_ROW_LIMIT = 1000
+
+
+def table_ref(schema_name, table_name):
+    return f"{quote_ident(schema_name)}.{quote_ident(table_name)}"
+
+
+def key_range_clause(key_columns, lower, upper):
+    # "lower < key <= upper" for one chunk; None leaves that end open
+    if len(key_columns) == 1:
+        key_sql = quote_ident(key_columns[0])
+        placeholders = "%s"
+    else:
+        key_sql = f"({', '.join(quote_ident(key) for key in key_columns)})"
+        placeholders = f"({', '.join(['%s'] * len(key_columns))})"
+    clauses = []
+    params = []
+    if lower is not None:
+        clauses.append(f"{key_sql} > {placeholders}")
+        params += list(lower)
+    if upper is not None:
+        clauses.append(f"{key_sql} <= {placeholders}")
+        params += list(upper)
+    return " AND ".join(clauses) or "1", params
+
+
+def chunk_boundaries(cursor, table_sql, key_columns, chunk_size, lower=None, upper=None):
+    # Keys that end each chunk of chunk_size rows between lower and upper, found by walking the primary key
+    key_list = ", ".join(quote_ident(key) for key in key_columns)
+    while True:
+        where_sql, params = key_range_clause(key_columns, lower, upper)
+        cursor.execute(f"SELECT {key_list} FROM {table_sql} WHERE {where_sql} ORDER BY {key_list} "
+                       f"LIMIT 1 OFFSET {int(chunk_size) - 1}", params)
+        row = cursor.fetchone()
+        if row is None:
+            return
+        lower = tuple(row)
+        yield lower
+
+
+def chunk_checksum(cursor, table_sql, columns, key_columns, lower, upper):
+    # Row count and XOR of the row hashes of one chunk, computed on the server. CONCAT_WS skips NULLs, so
+    # ISNULL() of every column goes into the hash too.
+    row_sql = ", ".join([quote_ident(column) for column in columns] +
+                        [f"ISNULL({quote_ident(column)})" for column in columns])
+    where_sql, params = key_range_clause(key_columns, lower, upper)
+    cursor.execute(f"SELECT COUNT(*), COALESCE(BIT_XOR(CRC32(CONCAT_WS('#', {row_sql}))), 0) "
+                   f"FROM {table_sql} WHERE {where_sql}", params)
+    count, checksum = cursor.fetchone()
+    return count, int(checksum)
+
+
+def chunk_rows(cursor, table_sql, columns, key_columns, lower, upper):
+    where_sql, params = key_range_clause(key_columns, lower, upper)
+    cursor.execute(f"SELECT {', '.join(quote_ident(column) for column in columns)} FROM {table_sql} "
+                   f"WHERE {where_sql}", params)
+    key_indexes = [columns.index(key) for key in key_columns]
+    return {tuple(row[i] for i in key_indexes): tuple(row) for row in cursor.fetchall()}
+
+
+def diff_chunk(source, target, columns, key_columns, lower, upper, chunk_size, found, row_limit):
+    # source and target are (cursor, table). Chunks with equal checksums are done; others are split into
+    # smaller chunks until they are small enough to fetch and compare row by row. Returns the source row
+    # count, whether the chunk differed and how many differing rows were left out of found for row_limit.
+    source_count, source_checksum = chunk_checksum(source[0], source[1], columns, key_columns, lower, upper)
+    target_count, target_checksum = chunk_checksum(target[0], target[1], columns, key_columns, lower, upper)
+    if (source_count, source_checksum) == (target_count, target_checksum):
+        return source_count, False, 0
+    if max(source_count, target_count) > DIFF_LEAF_SIZE:
+        # Split along the side with more rows in this range, so a range that is sparse in the source but dense
+        # in the target still ends up in chunks small enough to fetch
+        dense = target if target_count > source_count else source
+        sub_size = max(DIFF_LEAF_SIZE, min(chunk_size, max(source_count, target_count)) // 10)
+        sub_lower = lower
+        left_out = 0
+        for boundary in list(chunk_boundaries(dense[0], dense[1], key_columns, sub_size, lower, upper)) + [upper]:
+            left_out += diff_chunk(source, target, columns, key_columns, sub_lower, boundary, sub_size, found,
+                                   row_limit)[2]
+            sub_lower = boundary
+        return source_count, True, left_out
+    source_rows = chunk_rows(source[0], source[1], columns, key_columns, lower, upper)
+    target_rows = chunk_rows(target[0], target[1], columns, key_columns, lower, upper)
+    left_out = 0
+    for key in sorted(source_rows.keys() | target_rows.keys(), key=lambda key: [str(part) for part in key]):
+        source_row = source_rows.get(key)
+        target_row = target_rows.get(key)
+        if source_row == target_row:
+            continue
+        if len(found) >= row_limit:
+            left_out += 1
+            continue
+        if target_row is None:
+            kind = "missing"
+        elif source_row is None:
+            kind = "extra"
+        else:
+            kind = "changed"
+        found.append({"kind": kind, "key": key, "source": source_row, "target": target_row})
+    return source_count, True, left_out
+
+
+def diff_tables(connect_source, connect_target, source_table, target_table, columns, key_columns,
+                chunk_size=DIFF_CHUNK_SIZE, workers=DIFF_WORKERS, row_limit=DIFF_ROW_LIMIT, job=None):
+    # Compares two tables chunk by chunk over primary key ranges of the source. Every worker thread has a
+    # connection to each side; only the checksums of matching chunks cross the wire. The tables are given as
+    # SQL (see table_ref) and columns are the ones both tables have.
+    from concurrent.futures import ThreadPoolExecutor
+    import pymysql
+    local = threading.local()
+    lock = threading.Lock()
+    opened = []
+
+    def compare(lower, upper):
+        if job is not None and job.cancelled:
+            raise QueryCancelled()
+        if not hasattr(local, "source"):
+            local.source = connect_source()
+            local.target = connect_target()
+            with lock:
+                opened.extend([local.source, local.target])
+        found = []
+        rows, differed, left_out = diff_chunk((local.source.cursor(), source_table),
+                                              (local.target.cursor(), target_table), columns, key_columns, lower,
+                                              upper, chunk_size, found, row_limit)
+        return rows, differed, found, left_out
+
+    result = {"chunks": 0, "mismatched": 0, "rows": 0, "differences": [], "truncated": False, "bytes": 0}
+    try:
+        boundary_connection = connect_source()
+        opened.append(boundary_connection)
+        with ThreadPoolExecutor(workers) as pool:
+            futures = []
+            lower = None
+            # Chunks are compared while the rest of the key is still being walked
+            for boundary in chunk_boundaries(boundary_connection.cursor(), source_table, key_columns, chunk_size):
+                if job is not None and job.cancelled:
+                    raise QueryCancelled()
+                futures.append(pool.submit(compare, lower, boundary))
+                lower = boundary
+            futures.append(pool.submit(compare, lower, None))
+            for done, future in enumerate(futures, 1):
+                try:
+                    rows, differed, found, left_out = future.result()
+                except BaseException:
+                    # Leaving the pool waits for everything queued, so nothing more is started after a failure
+                    for pending in futures:
+                        pending.cancel()
+                    raise
+                result["chunks"] += 1
+                result["rows"] += rows
+                if differed:
+                    result["mismatched"] += 1
+                room = row_limit - len(result["differences"])
+                result["differences"] += found[:room]
+                result["truncated"] = result["truncated"] or left_out > 0 or len(found) > room
+                if job is not None:
+                    job.report(result["rows"], done, len(futures))
+    finally:
+        for connection in opened:
+            result["bytes"] += getattr(connection, "bytes_received", 0)
+            try:
+                connection.close()
+            except pymysql.Error:
+                pass
+    return result
+
+
+def compare_tables(schema_cache, connect_source, connect_target, source_database, source_table, target_database,
+                   target_table, chunk_size=DIFF_CHUNK_SIZE, workers=DIFF_WORKERS, job=None):
+    # Checks that two tables can be compared and runs diff_tables over the columns both have. Returns the
+    # compared columns, the columns only one side has and the diff_tables result.
+    source_connection = connect_source()
+    try:
+        source = schema_cache.load(source_connection.cursor(), source_table, source_database)
+    finally:
+        source_connection.close()
+    target_connection = connect_target()
+    try:
+        target = schema_cache.load(target_connection.cursor(), target_table, target_database)
+    finally:
+        target_connection.close()
+    if not source.columns:
+        raise ValueError(f"Table {source_database}.{source_table} does not exist.")
+    if not target.columns:
+        raise ValueError(f"Table {target_database}.{target_table} does not exist.")
+    if not source.primary_key:
+        raise ValueError(f"Table '{source_table}' has no primary key to split it into chunks.")
+    if target.primary_key != source.primary_key:
+        raise ValueError(f"The primary keys differ: ({', '.join(source.primary_key)}) and "
+                         f"({', '.join(target.primary_key)}).")
+    columns = [column for column in source.columns if column in target.columns]
+    skipped = [column for column in source.columns + target.columns if column not in columns]
+    result = diff_tables(connect_source, connect_target, table_ref(source_database, source_table),
+                         table_ref(target_database, target_table), columns, source.primary_key, chunk_size,
+                         workers, job=job)
+    return columns, skipped, result
+
+
+# Plan steps that expect to read more rows than this are shown in bold
+EXPLAIN_ROWS_WARNING = 10000
+
+# Access types that read a whole table or a whole index, as EXPLAIN reports them
+FULL_SCAN_ACCESS = {"ALL": "Full table scan", "index": "Full index scan"}
+
+TREE_PLAN_LINE = re.compile(r"^(?P<indent>\s*)-> (?P<step>.*?)(?:\s+\(cost=(?P<cost>[\d.e+]+)(?:\.\.[\d.e+]+)?"
+                            r" rows=(?P<rows>[\d.e+]+)\))?(?:\s+\(actual time=[\d.e+]+\.\.(?P<time>[\d.e+]+)"
+                            r" rows=(?P<actual_rows>[\d.e+]+) loops=(?P<loops>\d+)\))?\s*$")
+
+
+def split_statements(sql):
+    # Splits a script on the semicolons that are outside quotes and comments
+    statements = []
+    start = 0
+    i = 0
+    quote = None
+    while i < len(sql):
+        char = sql[i]
+        if quote is not None:
+            if char == "\\" and quote != "`":
+                i += 1
+            elif char == quote:
+                quote = None
+        elif char in "'\"`":
+            quote = char
+        elif sql.startswith("--", i) or char == "#":
+            end = sql.find("\n", i)
+            i = len(sql) if end < 0 else end
+        elif sql.startswith("/*", i):
+            end = sql.find("*/", i + 2)
+            i = len(sql) if end < 0 else end + 1
+        elif char == ";":
+            statements.append(sql[start:i])
+            start = i + 1
+        i += 1
+    statements.append(sql[start:])
+    return [statement.strip() for statement in statements if statement.strip()]
+
+
+def plan_step(step, access=None, rows=None, actual_rows=None, cost=None, key=None, details="", warning=None):
+    return {"step": step, "access": access, "rows": rows, "actual_rows": actual_rows, "cost": cost, "key": key,
+            "details": details, "warning": warning, "children": []}
+
+
+def plan_from_json(node, name="query_block"):
+    # Walks the JSON plan of MySQL (EXPLAIN FORMAT=JSON) or MariaDB (also ANALYZE FORMAT=JSON). Tables become
+    # steps with their access type and row estimates; every other object becomes a step named after its key.
+    if isinstance(node, list):
+        return [child for item in node for child in plan_from_json(item, name)]
+    if not isinstance(node, dict):
+        return []
+    table = node.get("table") if isinstance(node.get("table"), dict) else None
+    if set(node) == {"table"} and table is not None:
+        return plan_from_json(table, "table")
+    if "table_name" in node:
+        cost_info = node.get("cost_info") or {}
+        access = node.get("access_type")
+        rows = node.get("rows_examined_per_scan", node.get("rows"))
+        details = [f"{key}: {node[key]}" for key in ("filtered", "attached_condition", "using_index", "r_filtered")
+                   if key in node]
+        step = plan_step(f"table {node['table_name']}", access, rows, node.get("r_rows"),
+                         cost_info.get("prefix_cost", cost_info.get("read_cost", node.get("cost"))),
+                         node.get("key"), ", ".join(details), FULL_SCAN_ACCESS.get(access))
+    else:
+        details = [f"{key}: {value}" for key, value in node.items() if not isinstance(value, (dict, list))]
+        warning = None
+        if node.get("using_filesort") or name == "filesort":
+            warning = "Sorts rows in a file"
+        elif node.get("using_temporary_table") or name == "temporary_table":
+            warning = "Uses a temporary table"
+        step = plan_step(name, cost=(node.get("cost_info") or {}).get("query_cost"), details=", ".join(details),
+                         warning=warning)
+    for key, value in node.items():
+        if key != "cost_info" and isinstance(value, (dict, list)):
+            step["children"] += plan_from_json(value, key)
+    return [step]
+
+
+def plan_from_tree(text):
+    # Parses the indented text of EXPLAIN ANALYZE (or FORMAT=TREE) from MySQL 8
+    roots = []
+    parents = []
+    for line in text.splitlines():
+        match = TREE_PLAN_LINE.match(line)
+        if match is None:
+            if parents and line.strip():
+                parents[-1][1]["details"] += line.strip()
+            continue
+        step_text = match.group("step")
+        warning = None
+        if step_text.startswith("Table scan"):
+            warning = FULL_SCAN_ACCESS["ALL"]
+        elif step_text.startswith("Index scan"):
+            warning = FULL_SCAN_ACCESS["index"]
+        elif step_text.startswith(("Sort", "Temporary table")):
+            warning = "Sorts or buffers rows"
+        details = f"{match.group('time')} ms, {match.group('loops')} loops" if match.group("time") else ""
+        step = plan_step(step_text, rows=match.group("rows") and float(match.group("rows")),
+                         actual_rows=match.group("actual_rows") and float(match.group("actual_rows")),
+                         cost=match.group("cost"), details=details, warning=warning)
+        indent = len(match.group("indent"))
+        while parents and parents[-1][0] >= indent:
+            parents.pop()
+        (parents[-1][1]["children"] if parents else roots).append(step)
+        parents.append((indent, step))
+    return roots
+
+
+def explain_query(cursor, sql, analyze=False):
+    # The plan of one statement as plan steps. With analyze the statement really runs and the plan has the
+    # actual row counts.
+    import json
+    mariadb = "MariaDB" in cursor.connection.get_server_info()
+    if analyze and not mariadb:
+        cursor.execute(f"EXPLAIN ANALYZE {sql}")
+        return plan_from_tree("\n".join(row[0] for row in cursor.fetchall()))
+    cursor.execute(f"{'ANALYZE' if analyze else 'EXPLAIN'} FORMAT=JSON {sql}")
+    document = json.loads(cursor.fetchone()[0])
+    return plan_from_json(document.get("query_block", document))
+
+
+# Browse patterns kept for the index advisor, and the fewest rows a query has to examine before an index for it
+# is suggested
+ADVISOR_MAX_PATTERNS = 500
+ADVISOR_MIN_ROWS = 1000
+
+# Filter operators an index can seek on directly, and ones it can only scan a range of
+EQUALITY_OPERATORS = ("=", "IS NULL")
+RANGE_OPERATORS = ("<", "<=", ">", ">=", "LIKE")
+
+# Column types that cannot be indexed without a prefix length
+UNINDEXABLE_TYPES = ("text", "blob", "json", "geometry")
+
+# Columns may be qualified with the table name or its alias
+QUALIFIED_COLUMN = r"(?:`?(?P<qualifier>\w+)`?\.)?`?(?P<column>\w+)`?"
+SIMPLE_SELECT = re.compile(r"^\s*SELECT\s+.+?\s+FROM\s+(?:`?(?P<schema>\w+)`?\.)?`?(?P<table>\w+)`?"
+                           r"(?:\s+(?:AS\s+)?(?!WHERE\b|ORDER\b|LIMIT\b)`?(?P<alias>\w+)`?)?"
+                           r"(?:\s+WHERE\s+(?P<where>.+?))?(?:\s+ORDER\s+BY\s+(?P<order>.+?))?"
+                           r"(?:\s+LIMIT\s+[\d\s,]+(?:OFFSET\s+\d+)?)?\s*$", re.IGNORECASE | re.DOTALL)
+SIMPLE_CONDITION = re.compile(r"^\(?\s*" + QUALIFIED_COLUMN + r"\s*(?P<operator><=>|>=|<=|<>|!=|=|<|>|IN\b|"
+                              r"BETWEEN\b|NOT\s+LIKE\b|LIKE\b|IS\s+NOT\s+NULL\b|IS\s+NULL\b)\s*(?P<value>.*)$",
+                              re.IGNORECASE | re.DOTALL)
+SORT_COLUMN = re.compile(r"\s*" + QUALIFIED_COLUMN)
+
+
+class WorkloadRecorder:
+    # Filter and sort columns of the queries run through the browser and the console, counted per shape, for
+    # the index advisor
+    def __init__(self, max_patterns=ADVISOR_MAX_PATTERNS):
+        self.lock = threading.Lock()
+        self.patterns = collections.OrderedDict()
+        self.max_patterns = max_patterns
+
+    def record(self, schema_name, table_name, equality_columns, range_columns, sort_columns, sql, params=None,
+               count=1):
+        key = (schema_name, table_name, tuple(sorted(set(equality_columns))), tuple(range_columns),
+               tuple(sort_columns))
+        with self.lock:
+            pattern = self.patterns.pop(key, None)
+            if pattern is None:
+                pattern = {"schema": schema_name, "table": table_name, "equality": list(key[2]),
+                           "range": list(range_columns), "sort": list(sort_columns), "count": 0}
+            pattern["count"] += count
+            pattern["sql"] = sql
+            pattern["params"] = None if params is None else list(params)
+            self.patterns[key] = pattern
+            while len(self.patterns) > self.max_patterns:
+                self.patterns.popitem(last=False)
+
+    def record_filters(self, schema_name, table_name, filters, sort_columns, sql, params):
+        # filters as the grid keeps them, (column, operator, value)
+        equality = [column_name for column_name, operator, _ in filters if operator in EQUALITY_OPERATORS]
+        ranges = [column_name for column_name, operator, value in filters if operator in RANGE_OPERATORS
+                  and not (operator == "LIKE" and str(value).startswith(("%", "_")))]
+        if equality or ranges or sort_columns:
+            self.record(schema_name, table_name, equality, ranges, sort_columns, sql, params)
+
+    def record_statement(self, schema_name, sql):
+        # Only single table SELECTs with AND-ed conditions are understood; anything else is not recorded
+        match = SIMPLE_SELECT.match(sql)
+        if match is None or re.search(r"\b(JOIN|UNION|OR)\b", sql, re.IGNORECASE):
+            return
+        equality, ranges, sort_columns = [], [], []
+        # Column qualifiers can only name the table or its alias
+        names = {match.group("table").lower(), (match.group("alias") or "").lower()}
+
+        def own_column(column_match):
+            return column_match is not None and (column_match.group("qualifier") is None or
+                                                 column_match.group("qualifier").lower() in names)
+
+        where = match.group("where")
+        for condition in re.split(r"\s+AND\s+", where or "", flags=re.IGNORECASE) if where else []:
+            condition_match = SIMPLE_CONDITION.match(condition.strip())
+            if not own_column(condition_match):
+                continue
+            operator = " ".join(condition_match.group("operator").upper().split())
+            value = condition_match.group("value").strip()
+            if operator in ("=", "<=>", "IN", "IS NULL"):
+                equality.append(condition_match.group("column"))
+            elif operator in ("<", "<=", ">", ">=", "BETWEEN") or \
+                    (operator == "LIKE" and not value.lstrip("'\"").startswith(("%", "_"))):
+                ranges.append(condition_match.group("column"))
+        if match.group("order"):
+            for part in match.group("order").split(","):
+                column_match = SORT_COLUMN.match(part)
+                if own_column(column_match):
+                    sort_columns.append(column_match.group("column"))
+        if equality or ranges or sort_columns:
+            self.record(match.group("schema") or schema_name, match.group("table"), equality, ranges, sort_columns,
+                        sql)
+
+    def snapshot(self):
+        with self.lock:
+            return [dict(pattern) for pattern in self.patterns.values()]
+
+    def clear(self):
+        with self.lock:
+            self.patterns.clear()
+
+    def dump(self):
+        import json
+        return json.dumps(self.snapshot(), default=str)
+
+    def load(self, text):
+        import json
+        try:
+            patterns = json.loads(text) if text else []
+        except ValueError:
+            return
+        for pattern in patterns:
+            self.record(pattern["schema"], pattern["table"], pattern["equality"], pattern["range"],
+                        pattern["sort"], pattern["sql"], pattern["params"], pattern["count"])
+
+
+def candidate_index(schema, pattern):
+    # Equality columns first, then one range column, then the sort column when the index can still give the
+    # order; columns that cannot be indexed whole are left out
+    def indexable(column_name):
+        column_type = schema.column_types.get(column_name, "").lower()
+        return column_name in schema.column_types and not column_type.endswith(UNINDEXABLE_TYPES)
+
+    columns = [column_name for column_name in pattern["equality"] if indexable(column_name)]
+    ranges = [column_name for column_name in pattern["range"] if indexable(column_name) and column_name not in columns]
+    sort = [column_name for column_name in pattern["sort"][:1] if indexable(column_name)]
+    if ranges:
+        columns.append(ranges[0])
+        if sort and sort[0] == ranges[0]:
+            sort = []
+    if sort and not ranges and sort[0] not in columns:
+        columns.append(sort[0])
+    # An index starting with the primary key adds nothing to it
+    if columns and columns[:len(schema.primary_key)] == schema.primary_key:
+        return []
+    return columns
+
+
+def index_covers(schema, columns, equality_count):
+    # Whether an existing index starts with these columns, the equality ones in any order
+    for index_columns in schema.indexes.values():
+        if len(index_columns) >= len(columns) and \
+                set(index_columns[:equality_count]) == set(columns[:equality_count]) and \
+                index_columns[equality_count:len(columns)] == columns[equality_count:]:
+            return True
+    return False
+
+
+def explain_access(cursor, sql, params):
+    # Access type, rows examined and Extra of the first table in the plain EXPLAIN of a query
+    cursor.execute(f"EXPLAIN {sql}", params)
+    names = [desc[0].lower() for desc in cursor.description]
+    rows = cursor.fetchall()
+    if not rows:
+        return None
+    plan = dict(zip(names, rows[0]))
+    return plan.get("type"), int(plan.get("rows") or 0), plan.get("extra") or ""
+
+
+def advise_indexes(cursor, schema_cache, patterns, schema_name):
+    # Composite index suggestions for the recorded patterns of one database, best first. The benefit is the
+    # rows the queries examine today times how often they ran.
+    import pymysql
+    suggestions = {}
+    for pattern in patterns:
+        if pattern["schema"] != schema_name:
+            continue
+        schema = schema_cache.get(cursor, pattern["table"])
+        if not schema.columns:
+            continue
+        columns = candidate_index(schema, pattern)
+        equality_count = len([column_name for column_name in columns if column_name in pattern["equality"]])
+        if not columns or index_covers(schema, columns, equality_count):
+            continue
+        try:
+            plan = explain_access(cursor, pattern["sql"], pattern["params"])
+        except pymysql.Error:
+            continue
+        if plan is None:
+            continue
+        access, rows, extra = plan
+        filesort = "filesort" in extra.lower()
+        if access not in FULL_SCAN_ACCESS and not filesort and rows < ADVISOR_MIN_ROWS:
+            continue
+        reasons = []
+        if access in FULL_SCAN_ACCESS:
+            reasons.append(FULL_SCAN_ACCESS[access].lower())
+        if filesort:
+            reasons.append("sorts every matching row")
+        if not reasons:
+            reasons.append(f"examines {rows} rows")
+        key = (pattern["table"], tuple(columns))
+        suggestion = suggestions.setdefault(key, {"table": pattern["table"], "columns": columns, "uses": 0,
+                                                  "rows": 0, "benefit": 0, "reasons": [],
+                                                  "existing": list(schema.indexes)})
+        suggestion["uses"] += pattern["count"]
+        suggestion["rows"] = max(suggestion["rows"], rows)
+        suggestion["benefit"] += pattern["count"] * max(rows, 1)
+        suggestion["reasons"] += [reason for reason in reasons if reason not in suggestion["reasons"]]
+
+    # An index whose columns start with another suggestion's serves that one's queries too
+    for key, suggestion in list(suggestions.items()):
+        for other_key, other in suggestions.items():
+            if other is not suggestion and key[0] == other_key[0] and len(other_key[1]) > len(key[1]) and \
+                    other_key[1][:len(key[1])] == key[1] and key in suggestions:
+                other["uses"] += suggestion["uses"]
+                other["benefit"] += suggestion["benefit"]
+                del suggestions[key]
+                break
+
+    ranked = sorted(suggestions.values(), key=lambda suggestion: suggestion["benefit"], reverse=True)
+    for suggestion in ranked:
+        name = ("idx_" + "_".join(suggestion["columns"]))[:64]
+        base, number = name[:60], 2
+        while name in suggestion["existing"]:
+            name = f"{base}_{number}"
+            number += 1
+        suggestion["name"] = name
+        suggestion["sql"] = f"ALTER TABLE {quote_ident(suggestion['table'])} ADD INDEX {quote_ident(name)} " \
+                            f"({', '.join(quote_ident(column_name) for column_name in suggestion['columns'])})"
+    return ranked
+
+
+# Rows copied per statement when mirroring a table into a local snapshot
+SNAPSHOT_CHUNK_SIZE = 10000
+
+# Column types stored as numbers in a snapshot so that they sort and compare as numbers. Other values keep the
+# type they arrive as; dates and times are stored as text, which sorts the same way.
+SNAPSHOT_INTEGER_TYPES = {"tinyint", "smallint", "mediumint", "int", "integer", "bigint", "year"}
+SNAPSHOT_REAL_TYPES = {"decimal", "numeric", "float", "double", "real"}
+
+
+def snapshot_affinity(column_type, collation=None):
+    # Text in a case-insensitive collation compares with SQLite's NOCASE, so filters and sorting on the
+    # snapshot find the same rows as on the server. NOCASE only folds ASCII letters.
+    column_type = (column_type or "").lower().split("(")[0].split(" ")[0]
+    if column_type in SNAPSHOT_REAL_TYPES:
+        return "REAL"
+    if column_type in SNAPSHOT_INTEGER_TYPES:
+        return "INTEGER"
+    if collation is not None and collation.lower().endswith("_ci"):
+        return "COLLATE NOCASE"
+    return ""
+
+
+def snapshot_affinities(schema):
+    return [snapshot_affinity(schema.column_types.get(column_name), schema.collations.get(column_name))
+            for column_name in schema.columns]
+
+
+def snapshot_value(value):
+    if isinstance(value, (decimal.Decimal, datetime.date, datetime.time, datetime.timedelta)):
+        return str(value)
+    if isinstance(value, bytearray):
+        return bytes(value)
+    if isinstance(value, set):
+        return ",".join(sorted(value))
+    return value
+
+
+class SnapshotCursor:
+    # Runs the grid's MySQL queries on SQLite, which takes backquoted names and row value comparisons as they
+    # are and only needs the placeholders changed
+    def __init__(self, cursor):
+        self.cursor = cursor
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+    def execute(self, sql, params=None):
+        self.cursor.execute(sql.replace("%s", "?"), list(params or ()))
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, size=None):
+        return self.cursor.fetchmany(size)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+
+class SnapshotConnection:
+    # A connection to a snapshot file that looks enough like a pymysql one for ResultStream
+    use_unicode = True
+    bytes_received = 0
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def thread_id(self):
+        # Nothing on the server to kill when a read is cancelled
+        return None
+
+    def cursor(self, cursor_class=None):
+        return SnapshotCursor(self.connection.cursor())
+
+    def close(self):
+        self.connection.close()
+
+
+class SnapshotStore:
+    # Local SQLite copies of tables of one database, with what refreshing each one needs: its columns and key,
+    # the column whose growth marks new or changed rows and the server's UPDATE_TIME at the last refresh.
+    # tables is read on the GUI thread, so it is kept in memory and only changed under the lock once the file
+    # has been committed.
+    def __init__(self, path):
+        import json
+        self.path = path
+        self.lock = threading.Lock()
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        local = self.open_local()
+        try:
+            local.execute("CREATE TABLE IF NOT EXISTS _snapshot_tables (table_name TEXT PRIMARY KEY, info TEXT)")
+            self.tables = {table_name: json.loads(info)
+                           for table_name, info in local.execute("SELECT table_name, info FROM _snapshot_tables")}
+        finally:
+            local.close()
+
+    def open_local(self):
+        import sqlite3
+        local = sqlite3.connect(self.path, timeout=30, check_same_thread=False, isolation_level=None)
+        # Readers keep seeing the last committed copy while a refresh writes the next one
+        local.execute("PRAGMA journal_mode = WAL")
+        return local
+
+    def connect(self):
+        return SnapshotConnection(self.open_local())
+
+    def info(self, table_name):
+        with self.lock:
+            return self.tables.get(table_name)
+
+    def commit(self, local, info):
+        import json
+        local.execute("INSERT OR REPLACE INTO _snapshot_tables VALUES (?, ?)",
+                      (info["table"], json.dumps(info, default=str)))
+        local.execute("COMMIT")
+        with self.lock:
+            self.tables[info["table"]] = info
+
+    def remove(self, table_name):
+        local = self.open_local()
+        try:
+            local.execute("BEGIN IMMEDIATE")
+            local.execute(f"DROP TABLE IF EXISTS {quote_ident(table_name)}")
+            local.execute("DELETE FROM _snapshot_tables WHERE table_name = ?", (table_name,))
+            local.execute("COMMIT")
+        finally:
+            local.close()
+        with self.lock:
+            self.tables.pop(table_name, None)
+
+
+def read_update_time(cursor, table_name):
+    cursor.execute("SELECT UPDATE_TIME FROM information_schema.TABLES WHERE TABLE_SCHEMA = DATABASE() "
+                   "AND TABLE_NAME = %s", (table_name,))
+    row = cursor.fetchone()
+    return None if row is None or row[0] is None else str(row[0])
+
+
+def refresh_column(cursor, table_name):
+    # A column that grows with every changed row, so a refresh only has to copy the rows past its last value.
+    # A timestamp set ON UPDATE catches inserts and updates, an AUTO_INCREMENT key only inserts. Returns
+    # (column, mode), or (None, "full") when every refresh has to copy the whole table. Rows where the column is
+    # NULL are never past the last value, so a nullable ON UPDATE column means full copies too.
+    cursor.execute("SELECT COLUMN_NAME, EXTRA, IS_NULLABLE FROM information_schema.COLUMNS "
+                   "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s AND (EXTRA LIKE %s OR EXTRA LIKE %s) "
+                   "ORDER BY ORDINAL_POSITION", (table_name, "%on update%", "%auto_increment%"))
+    columns = [(column_name, extra.lower(), nullable == "YES") for column_name, extra, nullable in cursor.fetchall()]
+    for column_name, extra, nullable in columns:
+        if "on update" in extra and not nullable:
+            return column_name, "changes"
+    if any("on update" in extra for _, extra, _ in columns):
+        return None, "full"
+    for column_name, extra, nullable in columns:
+        if not nullable:
+            return column_name, "inserts"
+    return None, "full"
+
+
+def copy_rows(cursor, local, table_name, columns, order_columns, insert_sql, chunk_size, copied=0, where_sql="",
+              where_params=(), job=None):
+    # Copies rows from the server in order_columns order, which must identify a row, seeking from the last
+    # row of each chunk. Returns the number of rows copied so far and the order values of the last one.
+    column_sql = ", ".join(quote_ident(column_name) for column_name in columns)
+    order_sql = ", ".join(quote_ident(column_name) for column_name in order_columns)
+    order_indexes = [columns.index(column_name) for column_name in order_columns]
+    last = None
+    while True:
+        if job is not None and job.cancelled:
+            raise QueryCancelled()
+        conditions = [where_sql] if where_sql else []
+        params = list(where_params)
+        if last is not None:
+            seek_sql, seek_params = key_range_clause(order_columns, last, None)
+            conditions.append(seek_sql)
+            params += seek_params
+        where = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        cursor.execute(f"SELECT {column_sql} FROM {quote_ident(table_name)}{where} ORDER BY {order_sql} "
+                       f"LIMIT {int(chunk_size)}", params)
+        rows = cursor.fetchall()
+        if not rows:
+            break
+        local.executemany(insert_sql, [[snapshot_value(value) for value in row] for row in rows])
+        copied += len(rows)
+        last = tuple(rows[-1][i] for i in order_indexes)
+        if job is not None:
+            job.report(copied)
+        if len(rows) < chunk_size:
+            break
+    return copied, last
+
+
+def mirror_table(cursor, store, schema, chunk_size=SNAPSHOT_CHUNK_SIZE, job=None):
+    # Copies a whole table into the snapshot in primary key order, with the indexes it has on the server so
+    # that sorting and filtering the copy is as quick as it can be. The copy is written next to the old one
+    # and swapped in at the end, so the old one can be read until then. Returns the snapshot's info.
+    table_name = schema.table_name
+    if not schema.columns:
+        raise ValueError(f"Table '{table_name}' does not exist.")
+    if not schema.primary_key:
+        raise ValueError(f"Table '{table_name}' has no primary key to copy it in chunks.")
+    started = time.time()
+    # Read before copying, so that whatever changes during the copy is picked up by the next refresh
+    update_time = read_update_time(cursor, table_name)
+    column, mode = refresh_column(cursor, table_name)
+    last_value = None
+    if column is not None:
+        cursor.execute(f"SELECT MAX({quote_ident(column)}) FROM {quote_ident(table_name)}")
+        last_value = cursor.fetchone()[0]
+
+    columns = list(schema.columns)
+    new_name = table_name + "__snapshot_new"
+    local = store.open_local()
+    try:
+        local.execute("BEGIN IMMEDIATE")
+        local.execute(f"DROP TABLE IF EXISTS {quote_ident(new_name)}")
+        affinities = snapshot_affinities(schema)
+        column_sql = ", ".join(f"{quote_ident(column_name)} {affinity}"
+                               for column_name, affinity in zip(columns, affinities))
+        key_sql = ", ".join(quote_ident(column_name) for column_name in schema.primary_key)
+        local.execute(f"CREATE TABLE {quote_ident(new_name)} ({column_sql}, PRIMARY KEY ({key_sql}))")
+        insert_sql = f"INSERT INTO {quote_ident(new_name)} VALUES ({', '.join(['?'] * len(columns))})"
+        copied, _ = copy_rows(cursor, local, table_name, columns, schema.primary_key, insert_sql, chunk_size,
+                              job=job)
+        local.execute(f"DROP TABLE IF EXISTS {quote_ident(table_name)}")
+        local.execute(f"ALTER TABLE {quote_ident(new_name)} RENAME TO {quote_ident(table_name)}")
+        for index_name, index_columns in schema.indexes.items():
+            if index_name != "PRIMARY":
+                local.execute(f"CREATE INDEX {quote_ident(table_name + '__' + index_name)} ON "
+                              f"{quote_ident(table_name)} "
+                              f"({', '.join(quote_ident(column_name) for column_name in index_columns)})")
+        info = {"table": table_name, "columns": columns, "key_columns": list(schema.primary_key),
+                "affinities": affinities,
+                "refresh_column": column, "mode": mode, "last_value": last_value, "update_time": update_time,
+                "rows": copied, "copied": copied, "refreshed_at": started, "full_at": started}
+        store.commit(local, info)
+        return info
+    except BaseException:
+        if local.in_transaction:
+            local.execute("ROLLBACK")
+        raise
+    finally:
+        local.close()
+
+
+def refresh_snapshot(cursor, store, schema, chunk_size=SNAPSHOT_CHUNK_SIZE, job=None):
+    # Brings a snapshot up to date as cheaply as the table allows: nothing is copied while the server's
+    # UPDATE_TIME stays the same, and with a refresh column only the rows past its last value are. Changes the
+    # refresh column does not show (deletes, and updates when it is an AUTO_INCREMENT key) need mirror_table.
+    table_name = schema.table_name
+    info = store.info(table_name)
+    if info is None or info["columns"] != list(schema.columns) or info["key_columns"] != list(schema.primary_key) \
+            or info.get("affinities") != snapshot_affinities(schema):
+        return mirror_table(cursor, store, schema, chunk_size, job)
+    started = time.time()
+    update_time = read_update_time(cursor, table_name)
+    changed = update_time is None or update_time != info["update_time"]
+    if changed and info["mode"] == "full":
+        return mirror_table(cursor, store, schema, chunk_size, job)
+    info = dict(info, copied=0, refreshed_at=started, update_time=update_time)
+    local = store.open_local()
+    try:
+        local.execute("BEGIN IMMEDIATE")
+        if changed:
+            column = info["refresh_column"]
+            order_columns = [column] + [key for key in info["key_columns"] if key != column]
+            where_sql, where_params = "", ()
+            if info["last_value"] is not None:
+                # Rows written later can share the last value, so rows with it are copied again
+                where_sql, where_params = f"{quote_ident(column)} >= %s", (info["last_value"],)
+            insert_sql = f"INSERT OR REPLACE INTO {quote_ident(table_name)} " \
+                         f"VALUES ({', '.join(['?'] * len(info['columns']))})"
+            copied, last = copy_rows(cursor, local, table_name, info["columns"], order_columns, insert_sql,
+                                     chunk_size, 0, where_sql, where_params, job)
+            if last is not None:
+                info["last_value"] = last[0]
+            info["copied"] = copied
+            info["rows"] = local.execute(f"SELECT COUNT(*) FROM {quote_ident(table_name)}").fetchone()[0]
+        store.commit(local, info)
+        return info
+    except BaseException:
+        if local.in_transaction:
+            local.execute("ROLLBACK")
+        raise
+    finally:
+        local.close()
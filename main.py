@@ -1,16 +1,36 @@
+import time
+
+# Taken before anything else is imported so that --profile-startup can show what the imports cost
+STARTUP_STARTED = time.perf_counter()
+
+import array
+import bisect
+import collections
 import os
+import re
 import sys
+import threading
 
-import PyQt5
-import pymysql
-from PyQt5 import QtWidgets  # works for pyqt5
-from PyQt5.QtCore import Qt, QTimer
-from PyQt5.QtGui import QIcon
+from PyQt5.QtCore import Qt, QSettings, QTimer, QAbstractTableModel, QModelIndex, QObject, QRunnable, QThreadPool, \
+    pyqtSignal, QSortFilterProxyModel, QStandardPaths
+from PyQt5.QtGui import QIcon, QColor, QStandardItemModel, QStandardItem, QKeySequence
 from PyQt5.QtWidgets import QApplication, QMainWindow, QWidget, QPushButton, QLabel, QLineEdit, QGridLayout, \
-    QHBoxLayout, QVBoxLayout, QTreeWidget, QTreeWidgetItem, QTableWidget, QTableWidgetItem, QMessageBox, QInputDialog, \
-    QComboBox
+    QHBoxLayout, QVBoxLayout, QTreeView, QTableView, QMessageBox, QInputDialog, QComboBox, \
+    QProgressBar, QSpinBox, QCheckBox, QTableWidget, QTableWidgetItem, QFileDialog, QProgressDialog, \
+    QDockWidget, QTabWidget, QPlainTextEdit, QShortcut
 from PyQt5.QtWidgets import QDialog, QFormLayout
 
+from engine import quote_ident, query_log, statement_shape, QueryCancelled, connect, prepare_session, \
+    SLOW_QUERY_THRESHOLD, key_in_clause, flush_pending_changes, PAGE_SIZE, FILTER_OPERATORS, filter_clause, \
+    select_query, continuation_query, keyset_page_query, index_for_column, decode_value, \
+    ResultStream, SchemaCache, CopyRebuildRequired, DDL_PROGRESS_INTERVAL, online_ddl, read_ddl_progress, \
+    read_schema_tables, IMPORT_BATCH_SIZE, detect_delimiter, read_file_header, match_import_columns, \
+    local_infile_enabled, import_delimited_file, load_data_local_infile, export_result, DIFF_CHUNK_SIZE, \
+    DIFF_LEAF_SIZE, DIFF_WORKERS, compare_tables, split_statements, explain_query, EXPLAIN_ROWS_WARNING, \
+    FULL_SCAN_ACCESS, WorkloadRecorder, advise_indexes, SnapshotStore, mirror_table, refresh_snapshot
+
+IMPORTS_DONE = time.perf_counter()
+
 
 def resource_path(relative_path):
     base_path = getattr(sys, '_MEIPASS', os.path.dirname(os.path.abspath(__file__)))
@@ -45,6 +65,1543 @@ def show_error_message(message):
     msg_box.exec_()
 
 
+class StartupProfile:
+    # Time of each startup phase, printed with --profile-startup once the table tree has loaded
+    def __init__(self):
+        self.enabled = False
+        self.phases = [("start", STARTUP_STARTED), ("imports", IMPORTS_DONE)]
+        self.reported = False
+
+    def mark(self, phase):
+        self.phases.append((phase, time.perf_counter()))
+
+    def report(self):
+        if not self.enabled or self.reported:
+            return
+        self.reported = True
+        started = previous = self.phases[0][1]
+        print("Startup profile:")
+        for phase, at in self.phases[1:]:
+            print(f"  {phase:<24} {(at - previous) * 1000:8.1f} ms   at {(at - started) * 1000:8.1f} ms")
+            previous = at
+
+
+startup_profile = StartupProfile()
+
+
+# Organization and application name the settings are stored under
+SETTINGS_NAME = "SQL_Browser"
+
+
+def load_profiles(settings):
+    # Saved connection profiles. Passwords are not saved, so the password is None and is asked for when the
+    # profile is used.
+    profiles = {}
+    settings.beginGroup("profiles")
+    for name in settings.childGroups():
+        profiles[name] = {key: settings.value(f"{name}/{key}", "") for key in ("host", "user", "db")}
+        profiles[name]["password"] = None
+    settings.endGroup()
+    return profiles
+
+
+def save_profile(settings, name, host, user, db):
+    settings.beginGroup(f"profiles/{name}")
+    settings.setValue("host", host)
+    settings.setValue("user", user)
+    settings.setValue("db", db)
+    # Profiles saved by earlier versions could hold the password in plain text
+    settings.remove("password")
+    settings.endGroup()
+
+
+# Number of rows pulled from the server every time the view scrolls near the bottom
+FETCH_BLOCK_SIZE = 500
+
+# Connections in the pool for interactive work (table loads, edits, DDL), for background work (the refresh
+# timer) and for bulk work that can run for minutes (import, export, compare). Each lane has as many worker
+# threads as connections, so one lane never waits on another.
+POOL_SIZE = 4
+BACKGROUND_POOL_SIZE = 1
+BULK_POOL_SIZE = 2
+
+# Recent checkout waits kept per lane for the pool numbers
+POOL_WAIT_SAMPLES = 200
+
+
+class QueryJobSignals(QObject):
+    finished = pyqtSignal(object, object)
+    failed = pyqtSignal(object, object)
+    progress = pyqtSignal(object, int)
+
+
+class QueryJob(QRunnable):
+    def __init__(self, executor, label, fn, on_result=None, on_error=None, background=False, connection=True,
+                 feature=None, bulk=False):
+        super().__init__()
+        self.setAutoDelete(False)
+        self.executor = executor
+        self.label = label
+        self.feature = feature or label
+        self.fn = fn
+        self.on_result = on_result
+        self.on_error = on_error
+        self.background = background
+        self.bulk = bulk
+        self.needs_connection = connection
+        self.connection_id = None
+        self.submitted = time.perf_counter()
+        self.cancelled = False
+        self.rows = 0
+        self.done = None
+        self.total = None
+        self.signals = QueryJobSignals()
+
+    def report(self, rows, done=None, total=None):
+        # Called from the job function with the number of rows handled so far, and optionally how much of
+        # some total amount of work (e.g. bytes of a file) is done
+        self.rows = rows
+        self.done = done
+        self.total = total
+        self.signals.progress.emit(self, rows)
+
+    def run(self):
+        connection = None
+        query_log.set_feature(self.feature)
+        try:
+            if self.cancelled:
+                raise QueryCancelled()
+            if self.needs_connection:
+                connection = self.executor.acquire(self)
+                self.connection_id = connection.thread_id()
+            result = self.fn(connection, self)
+        except Exception as e:
+            if connection is not None:
+                self.executor.release(connection, broken=True)
+            if self.cancelled and not isinstance(e, QueryCancelled):
+                e = QueryCancelled()
+            self.signals.failed.emit(self, e)
+        else:
+            if connection is not None:
+                self.executor.release(connection)
+            self.signals.finished.emit(self, result)
+        finally:
+            self.connection_id = None
+
+
+class PoolLane:
+    # One lane of the connection pool with its own worker threads, idle connections and numbers
+    def __init__(self, name, size, parent):
+        self.name = name
+        self.size = size
+        self.thread_pool = QThreadPool(parent)
+        self.thread_pool.setMaxThreadCount(size)
+        self.idle = []
+        self.in_use = 0
+        self.opened = 0
+        self.reconnects = 0
+        self.discarded = 0
+        self.checkouts = 0
+        self.waits = collections.deque(maxlen=POOL_WAIT_SAMPLES)
+        # Connections the lane's jobs opened for themselves (result streams, exports, compares), which stay
+        # open outside the pool until they are closed
+        self.dedicated = []
+
+    def stats(self):
+        waits = sorted(self.waits)
+        self.dedicated = [connection for connection in self.dedicated if getattr(connection, "open", False)]
+        return {
+            "lane": self.name,
+            "size": self.size,
+            "in_use": self.in_use,
+            "idle": len(self.idle),
+            "dedicated": len(self.dedicated),
+            "opened": self.opened,
+            "reconnects": self.reconnects,
+            "discarded": self.discarded,
+            "checkouts": self.checkouts,
+            "wait_ms": sum(waits) / len(waits) if waits else 0.0,
+            "wait_p95_ms": waits[int(len(waits) * 0.95)] if waits else 0.0,
+            "wait_max_ms": waits[-1] if waits else 0.0,
+        }
+
+
+class QueryExecutor(QObject):
+    # Runs database work on a thread pool so the GUI thread never waits on MySQL. Job functions get a
+    # connection and the job, and their result or exception is handed back to the callbacks on the GUI thread.
+    job_started = pyqtSignal(object)
+    job_finished = pyqtSignal(object)
+    job_progress = pyqtSignal(object, int)
+
+    def __init__(self, connect, parent=None, size=POOL_SIZE, background_size=BACKGROUND_POOL_SIZE, prepare=None,
+                 bulk_size=BULK_POOL_SIZE):
+        super().__init__(parent)
+        self.connect = connect
+        # Called again on a connection that ping() had to reconnect, to restore its session settings
+        self.prepare = prepare
+        self.lanes = {
+            "interactive": PoolLane("interactive", size, self),
+            "background": PoolLane("background", background_size, self),
+            "bulk": PoolLane("bulk", bulk_size, self),
+        }
+        self.thread_pool = self.lanes["interactive"].thread_pool
+        self.lock = threading.Lock()
+        self.jobs = []
+        self.generation = 0
+
+    def lane(self, job=None):
+        if job is not None and job.bulk:
+            return self.lanes["bulk"]
+        return self.lanes["background" if job is not None and job.background else "interactive"]
+
+    def open_dedicated(self, lane_name, connect, **options):
+        # Opens a connection outside the pool for a job that keeps it to itself, e.g. an unbuffered result,
+        # and counts it in the lane's numbers while it is open
+        connection = connect(**options)
+        lane = self.lanes[lane_name]
+        with self.lock:
+            lane.dedicated.append(connection)
+        return connection
+
+    def acquire(self, job=None):
+        lane = self.lane(job)
+        with self.lock:
+            connection = lane.idle.pop() if lane.idle else None
+            generation = self.generation
+            lane.in_use += 1
+            lane.checkouts += 1
+        try:
+            if connection is None:
+                connection = self.connect()
+                connection.executor_generation = generation
+                with self.lock:
+                    lane.opened += 1
+            else:
+                # Idle connections may have been dropped by the server (wait_timeout, a restart), so they are
+                # checked and reconnected before use
+                thread_id = connection.thread_id()
+                connection.ping(reconnect=True)
+                if connection.thread_id() != thread_id:
+                    with self.lock:
+                        lane.reconnects += 1
+                    if self.prepare is not None:
+                        self.prepare(connection)
+        except Exception:
+            with self.lock:
+                lane.in_use -= 1
+            if connection is not None:
+                self._close(connection)
+            raise
+        connection.executor_lane = lane
+        if job is not None:
+            with self.lock:
+                lane.waits.append((time.perf_counter() - job.submitted) * 1000)
+        return connection
+
+    def reset(self):
+        # Connection settings changed, e.g. the database; idle connections are closed and busy ones are closed
+        # instead of being returned
+        with self.lock:
+            self.generation += 1
+            idle = []
+            for lane in self.lanes.values():
+                idle += lane.idle
+                lane.idle = []
+        for connection in idle:
+            self._close(connection)
+
+    def release(self, connection, broken=False):
+        lane = getattr(connection, "executor_lane", None)
+        if lane is None:
+            # Opened outside the pool, e.g. to check the login; it joins the interactive lane
+            lane = self.lanes["interactive"]
+            with self.lock:
+                lane.opened += 1
+        else:
+            with self.lock:
+                lane.in_use -= 1
+        if getattr(connection, "executor_generation", self.generation) != self.generation:
+            self._close(connection)
+            return
+        if broken:
+            # A failed job may have left a transaction open or the connection dead, so try to recover it
+            import pymysql
+            try:
+                connection.rollback()
+            except pymysql.Error:
+                with self.lock:
+                    lane.discarded += 1
+                self._close(connection)
+                return
+        with self.lock:
+            # A lane that was made smaller keeps only as many idle connections as it has threads
+            if len(lane.idle) < lane.size:
+                lane.idle.append(connection)
+                return
+        self._close(connection)
+
+    def _close(self, connection):
+        import pymysql
+        try:
+            connection.close()
+        except pymysql.Error:
+            pass
+
+    def set_sizes(self, size, background_size, bulk_size):
+        excess = []
+        with self.lock:
+            for lane, lane_size in ((self.lanes["interactive"], size), (self.lanes["background"], background_size),
+                                    (self.lanes["bulk"], bulk_size)):
+                lane.size = lane_size
+                lane.thread_pool.setMaxThreadCount(lane_size)
+                excess += lane.idle[lane_size:]
+                del lane.idle[lane_size:]
+        for connection in excess:
+            self._close(connection)
+
+    def stats(self):
+        with self.lock:
+            return [lane.stats() for lane in self.lanes.values()]
+
+    def stats_text(self):
+        interactive, background, bulk = self.stats()
+        return (f"Pool: {interactive['in_use']}/{interactive['size']} busy, "
+                f"{background['in_use']}/{background['size']} background, {bulk['in_use']}/{bulk['size']} bulk, "
+                f"{interactive['dedicated'] + bulk['dedicated']} streaming, wait {interactive['wait_ms']:.0f} ms, "
+                f"{interactive['reconnects'] + background['reconnects'] + bulk['reconnects']} reconnects")
+
+    def submit(self, label, fn, on_result=None, on_error=None, background=False, connection=True, feature=None,
+               bulk=False):
+        job = QueryJob(self, label, fn, on_result, on_error, background, connection, feature, bulk)
+        job.signals.finished.connect(self._job_finished)
+        job.signals.failed.connect(self._job_failed)
+        job.signals.progress.connect(self.job_progress)
+        self.jobs.append(job)
+        self.job_started.emit(job)
+        self.lane(job).thread_pool.start(job)
+        return job
+
+    def running(self, include_background=False):
+        return [job for job in self.jobs if include_background or not job.background]
+
+    def _done(self, job):
+        if job in self.jobs:
+            self.jobs.remove(job)
+        self.job_finished.emit(job)
+
+    def _job_finished(self, job, result):
+        self._done(job)
+        if job.on_result is not None:
+            job.on_result(result)
+
+    def _job_failed(self, job, error):
+        self._done(job)
+        if job.on_error is not None:
+            job.on_error(error)
+        elif not isinstance(error, QueryCancelled):
+            print(f"Error in '{job.label}': {error}")
+
+    def cancel(self, job):
+        job.cancelled = True
+        connection_id = job.connection_id
+        if connection_id is not None:
+            # The job's own connection is blocked inside the query, so the kill goes out on a side connection
+            threading.Thread(target=self._kill_query, args=(connection_id,), daemon=True).start()
+
+    def cancel_all(self, include_background=False):
+        for job in self.running(include_background):
+            self.cancel(job)
+
+    def _kill_query(self, connection_id):
+        import pymysql
+        query_log.set_feature("cancel")
+        try:
+            connection = self.connect()
+            try:
+                connection.cursor().execute(f"KILL QUERY {int(connection_id)}")
+            finally:
+                connection.close()
+        except pymysql.Error as e:
+            print(f"Error cancelling query: {e}")
+
+    def busy(self):
+        return any(lane.thread_pool.activeThreadCount() for lane in self.lanes.values())
+
+    def shutdown(self, timeout=2000):
+        self.cancel_all(include_background=True)
+        for lane in self.lanes.values():
+            lane.thread_pool.waitForDone(timeout)
+        self.reset()
+
+
+# Default number of rows written per statement when staged changes are applied
+EDIT_BATCH_SIZE = 1000
+
+EDITED_COLOR = QColor(255, 243, 176)
+INSERTED_COLOR = QColor(204, 238, 204)
+DELETED_COLOR = QColor(246, 200, 200)
+
+
+class LazyTableModel(QAbstractTableModel):
+    # Edits, inserts and deletes are staged here and highlighted until they are applied or discarded.
+    # Staged inserts are shown after the fetched rows.
+    pending_changed = pyqtSignal()
+    rows_loaded = pyqtSignal()
+    load_failed = pyqtSignal(object)
+
+    def __init__(self, executor, connect, parent=None, block_size=FETCH_BLOCK_SIZE):
+        super().__init__(parent)
+        self.executor = executor
+        self.connect = connect
+        self.block_size = block_size
+        self.stream = None
+        self.fetching = False
+        self.sql = None
+        self.params = None
+        self.setup = ()
+        self.affected_rows = None
+        self.decoders = None
+        self.columns = []
+        self.key_columns = []
+        self.key_indexes = []
+        self.rows = []
+        self.exhausted = True
+        self.continuation = None
+        self.table_name = None
+        self.page_size = None
+        self.extra_at_start = False
+        self.has_more = False
+        self.key_ordered = True
+        self.where_sql = ""
+        self.where_params = []
+        self.edited = {}
+        self.inserted = []
+        self.deleted = set()
+        # Set for results that are not read from the server, e.g. table snapshots, which cannot be edited
+        self.read_only = False
+
+    def _abandon_stream(self):
+        stream, self.stream = self.stream, None
+        if stream is not None and not stream.closed:
+            self.executor.submit("Closing result", lambda connection, job: stream.close(), background=True,
+                                 connection=False, feature="table load")
+
+    def _open_stream(self, label, sql, params, count, on_opened):
+        self._abandon_stream()
+        connect = self.connect
+        stream = ResultStream(lambda: self.executor.open_dedicated("interactive", connect), sql, params, self.setup,
+                              self.key_columns)
+        self.stream = stream
+        self.fetching = True
+
+        def open_stream(connection, job):
+            columns = stream.open(job)
+            return columns, stream.fetch(count, job)
+
+        def opened(result):
+            if stream is self.stream:
+                self.fetching = False
+                on_opened(stream, *result)
+
+        def failed(error):
+            if stream is self.stream:
+                self.fetching = False
+                self.exhausted = True
+                self.load_failed.emit(error)
+
+        self.executor.submit(label, open_stream, opened, failed, connection=False, feature="table load")
+
+    def load(self, sql, params=None, key_columns=(), table_name=None, page_size=None, extra_at_start=False,
+             key_ordered=True, where_sql="", where_params=(), setup=()):
+        # key_columns names the columns that identify a row; key_ordered says whether the query returns rows
+        # in ascending key order, which patch_rows needs to place inserted rows. where_sql is the filter the
+        # query applies, so the refresh tracker can apply the same one.
+        # With page_size the query is a single page that asks for one row more than it shows, to tell whether
+        # there is another page; extra_at_start says at which end that row turns up.
+        self.beginResetModel()
+        self.table_name = table_name
+        self.page_size = page_size
+        self.extra_at_start = extra_at_start
+        self.has_more = False
+        self.key_ordered = key_ordered
+        self.where_sql = where_sql
+        self.where_params = list(where_params)
+        self._drop_pending()
+        self.sql = sql
+        self.params = params
+        self.setup = list(setup)
+        self.affected_rows = None
+        self.decoders = None
+        self.rows = []
+        self.columns = []
+        self.key_columns = list(key_columns)
+        self.key_indexes = []
+        self.exhausted = False
+        self.continuation = None
+        self.endResetModel()
+        self._open_stream("Loading rows", sql, params, self._first_fetch_size(), self._loaded)
+
+    def cache_state(self):
+        # What the result cache needs to show this result again, or None if it cannot be reused. A result that
+        # was not read to the end can only be continued if it is in key order.
+        if self.sql is None or self.setup or self.fetching or self.has_pending() or not self.columns:
+            return None
+        if not self.exhausted and not (self.key_ordered and self.key_indexes):
+            return None
+        return {"sql": self.sql, "params": self.params, "columns": list(self.columns),
+                "key_columns": list(self.key_columns), "table_name": self.table_name, "page_size": self.page_size,
+                "extra_at_start": self.extra_at_start, "has_more": self.has_more, "key_ordered": self.key_ordered,
+                "where_sql": self.where_sql, "where_params": list(self.where_params), "exhausted": self.exhausted,
+                "decoders": self.decoders}
+
+    def restore(self, state, rows, continuation=None):
+        # Shows a cached result. continuation is the query for the rows after the cached ones, if the result
+        # had not been read to the end.
+        self._abandon_stream()
+        self.beginResetModel()
+        self._drop_pending()
+        self.sql = state["sql"]
+        self.params = state["params"]
+        self.setup = ()
+        self.decoders = state["decoders"]
+        self.columns = state["columns"]
+        self.key_columns = state["key_columns"]
+        self.table_name = state["table_name"]
+        self.page_size = state["page_size"]
+        self.extra_at_start = state["extra_at_start"]
+        self.has_more = state["has_more"]
+        self.key_ordered = state["key_ordered"]
+        self.where_sql = state["where_sql"]
+        self.where_params = state["where_params"]
+        self.exhausted = state["exhausted"]
+        self.continuation = continuation
+        self.fetching = False
+        self._update_key_indexes()
+        self.rows = rows
+        self.endResetModel()
+        self.rows_loaded.emit()
+
+    def _first_fetch_size(self):
+        if self.page_size is not None:
+            return self.page_size + 1
+        return self.block_size
+
+    def _take_page(self, stream, rows):
+        if self.page_size is None:
+            self.exhausted = stream.exhausted
+            return rows
+        # A page is complete after one fetch, so its stream is dropped right away
+        self.exhausted = True
+        self._abandon_stream()
+        self.has_more = len(rows) > self.page_size
+        if not self.has_more:
+            return rows
+        return rows[1:] if self.extra_at_start else rows[:self.page_size]
+
+    def _loaded(self, stream, columns, rows):
+        self.beginResetModel()
+        self.affected_rows = stream.affected_rows
+        self.decoders = stream.decoders
+        self.columns = columns
+        self._update_key_indexes()
+        self.rows = self._take_page(stream, rows)
+        self.endResetModel()
+        self.rows_loaded.emit()
+
+    def refresh(self):
+        if self.sql is None:
+            return
+        count = max(len(self.rows), self._first_fetch_size())
+        self.continuation = None
+        self._open_stream("Reloading rows", self.sql, self.params, count, self._refreshed)
+
+    def _refreshed(self, stream, columns, rows):
+        rows = self._take_page(stream, rows)
+        self.decoders = stream.decoders
+        if columns != self.columns:
+            self.beginResetModel()
+            self._drop_pending()
+            self.columns = columns
+            self._update_key_indexes()
+            self.rows = rows
+            self.endResetModel()
+            return
+
+        # Patch in place so the view keeps its scroll position and selection
+        old_count = len(self.rows)
+        if len(rows) < old_count:
+            self.beginRemoveRows(QModelIndex(), len(rows), old_count - 1)
+            del self.rows[len(rows):]
+            self.endRemoveRows()
+        self.rows[:len(rows)] = rows[:len(self.rows)]
+        if self.rows and self.columns:
+            self.dataChanged.emit(self.index(0, 0), self.index(len(self.rows) - 1, len(self.columns) - 1))
+        if len(rows) > old_count:
+            self.beginInsertRows(QModelIndex(), old_count, len(rows) - 1)
+            self.rows.extend(rows[old_count:])
+            self.endInsertRows()
+
+    def clear(self):
+        self._abandon_stream()
+        self.beginResetModel()
+        self._drop_pending()
+        self.table_name = None
+        self.fetching = False
+        self.sql = None
+        self.params = None
+        self.setup = ()
+        self.affected_rows = None
+        self.decoders = None
+        self.columns = []
+        self.key_columns = []
+        self.key_indexes = []
+        self.rows = []
+        self.exhausted = True
+        self.continuation = None
+        self.endResetModel()
+
+    def _update_key_indexes(self):
+        self.key_indexes = [self.columns.index(key) for key in self.key_columns if key in self.columns]
+        if len(self.key_indexes) != len(self.key_columns):
+            self.key_indexes = []
+
+    def row_key(self, row):
+        values = self.rows[row]
+        return tuple(values[i] for i in self.key_indexes)
+
+    def _drop_pending(self):
+        had_pending = self.has_pending()
+        self.edited = {}
+        self.inserted = []
+        self.deleted = set()
+        if had_pending:
+            self.pending_changed.emit()
+
+    def has_pending(self):
+        return bool(self.edited or self.inserted or self.deleted)
+
+    def pending_summary(self):
+        return f"{sum(len(edits) for edits in self.edited.values())} edited, {len(self.inserted)} inserted, " \
+               f"{len(self.deleted)} deleted"
+
+    def pending_changes(self):
+        updates = {}
+        for key, edits in self.edited.items():
+            if key not in self.deleted:
+                updates[key] = {self.columns[i]: value for i, value in edits.items()}
+        return {"table_name": self.table_name, "key_columns": list(self.key_columns), "columns": list(self.columns),
+                "updates": updates, "inserts": [list(values) for values in self.inserted],
+                "deletes": list(self.deleted)}
+
+    def discard_pending(self):
+        self.beginResetModel()
+        self._drop_pending()
+        self.endResetModel()
+
+    def is_inserted_row(self, row):
+        return row >= len(self.rows)
+
+    def add_pending_row(self, values):
+        row = len(self.rows) + len(self.inserted)
+        self.beginInsertRows(QModelIndex(), row, row)
+        self.inserted.append(list(values))
+        self.endInsertRows()
+        self.pending_changed.emit()
+
+    def stage_delete(self, row):
+        if self.is_inserted_row(row):
+            self.beginRemoveRows(QModelIndex(), row, row)
+            del self.inserted[row - len(self.rows)]
+            self.endRemoveRows()
+        elif self.key_indexes:
+            self.deleted.add(self.row_key(row))
+            self.dataChanged.emit(self.index(row, 0), self.index(row, len(self.columns) - 1))
+        else:
+            return False
+        self.pending_changed.emit()
+        return True
+
+    def row_values(self, row):
+        # Row as it will look once the staged changes are applied
+        if self.is_inserted_row(row):
+            return tuple(self.inserted[row - len(self.rows)])
+        values = self.rows[row]
+        edits = self.edited.get(self.row_key(row)) if self.edited else None
+        if edits:
+            values = tuple(edits.get(i, value) for i, value in enumerate(values))
+        return values
+
+    def raw_values(self, row, column_names):
+        # Values as the server has them, ignoring staged edits
+        return [self.decode(self.rows[row][self.columns.index(column_name)], self.columns.index(column_name))
+                for column_name in column_names]
+
+    def display_text(self, value, column):
+        # Raw values are already the server's text, so they only need decoding, except for binary columns
+        if type(value) is bytes and self.decoders is not None:
+            text_encoding = self.decoders[column][0]
+            if text_encoding is not None:
+                return value.decode(text_encoding, "replace")
+        return str(value)
+
+    def decode(self, value, column):
+        return decode_value(value, self.decoders[column]) if self.decoders is not None else value
+
+    def find_row(self, key):
+        for row in range(len(self.rows)):
+            if self.row_key(row) == key:
+                return row
+        return None
+
+    def patch_rows(self, changed_rows, deleted_keys=()):
+        # Applies server-side changes found by the refresh tracker without reloading the grid
+        positions = {self.row_key(i): i for i in range(len(self.rows))}
+        last_column = len(self.columns) - 1
+        inserted = []
+        for values in changed_rows:
+            key = tuple(values[i] for i in self.key_indexes)
+            position = positions.get(key)
+            if position is None:
+                inserted.append(tuple(values))
+            else:
+                self.rows[position] = tuple(values)
+                self.dataChanged.emit(self.index(position, 0), self.index(position, last_column))
+
+        for position in sorted((positions[key] for key in deleted_keys if key in positions), reverse=True):
+            self.remove_row(position)
+
+        if inserted and self.key_ordered:
+            keys = [self.row_key(i) for i in range(len(self.rows))]
+            for values in sorted(inserted, key=lambda v: tuple(v[i] for i in self.key_indexes)):
+                key = tuple(values[i] for i in self.key_indexes)
+                position = bisect.bisect_left(keys, key)
+                # Rows past the end of a stream that is still open will arrive through fetchMore
+                if position == len(keys) and not self.exhausted:
+                    continue
+                self.beginInsertRows(QModelIndex(), position, position)
+                self.rows.insert(position, values)
+                keys.insert(position, key)
+                self.endInsertRows()
+
+    def column_index(self, column_name):
+        try:
+            return self.columns.index(column_name)
+        except ValueError:
+            return None
+
+    def value(self, row, column):
+        return self.decode(self.row_values(row)[column], column)
+
+    def remove_row(self, row):
+        self.beginRemoveRows(QModelIndex(), row, row)
+        del self.rows[row]
+        self.endRemoveRows()
+
+    def rowCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.rows) + len(self.inserted)
+
+    def columnCount(self, parent=QModelIndex()):
+        if parent.isValid():
+            return 0
+        return len(self.columns)
+
+    def canFetchMore(self, parent):
+        return not parent.isValid() and not self.exhausted and not self.fetching and \
+            (self.stream is not None or self.continuation is not None)
+
+    def fetchMore(self, parent):
+        if not self.canFetchMore(parent):
+            return
+        if self.stream is None:
+            # A restored result picks up after its last cached row on a stream of its own
+            sql, params = self.continuation
+            self.continuation = None
+            self._open_stream("Fetching rows", sql, params, self.block_size, self._continued)
+            return
+        stream = self.stream
+        self.fetching = True
+
+        def fetched(rows):
+            if stream is not self.stream:
+                return
+            self.fetching = False
+            self.exhausted = stream.exhausted
+            if rows:
+                self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+                self.rows.extend(rows)
+                self.endInsertRows()
+
+        def failed(error):
+            if stream is self.stream:
+                self.fetching = False
+                self.exhausted = True
+                self.load_failed.emit(error)
+
+        self.executor.submit("Fetching rows", lambda connection, job: stream.fetch(self.block_size, job),
+                             fetched, failed, connection=False, feature="row fetch")
+
+    def _continued(self, stream, columns, rows):
+        self.decoders = stream.decoders
+        self.exhausted = stream.exhausted
+        if rows:
+            self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(rows) - 1)
+            self.rows.extend(rows)
+            self.endInsertRows()
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        row, column = index.row(), index.column()
+        if role in (Qt.DisplayRole, Qt.EditRole):
+            # Values stay as fetched and are only turned into text for the cells on screen
+            return self.display_text(self.row_values(row)[column], column)
+        if role == Qt.BackgroundRole:
+            if self.is_inserted_row(row):
+                return INSERTED_COLOR
+            if self.deleted and self.row_key(row) in self.deleted:
+                return DELETED_COLOR
+            if self.edited and column in self.edited.get(self.row_key(row), ()):
+                return EDITED_COLOR
+        return None
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if role != Qt.DisplayRole:
+            return None
+        if orientation == Qt.Horizontal:
+            return self.columns[section] if section < len(self.columns) else None
+        return str(section + 1)
+
+    def flags(self, index):
+        if not index.isValid():
+            return Qt.NoItemFlags
+        if self.read_only:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+        if self.is_inserted_row(index.row()) or self.key_indexes:
+            return Qt.ItemIsEnabled | Qt.ItemIsSelectable | Qt.ItemIsEditable
+        # Rows without a key cannot be addressed by an UPDATE
+        return Qt.ItemIsEnabled | Qt.ItemIsSelectable
+
+    def setData(self, index, value, role=Qt.EditRole):
+        if not index.isValid() or role != Qt.EditRole or self.read_only:
+            return False
+        row, column = index.row(), index.column()
+        if self.is_inserted_row(row):
+            self.inserted[row - len(self.rows)][column] = value
+        elif self.key_indexes:
+            key = self.row_key(row)
+            edits = self.edited.setdefault(key, {})
+            if value == self.display_text(self.rows[row][column], column):
+                # Edited back to what the server has
+                edits.pop(column, None)
+            else:
+                edits[column] = value
+            if not edits:
+                del self.edited[key]
+        else:
+            return False
+        self.dataChanged.emit(index, index)
+        self.pending_changed.emit()
+        return True
+
+
+# Bounds for the auto-refresh poll in milliseconds. The interval doubles for every poll that finds the table
+# unchanged and drops back to the minimum as soon as something changes.
+REFRESH_MIN_INTERVAL = 1000
+REFRESH_MAX_INTERVAL = 30000
+
+
+class TableChangeTracker:
+    # Polling is split in three so the queries can run on a worker: snapshot() reads what the grid holds on
+    # the GUI thread, check() talks to the server, and apply() patches the grid back on the GUI thread.
+    def __init__(self, min_interval=REFRESH_MIN_INTERVAL, max_interval=REFRESH_MAX_INTERVAL):
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.interval = min_interval
+        self.table_name = None
+        self.signature = None
+        self.hot = False
+        # Set when the server has no signature for the table (see read_signature). Polls then skip asking for
+        # one, only check the rows in view and stay at the longest interval.
+        self.unsigned = False
+        self.digests = {}
+
+    def start(self, table_name, signature, hot=False):
+        # The signature must be read before the grid loads the table so that changes made while it loads
+        # are picked up
+        self.table_name = table_name
+        self.signature = signature
+        self.hot = hot
+        self.unsigned = signature is None
+        self.digests = {}
+        self.interval = self.max_interval if self.unsigned else self.min_interval
+
+    def stop(self):
+        self.table_name = None
+        self.signature = None
+        self.hot = False
+        self.unsigned = False
+        self.digests = {}
+        self.interval = self.min_interval
+
+    def forget_rows(self):
+        # The grid switched to other rows of the same table, e.g. another page
+        self.digests = {}
+
+    def read_signature(self, cursor, table_name):
+        # Returns (signature, hot). UPDATE_TIME only has one second resolution, so a table written to
+        # within the last second is reported as hot and has its rows checked even if the signature matches.
+        cursor.execute("SELECT UPDATE_TIME, TABLE_ROWS, AUTO_INCREMENT, "
+                       "TIMESTAMPDIFF(SECOND, UPDATE_TIME, NOW()) <= 1 FROM information_schema.TABLES "
+                       "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s", (table_name,))
+        row = cursor.fetchone()
+        if row is None:
+            return None, True
+        if row[0] is not None:
+            return (row[0], row[1], row[2]), bool(row[3])
+
+        # InnoDB leaves UPDATE_TIME empty on some servers; a live checksum is the next cheapest thing
+        cursor.execute(f"CHECKSUM TABLE {quote_ident(table_name)} QUICK")
+        checksum = cursor.fetchone()
+        if checksum is None or checksum[1] is None:
+            # Nothing cheap to go on, so every poll falls through to the row digests
+            return None, True
+        return ("checksum", checksum[1]), False
+
+    def snapshot(self, model, visible=None):
+        # visible is the (first, last) row in view, which is all an unsigned table has checked
+        if self.table_name is None or model.sql is None or model.fetching or not model.columns:
+            return None
+        snapshot = {
+            "table_name": self.table_name,
+            "signature": self.signature,
+            "unsigned": self.unsigned,
+            "bounded": False,
+            "digests": self.digests,
+            "columns": list(model.columns),
+            # Rows in some other order than the key cannot be checked by key range, so they get reloaded
+            "key_columns": list(model.key_columns) if model.key_indexes and model.key_ordered else [],
+            "where_sql": model.where_sql,
+            "where_params": list(model.where_params),
+            "low": None,
+            "high": None,
+            "unbaselined": None,
+            "keys": [],
+            "view": None,
+        }
+        if model.key_indexes and visible is not None and model.rows:
+            first = max(0, min(visible[0], len(model.rows) - 1))
+            last = max(first, min(visible[1], len(model.rows) - 1))
+            snapshot["view"] = {"key_columns": list(model.key_columns), "ordered": model.key_ordered,
+                                "keys": [model.row_key(i) for i in range(first, last + 1)]}
+        if self.unsigned and snapshot["view"] is not None:
+            return self.bound(snapshot)
+        if snapshot["key_columns"]:
+            keys = [model.row_key(i) for i in range(len(model.rows))]
+            snapshot["keys"] = keys
+            if keys:
+                snapshot["low"] = keys[0]
+                # Only a fully streamed table covers everything past its last row
+                if not model.exhausted or model.page_size is not None:
+                    snapshot["high"] = keys[-1]
+            unbaselined = [key for key in keys if key not in self.digests]
+            if unbaselined:
+                snapshot["unbaselined"] = (unbaselined[0], unbaselined[-1])
+        return snapshot
+
+    def bound(self, snapshot):
+        # Narrows a snapshot to the rows in view. Rows in key order are checked by key range, which also finds
+        # rows added among them; rows in any other order only by their keys.
+        view = snapshot["view"]
+        snapshot = dict(snapshot, key_columns=view["key_columns"], keys=view["keys"], bounded=True,
+                        unbaselined=None)
+        if view["ordered"]:
+            snapshot["low"], snapshot["high"] = view["keys"][0], view["keys"][-1]
+        return snapshot
+
+    def read_digests(self, cursor, snapshot, low, high, keys=None):
+        # One CRC per row over the key range currently held by the grid, or over the given keys. The ISNULL
+        # flags keep NULL and empty strings apart, since CONCAT_WS skips NULLs.
+        columns = ", ".join(quote_ident(column) for column in snapshot["columns"])
+        nulls = ", ".join(f"ISNULL({quote_ident(column)})" for column in snapshot["columns"])
+        key_sql = ", ".join(quote_ident(key) for key in snapshot["key_columns"])
+        placeholders = ", ".join(["%s"] * len(snapshot["key_columns"]))
+        sql = f"SELECT {key_sql}, CRC32(CONCAT_WS(0x1f, {columns}, CONCAT({nulls}))) " \
+              f"FROM {quote_ident(snapshot['table_name'])}"
+        conditions = []
+        params = []
+        if snapshot["where_sql"]:
+            # Rows that stop matching the filter show up as deleted, rows that start matching as new
+            conditions.append(f"({snapshot['where_sql']})")
+            params.extend(snapshot["where_params"])
+        if low is not None:
+            conditions.append(f"({key_sql}) >= ({placeholders})")
+            params.extend(low)
+        if high is not None:
+            conditions.append(f"({key_sql}) <= ({placeholders})")
+            params.extend(high)
+        if keys is not None:
+            condition, condition_params = key_in_clause(snapshot["key_columns"], keys)
+            conditions.append(condition)
+            params.extend(condition_params)
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        cursor.execute(sql, params)
+        width = len(snapshot["key_columns"])
+        return {tuple(row[:width]): row[width] for row in cursor.fetchall()}
+
+    def read_rows(self, cursor, snapshot, keys):
+        rows = []
+        keys = list(keys)
+        for start in range(0, len(keys), 1000):
+            condition, params = key_in_clause(snapshot["key_columns"], keys[start:start + 1000])
+            cursor.execute(f"SELECT * FROM {quote_ident(snapshot['table_name'])} WHERE {condition}", params)
+            rows.extend(cursor.fetchall())
+        return rows
+
+    def check(self, cursor, snapshot):
+        # Runs on a worker. Never touches the tracker itself; everything found goes into the result.
+        if snapshot["unsigned"]:
+            # Asking again would only cost the same two queries for nothing
+            signature, hot = None, True
+        else:
+            signature, hot = self.read_signature(cursor, snapshot["table_name"])
+        changed = signature is None or hot or signature != snapshot["signature"]
+        result = {"table_name": snapshot["table_name"], "signature": signature, "hot": hot, "changed": False,
+                  "reload": False, "digests": None, "rows": [], "deleted": []}
+        if signature is None and not snapshot["bounded"] and snapshot["view"] is not None:
+            # The table just turned out to have no signature, so this poll and the ones after it only check the
+            # rows in view
+            snapshot = self.bound(snapshot)
+
+        if not snapshot["key_columns"]:
+            # Without a key there is no way to tell rows apart, so a change means a reload
+            result["changed"] = result["reload"] = changed
+            return result
+
+        if not changed:
+            # Rows fetched since the last poll only need a baseline digest
+            if snapshot["unbaselined"] is not None:
+                digests = dict(snapshot["digests"])
+                digests.update(self.read_digests(cursor, snapshot, *snapshot["unbaselined"]))
+                result["digests"] = digests
+            return result
+
+        if snapshot["bounded"] and not snapshot["view"]["ordered"]:
+            current = self.read_digests(cursor, snapshot, None, None, snapshot["keys"])
+        else:
+            current = self.read_digests(cursor, snapshot, snapshot["low"], snapshot["high"])
+        old = snapshot["digests"]
+        stale = [key for key, digest in current.items() if old.get(key) != digest]
+        if snapshot["bounded"]:
+            # Digests of the rows out of view stay as they were
+            result["digests"] = dict(old)
+            for key in snapshot["keys"]:
+                result["digests"].pop(key, None)
+            result["digests"].update(current)
+        else:
+            result["digests"] = current
+        result["deleted"] = [key for key in snapshot["keys"] if key not in current]
+        result["rows"] = self.read_rows(cursor, snapshot, stale)
+        result["changed"] = bool(stale or result["deleted"])
+        return result
+
+    def apply(self, model, result):
+        if result["table_name"] != self.table_name:
+            return False
+        self.signature = result["signature"]
+        self.hot = result["hot"]
+        if self.signature is None:
+            self.unsigned = True
+        if result["digests"] is not None:
+            self.digests = result["digests"]
+        if result["reload"]:
+            model.refresh()
+        elif result["rows"] or result["deleted"]:
+            model.patch_rows(result["rows"], result["deleted"])
+        return self.finish(result["changed"])
+
+    def finish(self, changed):
+        if self.unsigned:
+            self.interval = self.max_interval
+        elif changed:
+            self.interval = self.min_interval
+        else:
+            self.interval = min(self.interval * 2, self.max_interval)
+        return changed
+
+
+# Memory budget for results kept after switching away from a table, in megabytes
+RESULT_CACHE_BUDGET = 128
+
+
+def compact_column(values, raw=False):
+    # Integer and float columns go into typed arrays; other columns become one tuple each, which still saves
+    # the per-row tuples. Columns of a raw result are still bytes (see connect), so they are not checked.
+    if raw:
+        return tuple(values)
+    if values and all(type(value) is int for value in values):
+        try:
+            return array.array("q", values)
+        except OverflowError:
+            pass
+    elif values and all(type(value) is float for value in values):
+        return array.array("d", values)
+    return tuple(values)
+
+
+def column_size(column):
+    if isinstance(column, array.array):
+        return sys.getsizeof(column)
+    # Sizing every value would cost as much as copying them, so a sample stands in for the rest
+    sample = column[::max(1, len(column) // 256)]
+    per_value = sum(sys.getsizeof(value) for value in sample) / len(sample) if sample else 0
+    return sys.getsizeof(column) + int(per_value * len(column))
+
+
+def rows_size(rows):
+    # Same as column_size for a list of row tuples, which also costs a tuple per row
+    sample = rows[::max(1, len(rows) // 256)]
+    per_row = sum(sys.getsizeof(row) + sum(sys.getsizeof(value) for value in row) for row in sample) / len(sample) \
+        if sample else 0
+    return sys.getsizeof(rows) + int(per_row * len(rows))
+
+
+class ResultCache:
+    # Results of queries the grid moved away from, evicted least recently used first once over budget. An
+    # entry is only handed back while the table's signature is the one it was stored with. put() keeps the
+    # grid's row list as it is, and compact() turns it into columns later on a worker, so the lock guards
+    # against both that and DDL on a worker thread invalidating entries.
+    def __init__(self, budget=RESULT_CACHE_BUDGET * 1024 * 1024):
+        self.budget = budget
+        self.lock = threading.Lock()
+        self.entries = collections.OrderedDict()
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+
+    def __contains__(self, key):
+        with self.lock:
+            return key in self.entries
+
+    def put(self, key, table_name, signature, state, rows):
+        # rows must not be changed afterwards; the grid replaces its list when it loads something else
+        size = rows_size(rows)
+        with self.lock:
+            self._discard(key)
+            if size > self.budget:
+                return False
+            self.entries[key] = {"table_name": table_name, "signature": signature, "state": state, "rows": rows,
+                                 "data": None, "row_count": len(rows), "size": size}
+            self.size += size
+            self._evict()
+            return True
+
+    def compact(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None or entry["rows"] is None:
+                return
+        rows = entry["rows"]
+        state = entry["state"]
+        # Key columns are decoded as they are fetched even in a raw result
+        raw = [state["decoders"] is not None and column_name not in state["key_columns"]
+               for column_name in state["columns"]]
+        data = [compact_column([row[i] for row in rows], raw[i]) for i in range(len(state["columns"]))]
+        size = sum(column_size(column) for column in data)
+        with self.lock:
+            # Taken or replaced in the meantime
+            if self.entries.get(key) is not entry:
+                return
+            entry["data"] = data
+            entry["rows"] = None
+            self.size += size - entry["size"]
+            entry["size"] = size
+            self._evict()
+
+    def take(self, key, signature, hot):
+        # The entry leaves the cache while the grid shows it, and is stored again when the grid moves on
+        with self.lock:
+            entry = self._discard(key)
+            if entry is None or signature is None or hot or signature != entry["signature"]:
+                self.misses += 1
+                return None
+            self.hits += 1
+        if entry["rows"] is not None:
+            return entry["state"], entry["rows"]
+        rows = list(zip(*entry["data"])) if entry["data"] else [()] * entry["row_count"]
+        return entry["state"], rows
+
+    def invalidate(self, *table_names):
+        # No names drops everything
+        with self.lock:
+            for key in [key for key, entry in self.entries.items()
+                        if not table_names or entry["table_name"] in table_names]:
+                self._discard(key)
+
+    def set_budget(self, budget):
+        with self.lock:
+            self.budget = budget
+            self._evict()
+
+    def _discard(self, key):
+        entry = self.entries.pop(key, None)
+        if entry is not None:
+            self.size -= entry["size"]
+        return entry
+
+    def _evict(self):
+        while self.entries and self.size > self.budget:
+            self._discard(next(iter(self.entries)))
+
+    def stats_text(self):
+        with self.lock:
+            return f"Result cache: {len(self.entries)} results, {self.size / 1048576:.1f} MB, {self.hits} hits, " \
+                   f"{self.misses} misses"
+
+
+NODE_ROLE = Qt.UserRole + 1
+SORT_ROLE = Qt.UserRole + 2
+
+
+# Seconds after which a snapshot the grid reads from is shown as stale, and how often its age is redrawn (ms)
+SNAPSHOT_STALE_AFTER = 3600
+SNAPSHOT_AGE_INTERVAL = 5000
+
+
+def format_age(seconds):
+    if seconds < 60:
+        return f"{seconds:.0f} s"
+    if seconds < 3600:
+        return f"{seconds / 60:.0f} min"
+    if seconds < 86400:
+        return f"{seconds / 3600:.1f} h"
+    return f"{seconds / 86400:.1f} days"
+
+
+def format_size(size):
+    if size is None:
+        return ""
+    for unit in ("B", "KB", "MB", "GB"):
+        if size < 1024 or unit == "GB":
+            return f"{size:.0f} {unit}" if unit == "B" else f"{size:.1f} {unit}"
+        size /= 1024
+
+
+class TableTreeModel(QStandardItemModel):
+    # Databases on the server with their tables below them. A database's tables are read when it is first
+    # expanded, and a table's columns and indexes when it is; until then a placeholder row gives the view
+    # something to draw an expand arrow for.
+    HEADERS = ["Name", "Rows", "Data", "Index", "Engine"]
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.setHorizontalHeaderLabels(self.HEADERS)
+        self.current_database = None
+
+    def make_row(self, name, node, details=()):
+        items = [QStandardItem(name)]
+        items[0].setData(node, NODE_ROLE)
+        items[0].setData(name.lower(), SORT_ROLE)
+        for text, sort_key in details:
+            item = QStandardItem(text)
+            item.setData(sort_key, SORT_ROLE)
+            items.append(item)
+        for item in items:
+            item.setEditable(False)
+        return items
+
+    def add_placeholder(self, item):
+        item.appendRow(self.make_row("Loading...", ("placeholder",)))
+
+    def is_loaded(self, item):
+        return not (item.rowCount() == 1 and item.child(0).data(NODE_ROLE)[0] == "placeholder")
+
+    def set_databases(self, database_names, current_database):
+        self.removeRows(0, self.rowCount())
+        self.current_database = current_database
+        for database_name in database_names:
+            row = self.make_row(database_name, ("database", database_name))
+            self.add_placeholder(row[0])
+            self.appendRow(row)
+        self.set_current_database(current_database)
+
+    def set_current_database(self, database_name):
+        self.current_database = database_name
+        for row in range(self.rowCount()):
+            item = self.item(row)
+            font = item.font()
+            font.setBold(item.text() == database_name)
+            item.setFont(font)
+
+    def database_item(self, database_name):
+        for row in range(self.rowCount()):
+            if self.item(row).text() == database_name:
+                return self.item(row)
+        return None
+
+    def table_row(self, table_name, rows=None, data_length=None, index_length=None, engine=None, table_type=None,
+                  database_name=None):
+        if table_type == "VIEW":
+            engine = "VIEW"
+        row = self.make_row(table_name, ("table", database_name, table_name), [
+            ("" if rows is None else f"~{rows:,}", rows or 0),
+            (format_size(data_length), data_length or 0),
+            (format_size(index_length), index_length or 0),
+            (engine or "", engine or ""),
+        ])
+        self.add_placeholder(row[0])
+        return row
+
+    def set_tables(self, database_name, tables):
+        database_item = self.database_item(database_name)
+        if database_item is None:
+            return
+        database_item.removeRows(0, database_item.rowCount())
+        for details in tables:
+            database_item.appendRow(self.table_row(*details, database_name=database_name))
+
+    def table_item(self, database_name, table_name):
+        database_item = self.database_item(database_name)
+        if database_item is None or not self.is_loaded(database_item):
+            return None
+        for row in range(database_item.rowCount()):
+            if database_item.child(row).text() == table_name:
+                return database_item.child(row)
+        return None
+
+    def add_table(self, database_name, table_name):
+        database_item = self.database_item(database_name)
+        if database_item is not None and self.is_loaded(database_item) and \
+                self.table_item(database_name, table_name) is None:
+            database_item.appendRow(self.table_row(table_name, database_name=database_name))
+
+    def remove_table(self, database_name, table_name):
+        item = self.table_item(database_name, table_name)
+        if item is not None:
+            item.parent().removeRow(item.row())
+
+    def rename_table(self, database_name, old_table_name, new_table_name):
+        item = self.table_item(database_name, old_table_name)
+        if item is not None:
+            item.setText(new_table_name)
+            item.setData(("table", database_name, new_table_name), NODE_ROLE)
+            item.setData(new_table_name.lower(), SORT_ROLE)
+            self.forget_details(item)
+
+    def forget_details(self, item):
+        # Columns or indexes changed; they are read again the next time the table is expanded
+        if item is not None and self.is_loaded(item):
+            item.removeRows(0, item.rowCount())
+            self.add_placeholder(item)
+
+    def set_table_details(self, item, schema):
+        item.removeRows(0, item.rowCount())
+        columns_item = self.make_row(f"Columns ({len(schema.columns)})", ("group",))
+        for column_name in schema.columns:
+            nullable = " NULL" if schema.nullable.get(column_name) else ""
+            columns_item[0].appendRow(self.make_row(f"{column_name} {schema.column_types.get(column_name, '')}"
+                                                    f"{nullable}", ("column",)))
+        indexes_item = self.make_row(f"Indexes ({len(schema.indexes)})", ("group",))
+        for index_name, index_columns in sorted(schema.indexes.items()):
+            if index_name == "PRIMARY":
+                label = "PRIMARY KEY"
+            elif index_name in schema.unique_indexes:
+                label = f"UNIQUE {index_name}"
+            else:
+                label = index_name
+            indexes_item[0].appendRow(self.make_row(f"{label} ({', '.join(index_columns)})", ("index",)))
+        item.appendRow(columns_item)
+        item.appendRow(indexes_item)
+
+
+class TableFilterProxy(QSortFilterProxyModel):
+    # Search as you type over the table names already in the tree. Databases stay visible while one of their
+    # tables matches, and everything below a table is left alone.
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.text = ""
+        self.setSortRole(SORT_ROLE)
+
+    def set_text(self, text):
+        self.text = text.strip().lower()
+        self.invalidateFilter()
+
+    def table_matches(self, item):
+        node = item.data(NODE_ROLE)
+        return node is not None and node[0] == "table" and self.text in node[2].lower()
+
+    def filterAcceptsRow(self, source_row, source_parent):
+        if not self.text:
+            return True
+        model = self.sourceModel()
+        if not source_parent.isValid():
+            database_item = model.item(source_row)
+            return any(self.table_matches(database_item.child(row)) for row in range(database_item.rowCount()))
+        if not source_parent.parent().isValid():
+            return self.table_matches(model.itemFromIndex(source_parent).child(source_row))
+        return True
+
+
+# File types offered when exporting
+EXPORT_FORMATS = {
+    "CSV (*.csv)": "csv",
+    "Gzipped CSV (*.csv.gz)": "csv",
+    "TSV (*.tsv)": "tsv",
+    "Gzipped TSV (*.tsv.gz)": "tsv",
+    "JSON Lines (*.jsonl)": "jsonl",
+    "Gzipped JSON Lines (*.jsonl.gz)": "jsonl",
+}
+
+
+class QueryConsole(QWidget):
+    PLAN_COLUMNS = ["Step", "Access", "Rows", "Actual rows", "Cost", "Key", "Details"]
+
+    def __init__(self, window, settings):
+        super().__init__(window)
+        self.main_window = window
+        self.settings = settings
+        self.started = None
+
+        self.editor = QPlainTextEdit()
+        self.editor.setPlaceholderText("SQL to run; Ctrl+Enter runs the selection, or the whole script")
+        self.editor.setPlainText(settings.value("console/sql", ""))
+        run_button = QPushButton("Run")
+        run_button.clicked.connect(self.run)
+        explain_button = QPushButton("Explain")
+        explain_button.clicked.connect(self.explain)
+        self.analyze_checkbox = QCheckBox("Analyze")
+        self.analyze_checkbox.setToolTip("Run the statement and show actual row counts in the plan")
+        self.status_label = QLabel()
+        QShortcut(QKeySequence("Ctrl+Return"), self.editor, self.run)
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(run_button)
+        button_layout.addWidget(explain_button)
+        button_layout.addWidget(self.analyze_checkbox)
+        button_layout.addWidget(self.status_label)
+        button_layout.addStretch()
+
+        # Results stream in through the same lazy model as the table grid; a result without a key is read-only
+        self.result_model = LazyTableModel(window.executor, window.open_display_connection, self)
+        self.result_model.rows_loaded.connect(self.result_loaded)
+        self.result_model.load_failed.connect(self.query_failed)
+        self.result_model.rowsInserted.connect(self.update_row_count)
+        self.result_table = QTableView()
+        self.result_table.setModel(self.result_model)
+        self.plan_model = QStandardItemModel()
+        self.plan_model.setHorizontalHeaderLabels(self.PLAN_COLUMNS)
+        self.plan_tree = QTreeView()
+        self.plan_tree.setModel(self.plan_model)
+        self.output_tabs = QTabWidget()
+        self.output_tabs.addTab(self.result_table, "Result")
+        self.output_tabs.addTab(self.plan_tree, "Plan")
+
+        layout = QVBoxLayout()
+        layout.addWidget(self.editor, 1)
+        layout.addLayout(button_layout)
+        layout.addWidget(self.output_tabs, 2)
+        self.setLayout(layout)
+
+    def statements(self):
+        cursor = self.editor.textCursor()
+        # QTextCursor gives paragraph separators instead of newlines
+        sql = cursor.selectedText().replace("\u2029", "\n") if cursor.hasSelection() else self.editor.toPlainText()
+        self.settings.setValue("console/sql", self.editor.toPlainText())
+        return split_statements(sql)
+
+    def run(self):
+        statements = self.statements()
+        if not statements:
+            return
+        self.main_window.workload.record_statement(db, statements[-1])
+        # Earlier statements of a script run first on the connection that streams the last one's result
+        self.started = time.perf_counter()
+        self.status_label.setText("Running...")
+        self.output_tabs.setCurrentWidget(self.result_table)
+        self.result_model.load(statements[-1], setup=statements[:-1])
+
+    def result_loaded(self):
+        if self.started is None:
+            return
+        elapsed = (time.perf_counter() - self.started) * 1000
+        self.started = None
+        if self.result_model.columns:
+            self.update_row_count()
+            self.status_label.setText(self.status_label.text() + f" in {elapsed:.0f} ms")
+        else:
+            self.status_label.setText(f"{self.result_model.affected_rows} rows affected in {elapsed:.0f} ms")
+
+    def update_row_count(self, *args):
+        more = "" if self.result_model.exhausted else "+ (scroll for more)"
+        self.status_label.setText(f"{self.result_model.rowCount()}{more} rows")
+
+    def query_failed(self, error):
+        self.started = None
+        if isinstance(error, QueryCancelled):
+            self.status_label.setText("Cancelled")
+            return
+        self.status_label.setText("Failed")
+        show_error_message(f"Query failed: {error}")
+
+    def explain(self):
+        statements = self.statements()
+        if not statements:
+            return
+        sql = statements[-1]
+        analyze = self.analyze_checkbox.isChecked()
+        if analyze and not re.match(r"\s*(SELECT|WITH|TABLE)\b", sql, re.IGNORECASE):
+            confirm = QMessageBox.question(self, "Analyze", "Analyze runs the statement, so its changes are made. "
+                                           "Continue?", QMessageBox.Yes | QMessageBox.No)
+            if confirm != QMessageBox.Yes:
+                return
+        self.status_label.setText("Explaining...")
+
+        def explained(steps):
+            self.show_plan(steps)
+            self.status_label.setText(f"Plan of {statement_shape(sql)[:80]}")
+
+        def failed(error):
+            self.status_label.setText("Failed")
+            if not isinstance(error, QueryCancelled):
+                show_error_message(f"Explain failed: {error}")
+
+        self.main_window.executor.submit("Explaining query",
+                                         lambda connection, job: explain_query(connection.cursor(), sql, analyze),
+                                         explained, failed, feature="console")
+
+    def show_plan(self, steps):
+        self.plan_model.removeRows(0, self.plan_model.rowCount())
+        self.add_plan_steps(self.plan_model.invisibleRootItem(), steps)
+        self.plan_tree.expandAll()
+        for column in range(len(self.PLAN_COLUMNS) - 1):
+            self.plan_tree.resizeColumnToContents(column)
+        self.output_tabs.setCurrentWidget(self.plan_tree)
+
+    def add_plan_steps(self, parent, steps):
+        for step in steps:
+            values = [step["step"], step["access"], step["rows"], step["actual_rows"], step["cost"], step["key"],
+                      step["details"]]
+            items = []
+            for value in values:
+                item = QStandardItem("" if value is None else str(value))
+                item.setEditable(False)
+                if step["warning"] is not None:
+                    item.setBackground(DELETED_COLOR if step["warning"] == FULL_SCAN_ACCESS["ALL"] else EDITED_COLOR)
+                    item.setToolTip(step["warning"])
+                items.append(item)
+            try:
+                many_rows = float(step["rows"] or 0) > EXPLAIN_ROWS_WARNING
+            except (TypeError, ValueError):
+                many_rows = False
+            if many_rows:
+                font = items[2].font()
+                font.setBold(True)
+                items[2].setFont(font)
+            parent.appendRow(items)
+            self.add_plan_steps(items[0], step["children"])
+
+
 class ConnectDialog(QDialog):
     def __init__(self):
         super().__init__()
@@ -79,9 +1636,188 @@ class ConnectDialog(QDialog):
         }
 
 
+class PoolSizeDialog(QDialog):
+    def __init__(self, parent, size, background_size, bulk_size):
+        super().__init__(parent)
+
+        self.setWindowTitle("Connection Pool")
+        layout = QFormLayout()
+        self.size_input = QSpinBox()
+        self.size_input.setRange(1, 32)
+        self.size_input.setValue(size)
+        self.size_input.setToolTip("Connections for table loads, edits and schema changes")
+        self.background_size_input = QSpinBox()
+        self.background_size_input.setRange(1, 8)
+        self.background_size_input.setValue(background_size)
+        self.background_size_input.setToolTip("Connections for the refresh timer")
+        self.bulk_size_input = QSpinBox()
+        self.bulk_size_input.setRange(1, 8)
+        self.bulk_size_input.setValue(bulk_size)
+        self.bulk_size_input.setToolTip("Imports, exports and compares that can run at the same time")
+        layout.addRow("Interactive connections:", self.size_input)
+        layout.addRow("Background connections:", self.background_size_input)
+        layout.addRow("Bulk connections:", self.bulk_size_input)
+
+        ok_button = QPushButton("OK")
+        ok_button.clicked.connect(self.accept)
+        layout.addRow(ok_button)
+        self.setLayout(layout)
+
+    def get_sizes(self):
+        return self.size_input.value(), self.background_size_input.value(), self.bulk_size_input.value()
+
+
+class CompareDialog(QDialog):
+    THIS_SERVER = "This server"
+
+    def __init__(self, parent, table_name, profiles):
+        super().__init__(parent)
+
+        self.setWindowTitle(f"Compare {table_name}")
+        layout = QFormLayout()
+        self.server_input = QComboBox()
+        self.server_input.addItems([self.THIS_SERVER] + sorted(profiles))
+        self.server_input.setToolTip("Saved connection profile of the server with the other table")
+        self.database_input = QLineEdit(db)
+        self.table_input = QLineEdit(table_name)
+        self.chunk_size_input = QSpinBox()
+        self.chunk_size_input.setRange(DIFF_LEAF_SIZE, 10000000)
+        self.chunk_size_input.setValue(DIFF_CHUNK_SIZE)
+        self.workers_input = QSpinBox()
+        self.workers_input.setRange(1, 32)
+        self.workers_input.setValue(DIFF_WORKERS)
+        layout.addRow("Other server:", self.server_input)
+        layout.addRow("Other database:", self.database_input)
+        layout.addRow("Other table:", self.table_input)
+        layout.addRow("Rows per chunk:", self.chunk_size_input)
+        layout.addRow("Parallel connections:", self.workers_input)
+
+        compare_button = QPushButton("Compare")
+        compare_button.clicked.connect(self.accept)
+        layout.addRow(compare_button)
+        self.setLayout(layout)
+
+    def get_details(self):
+        server = self.server_input.currentText()
+        return (None if server == self.THIS_SERVER else server, self.database_input.text(), self.table_input.text(),
+                self.chunk_size_input.value(), self.workers_input.value())
+
+
+class DiffResultDialog(QDialog):
+    def __init__(self, parent, title, summary, columns, result):
+        super().__init__(parent)
+
+        self.setWindowTitle(title)
+        self.resize(900, 500)
+        layout = QVBoxLayout()
+        layout.addWidget(QLabel(summary))
+        table = QTableWidget(len(result["differences"]), 4)
+        table.setHorizontalHeaderLabels(["Difference", "Key", "Columns", "Values (this / other)"])
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.horizontalHeader().setStretchLastSection(True)
+        for row, difference in enumerate(result["differences"]):
+            source, target = difference["source"], difference["target"]
+            if source is not None and target is not None:
+                changed = [i for i, column in enumerate(columns) if source[i] != target[i]]
+                values = "; ".join(f"{source[i]} / {target[i]}" for i in changed)
+                changed_columns = ", ".join(columns[i] for i in changed)
+            else:
+                values = ", ".join(str(value) for value in source or target)
+                changed_columns = ""
+            kind = {"missing": "Only in this table", "extra": "Only in the other table",
+                    "changed": "Values differ"}[difference["kind"]]
+            for column, value in enumerate([kind, ", ".join(str(part) for part in difference["key"]),
+                                            changed_columns, values]):
+                table.setItem(row, column, QTableWidgetItem(value))
+        layout.addWidget(table)
+        close_button = QPushButton("Close")
+        close_button.clicked.connect(self.accept)
+        layout.addWidget(close_button)
+        self.setLayout(layout)
+
+
+class IndexAdvisorDialog(QDialog):
+    COLUMNS = ["Table", "Index", "Queries", "Rows examined", "Benefit", "Why", ""]
+
+    def __init__(self, window):
+        super().__init__(window)
+        self.main_window = window
+
+        self.setWindowTitle("Index Advisor")
+        self.resize(900, 400)
+        self.summary_label = QLabel()
+        self.table = QTableWidget(0, len(self.COLUMNS))
+        self.table.setHorizontalHeaderLabels(self.COLUMNS)
+        self.table.setEditTriggers(QTableWidget.NoEditTriggers)
+        self.table.horizontalHeader().setStretchLastSection(True)
+        analyze_button = QPushButton("Analyze")
+        analyze_button.clicked.connect(self.analyze)
+        clear_button = QPushButton("Forget Workload")
+        clear_button.clicked.connect(self.clear)
+        button_layout = QHBoxLayout()
+        button_layout.addWidget(self.summary_label)
+        button_layout.addStretch()
+        button_layout.addWidget(analyze_button)
+        button_layout.addWidget(clear_button)
+        layout = QVBoxLayout()
+        layout.addWidget(self.table)
+        layout.addLayout(button_layout)
+        self.setLayout(layout)
+
+    def analyze(self):
+        patterns = self.main_window.workload.snapshot()
+        schema_name = db
+        self.summary_label.setText(f"Checking {len(patterns)} recorded queries...")
+        self.main_window.run_query("Analyzing indexes",
+                                   lambda connection, job: advise_indexes(connection.cursor(),
+                                                                          self.main_window.schema_cache, patterns,
+                                                                          schema_name),
+                                   self.show_suggestions, error_message="Index advisor failed",
+                                   feature="index advisor")
+
+    def show_suggestions(self, suggestions):
+        self.summary_label.setText(f"{len(suggestions)} suggestions from "
+                                   f"{len(self.main_window.workload.snapshot())} recorded queries")
+        self.table.setRowCount(len(suggestions))
+        for row, suggestion in enumerate(suggestions):
+            values = [suggestion["table"], f"{suggestion['name']} ({', '.join(suggestion['columns'])})",
+                      suggestion["uses"], suggestion["rows"], suggestion["benefit"], ", ".join(suggestion["reasons"])]
+            for column, value in enumerate(values):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                self.table.setItem(row, column, item)
+            create_button = QPushButton("Create")
+            create_button.clicked.connect(lambda checked, suggestion=suggestion, button=create_button:
+                                          self.create(suggestion, button))
+            self.table.setCellWidget(row, len(values), create_button)
+        self.table.resizeColumnsToContents()
+
+    def create(self, suggestion, button):
+        button.setEnabled(False)
+        table_name = suggestion["table"]
+
+        def created(algorithm):
+            button.setText("Created")
+            self.main_window.table_details_changed(table_name)
+            self.main_window.update_view_hints()
+
+        self.main_window.queue_schema_change(f"Adding index {suggestion['name']}", suggestion["sql"], [table_name],
+                                             created, "Failed to add index")
+
+    def clear(self):
+        self.main_window.workload.clear()
+        self.table.setRowCount(0)
+        self.summary_label.setText("")
+
+
 class ServerDetailsDialog(QDialog):
-    def __init__(self):
+    def __init__(self, settings=None):
         super().__init__()
+        self.settings = settings
+        self.profiles = load_profiles(settings) if settings is not None else {}
+        self.profile_input = QComboBox()
+        self.profile_input.addItems([""] + sorted(self.profiles))
+        self.profile_input.currentTextChanged.connect(self.profile_selected)
         self.host_label = QLabel("Host:")
         self.host_input = QLineEdit()
         self.user_label = QLabel("User:")
@@ -91,23 +1827,42 @@ class ServerDetailsDialog(QDialog):
         self.db_label = QLabel("Database:")
         self.db_input = QLineEdit()
 
+        self.save_profile_input = QLineEdit()
+        self.save_profile_input.setPlaceholderText("Profile name (optional)")
+        self.auto_connect_checkbox = QCheckBox("Connect with this profile on startup")
+
         layout = QGridLayout()
-        layout.addWidget(self.host_label, 0, 0)
-        layout.addWidget(self.host_input, 0, 1)
-        layout.addWidget(self.user_label, 1, 0)
-        layout.addWidget(self.user_input, 1, 1)
-        layout.addWidget(self.password_label, 2, 0)
-        layout.addWidget(self.password_input, 2, 1)
-        layout.addWidget(self.db_label, 3, 0)
-        layout.addWidget(self.db_input, 3, 1)
+        layout.addWidget(QLabel("Profile:"), 0, 0)
+        layout.addWidget(self.profile_input, 0, 1)
+        layout.addWidget(self.host_label, 1, 0)
+        layout.addWidget(self.host_input, 1, 1)
+        layout.addWidget(self.user_label, 2, 0)
+        layout.addWidget(self.user_input, 2, 1)
+        layout.addWidget(self.password_label, 3, 0)
+        layout.addWidget(self.password_input, 3, 1)
+        layout.addWidget(self.db_label, 4, 0)
+        layout.addWidget(self.db_input, 4, 1)
+        layout.addWidget(QLabel("Save as:"), 5, 0)
+        layout.addWidget(self.save_profile_input, 5, 1)
+        layout.addWidget(self.auto_connect_checkbox, 6, 1)
 
         self.submit_button = QPushButton("Submit")
         self.submit_button.clicked.connect(self.accept)
-        layout.addWidget(self.submit_button, 4, 1)
+        layout.addWidget(self.submit_button, 7, 1)
 
         self.setLayout(layout)
         self.setWindowTitle("Server Details")
 
+    def profile_selected(self, name):
+        profile = self.profiles.get(name)
+        if profile is None:
+            return
+        self.host_input.setText(profile["host"])
+        self.user_input.setText(profile["user"])
+        self.password_input.clear()
+        self.db_input.setText(profile["db"])
+        self.save_profile_input.setText(name)
+
     def get_details(self):
         host = self.host_input.text()
         user = self.user_input.text()
@@ -115,39 +1870,550 @@ class ServerDetailsDialog(QDialog):
         db = self.db_input.text()
         return host, user, password, db
 
+    def save(self):
+        # Called once the details are known to work
+        name = self.save_profile_input.text().strip()
+        if self.settings is None or not name:
+            return
+        host, user, _, db = self.get_details()
+        save_profile(self.settings, name, host, user, db)
+        if self.auto_connect_checkbox.isChecked():
+            self.settings.setValue("connection/auto_connect_profile", name)
+
+
+class ImportDialog(QDialog):
+    DELIMITERS = {"Auto": None, "Comma": ",", "Tab": "\t", "Semicolon": ";", "Pipe": "|"}
+    SKIP = "(skip)"
+
+    def __init__(self, parent, table_name, table_columns, local_infile_available, resume_rows):
+        super().__init__(parent)
+        self.table_columns = table_columns
+        self.resume_rows = resume_rows
+        self.file_columns = []
+        self.setWindowTitle(f"Import into {table_name}")
+
+        self.path_input = QLineEdit()
+        self.path_input.editingFinished.connect(self.reload_file)
+        browse_button = QPushButton("Browse...")
+        browse_button.clicked.connect(self.browse)
+        path_layout = QHBoxLayout()
+        path_layout.addWidget(self.path_input)
+        path_layout.addWidget(browse_button)
+
+        self.delimiter_input = QComboBox()
+        self.delimiter_input.addItems(list(self.DELIMITERS))
+        self.delimiter_input.currentIndexChanged.connect(self.reload_file)
+        self.header_checkbox = QCheckBox("First row is a header")
+        self.header_checkbox.setChecked(True)
+        self.header_checkbox.toggled.connect(self.reload_file)
+        self.mapping_table = QTableWidget(0, 2)
+        self.mapping_table.setHorizontalHeaderLabels(["File column", "Table column"])
+        self.batch_size_input = QSpinBox()
+        self.batch_size_input.setRange(1, 1000000)
+        self.batch_size_input.setValue(IMPORT_BATCH_SIZE)
+        self.start_row_input = QSpinBox()
+        self.start_row_input.setRange(0, 2 ** 31 - 1)
+        self.empty_as_null_checkbox = QCheckBox("Empty values are NULL")
+        self.empty_as_null_checkbox.setChecked(True)
+        self.load_data_checkbox = QCheckBox("Use LOAD DATA LOCAL INFILE")
+        self.load_data_checkbox.setEnabled(local_infile_available)
+        if not local_infile_available:
+            self.load_data_checkbox.setToolTip("The server has local_infile turned off")
+
+        import_button = QPushButton("Import")
+        import_button.clicked.connect(self.accept)
+        cancel_button = QPushButton("Cancel")
+        cancel_button.clicked.connect(self.reject)
+        button_layout = QHBoxLayout()
+        button_layout.addStretch()
+        button_layout.addWidget(import_button)
+        button_layout.addWidget(cancel_button)
 
-class MainWindow(QMainWindow):
-    def __init__(self):
-        global host, user, password, db
-        super().__init__()
+        layout = QFormLayout()
+        layout.addRow("File:", path_layout)
+        layout.addRow("Delimiter:", self.delimiter_input)
+        layout.addRow(self.header_checkbox)
+        layout.addRow(self.mapping_table)
+        layout.addRow("Rows per batch:", self.batch_size_input)
+        layout.addRow("Start at data row:", self.start_row_input)
+        layout.addRow(self.empty_as_null_checkbox)
+        layout.addRow(self.load_data_checkbox)
+        layout.addRow(button_layout)
+        self.setLayout(layout)
+        self.resize(520, 480)
+
+    def browse(self):
+        path, _ = QFileDialog.getOpenFileName(self, "Import File", "", "Delimited files (*.csv *.tsv *.txt *.tab);;"
+                                                                      "All files (*)")
+        if path:
+            self.path_input.setText(path)
+            self.reload_file()
+
+    def delimiter(self):
+        delimiter = self.DELIMITERS[self.delimiter_input.currentText()]
+        if delimiter is None:
+            delimiter = detect_delimiter(self.path_input.text())
+        return delimiter
+
+    def reload_file(self):
+        path = self.path_input.text()
+        self.mapping_table.setRowCount(0)
+        self.file_columns = []
+        if not path or not os.path.isfile(path):
+            return
+        try:
+            first_row = read_file_header(path, self.delimiter())
+        except (OSError, UnicodeError) as e:
+            show_error_message(f"Could not read {path}: {e}")
+            return
+        has_header = self.header_checkbox.isChecked()
+        self.file_columns = first_row if has_header else [f"Column {i + 1}" for i in range(len(first_row))]
+        matches = dict(match_import_columns(self.file_columns, self.table_columns, has_header))
+        self.mapping_table.setRowCount(len(self.file_columns))
+        for row, file_column in enumerate(self.file_columns):
+            self.mapping_table.setItem(row, 0, QTableWidgetItem(file_column))
+            target = QComboBox()
+            target.addItems([self.SKIP] + self.table_columns)
+            if row in matches:
+                target.setCurrentText(matches[row])
+            self.mapping_table.setCellWidget(row, 1, target)
+        self.start_row_input.setValue(self.resume_rows(path))
+
+    def get_options(self):
+        mapping = []
+        for row in range(self.mapping_table.rowCount()):
+            column_name = self.mapping_table.cellWidget(row, 1).currentText()
+            if column_name != self.SKIP:
+                mapping.append((row, column_name))
+        return {
+            "path": self.path_input.text(),
+            "delimiter": self.delimiter(),
+            "has_header": self.header_checkbox.isChecked(),
+            "mapping": mapping,
+            "file_column_count": len(self.file_columns),
+            "batch_size": self.batch_size_input.value(),
+            "start_row": self.start_row_input.value(),
+            "empty_as_null": self.empty_as_null_checkbox.isChecked(),
+            "load_data": self.load_data_checkbox.isChecked(),
+        }
 
-        server_details_dialog = ServerDetailsDialog()
-        if server_details_dialog.exec_() == QDialog.Accepted:
-            host, user, password, db = server_details_dialog.get_details()
 
+class QueryLogDock(QDockWidget):
+    SLOW_COLUMNS = ["Time", "Feature", "ms", "Rows", "Bytes", "Statement", "Parameters"]
+    SHAPE_COLUMNS = ["Feature", "Count", "Total ms", "Mean ms", "Max ms", "Rows", "Bytes", "Errors", "Statement"]
+
+    def __init__(self, parent, settings):
+        super().__init__("Query Log", parent)
+        self.setObjectName("query_log_dock")
+        self.settings = settings
+
+        self.threshold_input = QSpinBox()
+        self.threshold_input.setRange(0, 3600000)
+        self.threshold_input.setSuffix(" ms")
+        self.threshold_input.setValue(int(settings.value("query_log/slow_ms", SLOW_QUERY_THRESHOLD)))
+        self.threshold_input.valueChanged.connect(self.threshold_changed)
+        query_log.set_slow_threshold(self.threshold_input.value())
+        self.summary_label = QLabel()
+        export_button = QPushButton("Export JSON...")
+        export_button.clicked.connect(self.export)
+        clear_button = QPushButton("Clear")
+        clear_button.clicked.connect(self.clear)
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(QLabel("Slow threshold:"))
+        top_layout.addWidget(self.threshold_input)
+        top_layout.addWidget(self.summary_label)
+        top_layout.addStretch()
+        top_layout.addWidget(export_button)
+        top_layout.addWidget(clear_button)
+
+        self.slow_table = self.make_table(self.SLOW_COLUMNS)
+        self.shape_table = self.make_table(self.SHAPE_COLUMNS)
+        tabs = QTabWidget()
+        tabs.addTab(self.slow_table, "Slow statements")
+        tabs.addTab(self.shape_table, "By statement shape")
+
+        layout = QVBoxLayout()
+        layout.addLayout(top_layout)
+        layout.addWidget(tabs)
+        widget = QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+
+        # Only redrawn while the panel is visible
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.update_tables)
+        self.visibilityChanged.connect(self.visibility_changed)
+
+    @staticmethod
+    def make_table(headers, sortable=True):
+        table = QTableWidget(0, len(headers))
+        table.setHorizontalHeaderLabels(headers)
+        table.setEditTriggers(QTableWidget.NoEditTriggers)
+        table.setSortingEnabled(sortable)
+        table.horizontalHeader().setStretchLastSection(True)
+        return table
+
+    def visibility_changed(self, visible):
+        if visible:
+            self.update_tables()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def threshold_changed(self, value):
+        self.settings.setValue("query_log/slow_ms", value)
+        query_log.set_slow_threshold(value)
+        self.update_tables()
+
+    @staticmethod
+    def fill_table(table, rows):
+        sortable = table.isSortingEnabled()
+        table.setSortingEnabled(False)
+        table.setRowCount(len(rows))
+        for row, values in enumerate(rows):
+            for column, value in enumerate(values):
+                item = QTableWidgetItem()
+                item.setData(Qt.DisplayRole, value)
+                table.setItem(row, column, item)
+        table.setSortingEnabled(sortable)
+
+    def update_tables(self):
+        snapshot = query_log.snapshot()
+        slow = sorted(snapshot["slow"], key=lambda entry: entry["seconds"], reverse=True)
+        self.fill_table(self.slow_table, [
+            [time.strftime("%H:%M:%S", time.localtime(entry["time"])), entry["feature"],
+             round(entry["seconds"] * 1000, 1), entry["rows"], entry["bytes"],
+             entry["sql"] if entry["error"] is None else f"{entry['sql']} -- {entry['error']}", entry["params"] or ""]
+            for entry in slow])
+        shapes = sorted(snapshot["shapes"], key=lambda totals: totals["seconds"], reverse=True)
+        self.fill_table(self.shape_table, [
+            [totals["feature"], totals["count"], round(totals["seconds"] * 1000, 1),
+             round(totals["seconds"] * 1000 / totals["count"], 2), round(totals["max_seconds"] * 1000, 1),
+             totals["rows"], totals["bytes"], totals["errors"], totals["shape"]]
+            for totals in shapes])
+        total_seconds = sum(totals["seconds"] for totals in snapshot["shapes"])
+        self.summary_label.setText(f"{snapshot['statements']} statements, {total_seconds:.2f} s, "
+                                   f"{len(slow)} slow")
+
+    def export(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Export Query Log", "query_log.json", "JSON (*.json)")
+        if not path:
+            return
         try:
-            self.db = pymysql.connect(host=host, user=user, password=password, db=db)
-            self.cursor = self.db.cursor()
-        except pymysql.Error as e:
-            print("Error connecting to database:", e)
-            sys.exit(1)
+            query_log.export(path)
+        except OSError as e:
+            show_error_message(f"Failed to export query log: {e}")
+
+    def clear(self):
+        query_log.clear()
+        self.update_tables()
+
+
+# The watchdog's heartbeat interval, the shortest delay counted as a stall, the stall length at which the
+# blocking stack is kept (all in milliseconds), and the histogram buckets stalls are counted in
+HEARTBEAT_INTERVAL = 50
+STALL_MIN = 50
+STALL_THRESHOLD = 200
+STALL_BUCKETS = [100, 200, 500, 1000, 2000, 5000]
+STALL_RECENT_ENTRIES = 100
+HEARTBEAT_SAMPLES = 1200
+
+
+def frame_handler(frames):
+    # The event handler a main thread stack is in: the outermost method under the event loop, named after its
+    # class, or else the first function below the module
+    for frame in frames:
+        owner = frame.f_locals.get("self")
+        if owner is not None:
+            return f"{type(owner).__name__}.{frame.f_code.co_name}"
+    for frame in frames[1:]:
+        if frame.f_code.co_name != "<lambda>":
+            return frame.f_code.co_name
+    return "event loop"
+
+
+class StallWatchdog(QObject):
+    # Measures how responsive the main thread is from how late a heartbeat timer fires. A sampler thread
+    # looks at the main thread's stack while a beat is overdue, so a stall is put down to the handler that
+    # was running and, past the threshold, the stack of the blocking call is kept. Modal dialogs keep the
+    # event loop running, so the time spent in them is counted separately.
+    def __init__(self, parent=None, threshold=STALL_THRESHOLD):
+        super().__init__(parent)
+        self.threshold = threshold
+        self.lock = threading.Lock()
+        self.main_thread_id = threading.get_ident()
+        self.last_beat = time.perf_counter()
+        self.sampled_handler = None
+        self.sampled_stack = None
+        self.latencies = collections.deque(maxlen=HEARTBEAT_SAMPLES)
+        self.handlers = {}
+        self.recent = collections.deque(maxlen=STALL_RECENT_ENTRIES)
+        self.modal = {}
+        self.running = False
+        self.timer = QTimer(self)
+        self.timer.setTimerType(Qt.PreciseTimer)
+        self.timer.setInterval(HEARTBEAT_INTERVAL)
+        self.timer.timeout.connect(self.beat)
+
+    def start(self):
+        self.running = True
+        self.last_beat = time.perf_counter()
+        self.timer.start()
+        threading.Thread(target=self.sample, name="stall watchdog", daemon=True).start()
+
+    def stop(self):
+        self.running = False
+        self.timer.stop()
+
+    def set_threshold(self, threshold):
+        self.threshold = threshold
+
+    def beat(self):
+        now = time.perf_counter()
+        delay = (now - self.last_beat) * 1000 - HEARTBEAT_INTERVAL
+        self.last_beat = now
+        modal = QApplication.activeModalWidget()
+        with self.lock:
+            self.latencies.append(max(delay, 0))
+            if modal is not None:
+                title = modal.windowTitle() or type(modal).__name__
+                self.modal[title] = self.modal.get(title, 0) + (delay + HEARTBEAT_INTERVAL)
+            handler, stack = self.sampled_handler, self.sampled_stack
+            self.sampled_handler = self.sampled_stack = None
+            if delay < STALL_MIN:
+                return
+            handler = handler or "unknown"
+            totals = self.handlers.setdefault(handler, {"count": 0, "total": 0.0, "max": 0.0,
+                                                        "buckets": [0] * (len(STALL_BUCKETS) + 1)})
+            totals["count"] += 1
+            totals["total"] += delay
+            totals["max"] = max(totals["max"], delay)
+            totals["buckets"][bisect.bisect_right(STALL_BUCKETS, delay)] += 1
+            if delay >= self.threshold:
+                self.recent.append({"time": time.time(), "ms": delay, "handler": handler, "stack": stack})
+
+    def sample(self):
+        import traceback
+        while self.running:
+            time.sleep(HEARTBEAT_INTERVAL / 4000)
+            overdue = (time.perf_counter() - self.last_beat) * 1000 - HEARTBEAT_INTERVAL
+            if overdue < STALL_MIN / 2:
+                continue
+            with self.lock:
+                need_handler = self.sampled_handler is None
+                need_stack = self.sampled_stack is None and overdue >= self.threshold
+            if not (need_handler or need_stack):
+                continue
+            frame = sys._current_frames().get(self.main_thread_id)
+            frames = []
+            while frame is not None:
+                frames.append(frame)
+                frame = frame.f_back
+            frames.reverse()
+            handler = frame_handler(frames)
+            stack = "".join(traceback.format_list(traceback.extract_stack(frames[-1]))) if need_stack and frames \
+                else None
+            del frames
+            with self.lock:
+                if need_handler:
+                    self.sampled_handler = handler
+                if stack is not None:
+                    self.sampled_stack = stack
+
+    def snapshot(self):
+        with self.lock:
+            latencies = sorted(self.latencies)
+            return {
+                "latency": {percentile: latencies[min(len(latencies) - 1, int(len(latencies) * percentile / 100))]
+                            for percentile in (50, 95, 99)} if latencies else {},
+                "max_latency": latencies[-1] if latencies else 0,
+                "handlers": {handler: dict(totals, buckets=list(totals["buckets"]))
+                             for handler, totals in self.handlers.items()},
+                "recent": list(self.recent),
+                "modal": dict(self.modal),
+            }
+
+    def clear(self):
+        with self.lock:
+            self.latencies.clear()
+            self.handlers.clear()
+            self.recent.clear()
+            self.modal.clear()
+
+
+class DiagnosticsDock(QDockWidget):
+    HANDLER_COLUMNS = ["Handler", "Stalls", "Total ms", "Max ms"] + \
+        [f"<{bucket} ms" for bucket in STALL_BUCKETS] + [f">={STALL_BUCKETS[-1]} ms"]
+    STALL_COLUMNS = ["Time", "ms", "Handler"]
+
+    def __init__(self, parent, settings, watchdog):
+        super().__init__("Diagnostics", parent)
+        self.setObjectName("diagnostics_dock")
+        self.settings = settings
+        self.watchdog = watchdog
+
+        self.threshold_input = QSpinBox()
+        self.threshold_input.setRange(STALL_MIN, 60000)
+        self.threshold_input.setSuffix(" ms")
+        self.threshold_input.setValue(watchdog.threshold)
+        self.threshold_input.setToolTip("Stalls at least this long keep the stack of the blocking call")
+        self.threshold_input.valueChanged.connect(self.threshold_changed)
+        self.summary_label = QLabel()
+        clear_button = QPushButton("Clear")
+        clear_button.clicked.connect(self.clear)
+        top_layout = QHBoxLayout()
+        top_layout.addWidget(QLabel("Stack threshold:"))
+        top_layout.addWidget(self.threshold_input)
+        top_layout.addWidget(self.summary_label)
+        top_layout.addStretch()
+        top_layout.addWidget(clear_button)
+
+        self.handler_table = QueryLogDock.make_table(self.HANDLER_COLUMNS)
+        self.stall_table = QueryLogDock.make_table(self.STALL_COLUMNS, sortable=False)
+        self.stall_table.currentCellChanged.connect(self.stall_selected)
+        self.stack_view = QPlainTextEdit()
+        self.stack_view.setReadOnly(True)
+        stall_layout = QHBoxLayout()
+        stall_layout.addWidget(self.stall_table)
+        stall_layout.addWidget(self.stack_view)
+        stall_widget = QWidget()
+        stall_widget.setLayout(stall_layout)
+        tabs = QTabWidget()
+        tabs.addTab(self.handler_table, "Stalls by handler")
+        tabs.addTab(stall_widget, "Long stalls")
+
+        layout = QVBoxLayout()
+        layout.addLayout(top_layout)
+        layout.addWidget(tabs)
+        widget = QWidget()
+        widget.setLayout(layout)
+        self.setWidget(widget)
+        self.stalls = []
+
+        # Only redrawn while the panel is visible
+        self.timer = QTimer(self)
+        self.timer.setInterval(1000)
+        self.timer.timeout.connect(self.update_tables)
+        self.visibilityChanged.connect(self.visibility_changed)
+
+    def visibility_changed(self, visible):
+        if visible:
+            self.update_tables()
+            self.timer.start()
+        else:
+            self.timer.stop()
+
+    def threshold_changed(self, value):
+        self.settings.setValue("diagnostics/stall_ms", value)
+        self.watchdog.set_threshold(value)
+
+    def update_tables(self):
+        snapshot = self.watchdog.snapshot()
+        handlers = sorted(snapshot["handlers"].items(), key=lambda item: item[1]["total"], reverse=True)
+        rows = [[handler, totals["count"], round(totals["total"]), round(totals["max"])] + totals["buckets"]
+                for handler, totals in handlers]
+        rows += [[f"modal: {title}", "", round(total), ""] + [""] * (len(STALL_BUCKETS) + 1)
+                 for title, total in snapshot["modal"].items()]
+        QueryLogDock.fill_table(self.handler_table, rows)
+        self.stalls = list(reversed(snapshot["recent"]))
+        QueryLogDock.fill_table(self.stall_table, [
+            [time.strftime("%H:%M:%S", time.localtime(stall["time"])), round(stall["ms"]), stall["handler"]]
+            for stall in self.stalls])
+        latency = snapshot["latency"]
+        if latency:
+            self.summary_label.setText(f"Event loop latency p50 {latency[50]:.0f} ms, p95 {latency[95]:.0f} ms, "
+                                       f"p99 {latency[99]:.0f} ms, max {snapshot['max_latency']:.0f} ms")
+
+    def stall_selected(self, row, *args):
+        if 0 <= row < len(self.stalls):
+            self.stack_view.setPlainText(self.stalls[row]["stack"] or "No stack was captured for this stall.")
+
+    def clear(self):
+        self.watchdog.clear()
+        self.update_tables()
+        self.stack_view.clear()
+
+
+class MainWindow(QMainWindow):
+    def __init__(self, profile=None):
+        global host, user, password, db
+        super().__init__()
+        self.settings = QSettings(SETTINGS_NAME, SETTINGS_NAME)
+
+        # A saved profile, from --profile or one set to connect on startup, skips the server details dialog
+        self.server_details_dialog = None
+        profiles = load_profiles(self.settings)
+        profile = profile or self.settings.value("connection/auto_connect_profile", "")
+        if profile in profiles:
+            details = profiles[profile]
+            host, user, db = details["host"], details["user"], details["db"]
+            password = details["password"]
+            if password is None:
+                password, ok = QInputDialog.getText(None, "Password", f"Password for {user}@{host}:",
+                                                    QLineEdit.Password)
+                if not ok:
+                    sys.exit(0)
+        else:
+            if profile:
+                print(f"No saved connection profile named '{profile}'")
+            if not self.ask_server_details():
+                sys.exit(0)
+        startup_profile.mark("connection details")
+
+        # All queries run on the executor; the server is reached in the background once the window is up
+        self.executor = QueryExecutor(self.open_connection, self,
+                                      int(self.settings.value("pool/size", POOL_SIZE)),
+                                      int(self.settings.value("pool/background_size", BACKGROUND_POOL_SIZE)),
+                                      self.prepare_connection,
+                                      int(self.settings.value("pool/bulk_size", BULK_POOL_SIZE)))
+        self.executor.job_started.connect(self.update_query_status)
+        self.executor.job_finished.connect(self.update_query_status)
+        self.executor.job_progress.connect(self.update_query_status)
+        self.schema_cache = SchemaCache()
 
         # Initialize main layout
         main_layout = QVBoxLayout()
 
         # Initialize table and value viewer
         self.setWindowIcon(QIcon(resource_path("images/sql.ico")))
-        startup_message()
-        self.table_tree = QTreeWidget()
-        self.table_tree.setHeaderLabels(["Tables"])
-        self.table_tree.itemClicked.connect(self.show_table_values)
-        self.value_table = QTableWidget()
-        self.value_table.setColumnCount(2)
-        self.value_table.itemChanged.connect(self.update_table_value)
-
+        # Shown once the event loop runs, so the window and the connection do not wait for it
+        QTimer.singleShot(0, startup_message)
+        # Databases and their tables; details are read as nodes are expanded and the search box only filters
+        # names already loaded
+        self.tree_model = TableTreeModel(self)
+        self.tree_proxy = TableFilterProxy(self)
+        self.tree_proxy.setSourceModel(self.tree_model)
+        self.table_tree = QTreeView()
+        self.table_tree.setModel(self.tree_proxy)
+        self.table_tree.setUniformRowHeights(True)
+        self.table_tree.setSortingEnabled(True)
+        self.table_tree.sortByColumn(0, Qt.AscendingOrder)
+        self.table_tree.clicked.connect(self.tree_clicked)
+        self.table_tree.expanded.connect(self.tree_expanded)
+        self.table_search_input = QLineEdit()
+        self.table_search_input.setPlaceholderText("Search tables")
+        self.table_search_input.setClearButtonEnabled(True)
+        self.table_search_timer = QTimer(self)
+        self.table_search_timer.setSingleShot(True)
+        self.table_search_timer.setInterval(150)
+        self.table_search_timer.timeout.connect(self.search_tables)
+        self.table_search_input.textChanged.connect(lambda text: self.table_search_timer.start())
+        self.table_model = LazyTableModel(self.executor, self.open_display_connection, self)
+        self.table_model.pending_changed.connect(self.update_pending_status)
+        self.table_model.rows_loaded.connect(self.update_page_controls)
+        self.table_model.load_failed.connect(self.table_load_failed)
+        self.value_table = QTableView()
+        self.value_table.setModel(self.table_model)
+
+        # Auto-refresh polls for changes and patches the grid; the interval adapts to how busy the table is
+        self.refresh_tracker = TableChangeTracker()
+        # Table the user was last told only has the rows in view checked
+        self.unsigned_notice = None
         self.timer = QTimer(self)
-        self.timer.timeout.connect(self.refresh_table)
-        self.timer.start(1000)  #
+        self.timer.setSingleShot(True)
+        self.timer.timeout.connect(self.poll_table_changes)
+        self.timer.start(self.refresh_tracker.interval)
 
         # Initialize buttons
         add_table_button = QPushButton("Add Table")
@@ -166,6 +2432,12 @@ class MainWindow(QMainWindow):
         add_column_button.clicked.connect(self.add_column)
         remove_column_button = QPushButton("Remove Column")
         remove_column_button.clicked.connect(self.remove_column)
+        import_button = QPushButton("Import File")
+        import_button.clicked.connect(self.import_file)
+        export_button = QPushButton("Export")
+        export_button.clicked.connect(self.export_table)
+        compare_button = QPushButton("Compare")
+        compare_button.clicked.connect(self.compare_table)
 
         # Add buttons to button layout
         button_layout = QHBoxLayout()
@@ -177,21 +2449,200 @@ class MainWindow(QMainWindow):
         button_layout.addWidget(add_column_button)
         button_layout.addWidget(edit_value_button)
         button_layout.addWidget(remove_column_button)
+        button_layout.addWidget(import_button)
+        button_layout.addWidget(export_button)
+        button_layout.addWidget(compare_button)
+
+        # Staged changes bar
+        self.pending_label = QLabel()
+        self.apply_button = QPushButton("Apply Changes")
+        self.apply_button.clicked.connect(self.apply_changes)
+        self.discard_button = QPushButton("Discard Changes")
+        self.discard_button.clicked.connect(self.discard_changes)
+        self.batch_size_input = QSpinBox()
+        self.batch_size_input.setRange(1, 100000)
+        self.batch_size_input.setValue(int(self.settings.value("edits/batch_size", EDIT_BATCH_SIZE)))
+        self.batch_size_input.valueChanged.connect(lambda value: self.settings.setValue("edits/batch_size", value))
+        pending_layout = QHBoxLayout()
+        pending_layout.addWidget(self.pending_label)
+        pending_layout.addStretch()
+        pending_layout.addWidget(QLabel("Batch size:"))
+        pending_layout.addWidget(self.batch_size_input)
+        pending_layout.addWidget(self.apply_button)
+        pending_layout.addWidget(self.discard_button)
+        self.update_pending_status()
+
+        # Paged browsing bar
+        self.page_direction = "first"
+        self.paged_checkbox = QCheckBox("Paged")
+        self.paged_checkbox.setChecked(self.settings.value("browse/paged", False, type=bool))
+        self.paged_checkbox.toggled.connect(self.paged_mode_toggled)
+        self.page_size_input = QSpinBox()
+        self.page_size_input.setRange(1, 100000)
+        self.page_size_input.setValue(int(self.settings.value("browse/page_size", PAGE_SIZE)))
+        self.page_size_input.valueChanged.connect(lambda value: self.settings.setValue("browse/page_size", value))
+        self.cache_budget_input = QSpinBox()
+        self.cache_budget_input.setRange(0, 65536)
+        self.cache_budget_input.setSuffix(" MB")
+        self.cache_budget_input.setValue(int(self.settings.value("cache/budget_mb", RESULT_CACHE_BUDGET)))
+        self.cache_budget_input.setToolTip("Memory kept for results of tables you switched away from")
+        self.cache_budget_input.valueChanged.connect(self.result_cache_budget_changed)
+        self.result_cache = ResultCache(self.cache_budget_input.value() * 1024 * 1024)
+        self.load_generation = 0
+        self.first_page_button = QPushButton("First")
+        self.first_page_button.clicked.connect(lambda: self.load_page("first"))
+        self.prev_page_button = QPushButton("Prev")
+        self.prev_page_button.clicked.connect(lambda: self.load_page("prev"))
+        self.next_page_button = QPushButton("Next")
+        self.next_page_button.clicked.connect(lambda: self.load_page("next"))
+        self.last_page_button = QPushButton("Last")
+        self.last_page_button.clicked.connect(lambda: self.load_page("last"))
+        self.jump_key_input = QLineEdit()
+        self.jump_key_input.setPlaceholderText("Jump to key")
+        self.jump_key_input.returnPressed.connect(self.jump_to_key)
+        jump_button = QPushButton("Go")
+        jump_button.clicked.connect(self.jump_to_key)
+        self.page_label = QLabel()
+        self.page_warning_label = QLabel()
+        self.page_warning_label.setStyleSheet("color: #b00000")
+        page_layout = QHBoxLayout()
+        page_layout.addWidget(self.paged_checkbox)
+        page_layout.addWidget(QLabel("Page size:"))
+        page_layout.addWidget(self.page_size_input)
+        page_layout.addWidget(self.first_page_button)
+        page_layout.addWidget(self.prev_page_button)
+        page_layout.addWidget(self.next_page_button)
+        page_layout.addWidget(self.last_page_button)
+        page_layout.addWidget(self.jump_key_input)
+        page_layout.addWidget(jump_button)
+        page_layout.addWidget(self.page_label)
+        page_layout.addWidget(self.page_warning_label)
+        page_layout.addStretch()
+        page_layout.addWidget(QLabel("Result cache:"))
+        page_layout.addWidget(self.cache_budget_input)
+        self.update_page_controls()
+
+        # Header clicks sort and the filter bar filters on the server, through the same loading path
+        self.sort_column = None
+        self.sort_descending = False
+        self.filters = []
+        header = self.value_table.horizontalHeader()
+        header.setSectionsClickable(True)
+        header.sectionClicked.connect(self.header_clicked)
+        self.filter_column_input = QComboBox()
+        self.filter_operator_input = QComboBox()
+        self.filter_operator_input.addItems(FILTER_OPERATORS)
+        self.filter_value_input = QLineEdit()
+        self.filter_value_input.setPlaceholderText("Value")
+        self.filter_value_input.returnPressed.connect(self.add_filter)
+        add_filter_button = QPushButton("Add Filter")
+        add_filter_button.clicked.connect(self.add_filter)
+        clear_filters_button = QPushButton("Clear Filters")
+        clear_filters_button.clicked.connect(self.clear_filters)
+        self.filters_label = QLabel()
+        self.index_hint_label = QLabel()
+        filter_layout = QHBoxLayout()
+        filter_layout.addWidget(QLabel("Filter:"))
+        filter_layout.addWidget(self.filter_column_input)
+        filter_layout.addWidget(self.filter_operator_input)
+        filter_layout.addWidget(self.filter_value_input)
+        filter_layout.addWidget(add_filter_button)
+        filter_layout.addWidget(clear_filters_button)
+        filter_layout.addWidget(self.filters_label)
+        filter_layout.addStretch()
+        filter_layout.addWidget(self.index_hint_label)
+        self.table_model.rows_loaded.connect(self.update_filter_columns)
 
         # Add table and button layouts to main layout
+        main_layout.addWidget(self.table_search_input)
         main_layout.addWidget(self.table_tree)
+        main_layout.addLayout(page_layout)
+        main_layout.addLayout(filter_layout)
         main_layout.addWidget(self.value_table)
+        main_layout.addLayout(pending_layout)
         main_layout.addLayout(button_layout)
 
+        # Running query indicator with a cancel button in the status bar
+        self.query_status_label = QLabel()
+        self.query_progress = QProgressBar()
+        self.query_progress.setRange(0, 0)
+        self.query_progress.setMaximumWidth(120)
+        self.cancel_query_button = QPushButton("Cancel")
+        self.cancel_query_button.clicked.connect(self.cancel_queries)
+        self.schema_cache_label = QLabel()
+        self.schema_change_label = QLabel()
+        self.snapshot_label = QLabel()
+        self.statusBar().addPermanentWidget(self.snapshot_label)
+        self.statusBar().addPermanentWidget(self.schema_change_label)
+        self.pool_label = QLabel()
+        self.statusBar().addPermanentWidget(self.schema_cache_label)
+        self.statusBar().addPermanentWidget(self.pool_label)
+        self.statusBar().addPermanentWidget(self.query_status_label)
+        self.statusBar().addPermanentWidget(self.query_progress)
+        self.statusBar().addPermanentWidget(self.cancel_query_button)
+        self.update_query_status()
+
         # Set main widget and window properties
         main_widget = QWidget()
         main_widget.setLayout(main_layout)
-        self.setCentralWidget(main_widget)
+        # Filters and sorts people use, kept across sessions for the index advisor
+        self.workload = WorkloadRecorder()
+        self.workload.load(self.settings.value("advisor/workload", ""))
+        self.query_console = QueryConsole(self, self.settings)
+        self.tabs = QTabWidget()
+        self.tabs.addTab(main_widget, "Browse")
+        self.tabs.addTab(self.query_console, "Query")
+        self.setCentralWidget(self.tabs)
         self.setWindowTitle("SQL Database Manager")
         self.setWindowIcon(QIcon(resource_path("images/sql.ico")))
 
-        # Populate table tree with existing tables
-        self.populate_table_tree()
+        # Statement timings from every connection, in a panel that can be docked anywhere
+        self.query_log_dock = QueryLogDock(self, self.settings)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.query_log_dock)
+        self.query_log_dock.hide()
+        self.watchdog = StallWatchdog(self, int(self.settings.value("diagnostics/stall_ms", STALL_THRESHOLD)))
+        self.watchdog.start()
+        self.diagnostics_dock = DiagnosticsDock(self, self.settings, self.watchdog)
+        self.addDockWidget(Qt.BottomDockWidgetArea, self.diagnostics_dock)
+        self.diagnostics_dock.hide()
+        view_menu = self.menuBar().addMenu("View")
+        view_menu.addAction(self.query_log_dock.toggleViewAction())
+        view_menu.addAction(self.diagnostics_dock.toggleViewAction())
+        self.raw_fetch_action = view_menu.addAction("Decode Values Only When Shown")
+        self.raw_fetch_action.setCheckable(True)
+        self.raw_fetch_action.setChecked(self.settings.value("browse/raw_fetch", True, type=bool))
+        self.raw_fetch_action.toggled.connect(lambda checked: self.settings.setValue("browse/raw_fetch", checked))
+        connection_menu = self.menuBar().addMenu("Connection")
+        connection_menu.addAction("Pool Size...", self.change_pool_size)
+        tools_menu = self.menuBar().addMenu("Tools")
+        tools_menu.addAction("Index Advisor...", self.show_index_advisor)
+
+        # Local copies of tables that the grid reads from instead of the server, one SQLite file per database
+        self.snapshot_stores = {}
+        snapshot_menu = self.menuBar().addMenu("Snapshot")
+        self.browse_snapshots_action = snapshot_menu.addAction("Browse Snapshots")
+        self.browse_snapshots_action.setCheckable(True)
+        self.browse_snapshots_action.setChecked(self.settings.value("snapshot/browse", True, type=bool))
+        self.browse_snapshots_action.toggled.connect(self.browse_snapshots_toggled)
+        snapshot_menu.addSeparator()
+        snapshot_menu.addAction("Mirror Table", self.mirror_current_table)
+        snapshot_menu.addAction("Refresh Snapshot", lambda: self.refresh_snapshots([self.current_table_name()]))
+        snapshot_menu.addAction("Refresh All Snapshots", self.refresh_snapshots)
+        snapshot_menu.addAction("Remove Snapshot", self.remove_snapshot)
+        self.snapshot_timer = QTimer(self)
+        self.snapshot_timer.setInterval(SNAPSHOT_AGE_INTERVAL)
+        self.snapshot_timer.timeout.connect(self.update_snapshot_status)
+
+        # Schema changes run one at a time in the order they were made, while the rest of the window stays usable
+        self.schema_changes = []
+        self.schema_change_job = None
+        self.schema_change_progress = None
+        self.schema_change_timer = QTimer(self)
+        self.schema_change_timer.setInterval(DDL_PROGRESS_INTERVAL)
+        self.schema_change_timer.timeout.connect(self.poll_schema_change_progress)
+
+        # Connect, then populate table tree with existing tables
+        self.connect_to_server()
 
         # Initialize add column dialog
         self.add_column_dialog = QDialog(self)
@@ -209,373 +2660,1311 @@ class MainWindow(QMainWindow):
         self.add_column_dialog_layout.addWidget(self.column_name_input, 0, 1)
         self.add_column_dialog_layout.addWidget(self.column_type_label, 1, 0)
         self.add_column_dialog_layout.addWidget(self.column_type_dropdown, 1, 1)
+        add_column_ok_button = QPushButton("OK")
+        add_column_ok_button.clicked.connect(self.add_column_ok)
+        self.add_column_dialog_layout.addWidget(add_column_ok_button, 2, 0, 1, 2)
 
-    def get_columns(self, table_name):
-        self.cursor.execute(f"DESCRIBE {table_name}")
-        return [column[0] for column in self.cursor.fetchall()]
-
-    def get_primary_key(self, table_name):
-        self.cursor.execute(f"SHOW KEYS FROM {table_name} WHERE Key_name = 'PRIMARY'")
-        primary_key = self.cursor.fetchone()
-        if primary_key is not None:
-            return primary_key[4]
+    def ask_server_details(self):
+        global host, user, password, db
+        self.server_details_dialog = ServerDetailsDialog(self.settings)
+        if self.server_details_dialog.exec_() != QDialog.Accepted:
+            return False
+        host, user, password, db = self.server_details_dialog.get_details()
+        return True
+
+    def connect_to_server(self):
+        self.statusBar().showMessage(f"Connecting to {host}...")
+
+        def connected(connection):
+            startup_profile.mark("connected")
+            # The connection used to check the login becomes the executor's first one
+            self.executor.release(connection)
+            self.statusBar().showMessage(f"Connected to {host}", 5000)
+            if self.server_details_dialog is not None:
+                self.server_details_dialog.save()
+                self.server_details_dialog = None
+            self.populate_table_tree()
+
+        def failed(error):
+            print("Error connecting to database:", error)
+            show_error_message(f"Error connecting to database: {error}")
+            if self.ask_server_details():
+                self.connect_to_server()
+            else:
+                self.close()
+
+        self.executor.submit(f"Connecting to {host}", lambda connection, job: self.open_connection(), connected,
+                             failed, connection=False, feature="connect")
+
+    def open_connection(self, **options):
+        return connect(host, user, password, db, **options)
+
+    def open_display_connection(self):
+        # Connections for results that are only shown, which skip converting every value unless turned off
+        if self.raw_fetch_action.isChecked():
+            return self.open_connection(raw=True)
+        return self.open_connection()
+
+    def prepare_connection(self, connection):
+        prepare_session(connection)
+
+    def show_index_advisor(self):
+        dialog = IndexAdvisorDialog(self)
+        dialog.analyze()
+        dialog.exec_()
+
+    def change_pool_size(self):
+        dialog = PoolSizeDialog(self, *(lane.size for lane in self.executor.lanes.values()))
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        size, background_size, bulk_size = dialog.get_sizes()
+        self.settings.setValue("pool/size", size)
+        self.settings.setValue("pool/background_size", background_size)
+        self.settings.setValue("pool/bulk_size", bulk_size)
+        self.executor.set_sizes(size, background_size, bulk_size)
+        self.update_query_status()
+
+    def closeEvent(self, event):
+        if self.table_model.has_pending():
+            confirm = QMessageBox.question(self, "Pending Changes",
+                                           f"Discard the changes that have not been applied "
+                                           f"({self.table_model.pending_summary()})?",
+                                           QMessageBox.Yes | QMessageBox.No)
+            if confirm != QMessageBox.Yes:
+                event.ignore()
+                return
+        self.timer.stop()
+        self.table_model.clear()
+        self.query_console.result_model.clear()
+        self.settings.setValue("advisor/workload", self.workload.dump())
+        self.watchdog.stop()
+        self.executor.shutdown()
+        super().closeEvent(event)
+
+    def update_query_status(self, *args):
+        self.schema_cache_label.setText(f"{self.schema_cache.stats_text()} | {self.result_cache.stats_text()}")
+        self.pool_label.setText(self.executor.stats_text())
+        self.pool_label.setToolTip("\n".join(
+            f"{lane['lane']}: {lane['in_use']} in use, {lane['idle']} idle of {lane['size']}, "
+            f"{lane['dedicated']} dedicated, "
+            f"{lane['opened']} opened, {lane['reconnects']} reconnected, {lane['discarded']} discarded, "
+            f"wait {lane['wait_ms']:.1f} ms avg / {lane['wait_p95_ms']:.1f} ms p95 / {lane['wait_max_ms']:.1f} ms max "
+            f"over {lane['checkouts']} checkouts" for lane in self.executor.stats()))
+        jobs = self.executor.running()
+        if not jobs:
+            self.query_status_label.setText("Ready")
+            self.query_progress.hide()
+            self.cancel_query_button.setEnabled(False)
+            return
+        job = jobs[0]
+        text = f"Running: {job.label}"
+        if job.rows:
+            text += f" ({job.rows} rows)"
+        if len(jobs) > 1:
+            text += f" +{len(jobs) - 1} more"
+        self.query_status_label.setText(text)
+        self.query_progress.show()
+        self.cancel_query_button.setEnabled(True)
+
+    def cancel_queries(self):
+        self.executor.cancel_all()
+
+    def run_query(self, label, fn, on_result=None, error_message=None, on_error=None, feature=None):
+        # Shorthand for the common case: run fn on a worker and report failures in a message box
+        def failed(error):
+            if isinstance(error, QueryCancelled):
+                self.statusBar().showMessage(f"Cancelled: {label}", 5000)
+            elif error_message is not None:
+                print(f"{error_message}: {error}")
+                show_error_message(f"{error_message}: {error}")
+            if on_error is not None:
+                on_error(error)
+
+        return self.executor.submit(label, fn, on_result, failed, feature=feature)
+
+    def current_table_name(self):
+        # The table selected in the tree, or the one owning a selected column or index
+        index = self.tree_proxy.mapToSource(self.table_tree.currentIndex())
+        item = self.tree_model.itemFromIndex(index.sibling(index.row(), 0)) if index.isValid() else None
+        while item is not None:
+            node = item.data(NODE_ROLE)
+            if node[0] == "table":
+                return node[2] if node[1] == db else None
+            item = item.parent()
+        return None
+
+    def select_table(self, table_name):
+        item = self.tree_model.table_item(db, table_name)
+        if item is not None:
+            self.table_tree.setCurrentIndex(self.tree_proxy.mapFromSource(item.index()))
+
+    def get_columns(self, cursor, table_name):
+        return list(self.schema_cache.get(cursor, table_name).columns)
+
+    def get_primary_key_columns(self, cursor, table_name):
+        return list(self.schema_cache.get(cursor, table_name).primary_key)
+
+    def get_primary_key(self, cursor, table_name):
+        primary_key = self.schema_cache.get(cursor, table_name).primary_key
+        if primary_key:
+            return primary_key[0]
         else:
             return None
 
-    def update_table_value(self, item):
-        row = item.row()
-        col = item.column()
-        table_name = self.table_tree.currentItem().text(0)
-        primary_key = self.get_primary_key(table_name)
-        primary_key_col = self.get_columns(table_name).index(primary_key)
-        primary_key_val = self.value_table.item(row, primary_key_col).text()
-        column_name = self.value_table.horizontalHeaderItem(col).text()
-        new_value = item.text()
-        query = f"UPDATE {table_name} SET {column_name} = '{new_value}' WHERE {primary_key} = '{primary_key_val}'"
-        try:
-            self.cursor.execute(query)
-            self.commit_changes()
-        except Exception as e:
-            show_error_message(f"Error updating value: {str(e)}")
-            self.refresh_table()
-
-    def commit_changes(self):
-        try:
-            self.db.commit()
-            print("Changes successfully committed.")
-        except:
-            self.db.rollback()
-            print("Error committing changes to the database.")
-
-    def get_column_type(self, table_name, column_name):
-        self.cursor.execute(f"SHOW COLUMNS FROM {table_name} WHERE Field = '{column_name}'")
-        column_data = self.cursor.fetchone()
-        if column_data is not None:
-            column_type = column_data[1]
-            return column_type
+    def update_pending_status(self):
+        has_pending = self.table_model.has_pending()
+        if has_pending:
+            self.pending_label.setText(f"Pending: {self.table_model.pending_summary()}")
         else:
-            return None
+            self.pending_label.setText("No pending changes")
+        self.apply_button.setEnabled(has_pending)
+        self.discard_button.setEnabled(has_pending)
+
+    def apply_changes(self):
+        if not self.table_model.has_pending():
+            return
+        changes = self.table_model.pending_changes()
+        batch_size = self.batch_size_input.value()
+        table_name = changes["table_name"]
+
+        def applied(count):
+            self.statusBar().showMessage(f"Applied {count} changes to {table_name}", 5000)
+            if self.table_model.table_name == table_name:
+                self.table_model.discard_pending()
+                self.refresh_table()
+
+        self.run_query(f"Applying changes to {table_name}",
+                       lambda connection, job: flush_pending_changes(connection, changes, batch_size, job),
+                       applied, error_message="Failed to apply changes, nothing was written", feature="cell edit")
+
+    def discard_changes(self):
+        self.table_model.discard_pending()
+
+    def confirm_discard_pending(self):
+        if not self.table_model.has_pending():
+            return True
+        confirm = QMessageBox.question(self, "Pending Changes",
+                                       f"Discard the changes to '{self.table_model.table_name}' that have not been "
+                                       f"applied ({self.table_model.pending_summary()})?",
+                                       QMessageBox.Yes | QMessageBox.No)
+        return confirm == QMessageBox.Yes
+
+    def get_column_type(self, cursor, table_name, column_name):
+        return self.schema_cache.get(cursor, table_name).column_types.get(column_name)
 
     def refresh_table(self):
-        try:
-            table_name = self.table_tree.currentItem()
-            if table_name is None:
-                return
-            self.cursor.execute(f"SELECT * FROM {table_name}")
-            data = self.cursor.fetchall()
-            num_rows = len(data)
-            num_cols = len(self.get_columns(table_name))
-            self.value_table.setRowCount(num_rows)
-            self.value_table.setColumnCount(num_cols)
-            self.value_table.setHorizontalHeaderLabels(self.get_columns(table_name))
-            for i, row_data in enumerate(data):
-                for j, col_data in enumerate(row_data):
-                    item = QTableWidgetItem(str(col_data))
-                    self.value_table.setItem(i, j, item)
-
-            # Set default values for new columns
-            columns = self.get_columns(table_name)
-            for i in range(num_cols, len(columns)):
-                column_type = self.get_column_type(table_name, columns[i])
-                if column_type == "int":
-                    for j in range(num_rows):
-                        item = QTableWidgetItem(str(0))
-                        self.value_table.setItem(j, i, item)
-                else:
-                    for j in range(num_rows):
-                        item = QTableWidgetItem("hi")
-                        self.value_table.setItem(j, i, item)
-
-        except Exception as e:
-            print(f"Error refreshing table: {str(e)}")
+        # Full reload of the rows already in the grid, for when the table structure or its contents are
+        # known to have changed
+        table_name = self.current_table_name()
+        if table_name is None or self.table_model.sql is None:
+            return
+        if self.table_model.read_only:
+            self.refresh_snapshots([table_name])
+            return
+
+        def read_signature(connection, job):
+            return self.refresh_tracker.read_signature(connection.cursor(), table_name)
+
+        def reload(signature):
+            if self.current_table_name() == table_name:
+                self.refresh_tracker.start(table_name, *signature)
+                self.table_model.refresh()
+
+        self.executor.submit(f"Refreshing {table_name}", read_signature, reload,
+                             lambda error: print(f"Error refreshing table: {error}"), feature="refresh")
+
+    def poll_table_changes(self):
+        view = self.value_table
+        first = view.rowAt(0)
+        last = view.rowAt(view.viewport().height() - 1)
+        visible = (max(first, 0), last if last >= 0 else self.table_model.rowCount() - 1)
+        snapshot = self.refresh_tracker.snapshot(self.table_model, visible)
+        if snapshot is None:
+            self.timer.start(self.refresh_tracker.interval)
+            return
+
+        def applied(result):
+            self.refresh_tracker.apply(self.table_model, result)
+            table_name = self.refresh_tracker.table_name
+            if self.refresh_tracker.unsigned and table_name is not None and self.unsigned_notice != table_name:
+                self.unsigned_notice = table_name
+                self.statusBar().showMessage(
+                    f"The server keeps no change time or checksum for {table_name}; auto-refresh only checks the "
+                    f"rows in view, every {self.refresh_tracker.interval // 1000} s", 10000)
+            self.timer.start(self.refresh_tracker.interval)
+
+        def failed(error):
+            print(f"Error refreshing table: {error}")
+            self.refresh_tracker.finish(False)
+            self.timer.start(self.refresh_tracker.interval)
+
+        self.executor.submit("Checking for changes",
+                             lambda connection, job: self.refresh_tracker.check(connection.cursor(), snapshot),
+                             applied, failed, background=True, feature="refresh timer")
 
     def populate_table_tree(self):
-        self.table_tree.clear()
-        self.cursor.execute("SHOW TABLES")
-        tables = self.cursor.fetchall()
-        for table in tables:
-            table_name = table[0]
-            table_item = QTreeWidgetItem([table_name])
-            self.table_tree.addTopLevelItem(table_item)
-
-    def show_table_values(self, item, column):
-        table_name = item.text(column)
-        self.cursor.execute(f"SELECT * FROM {table_name}")
-        values = self.cursor.fetchall()
-
-        # Set the number of rows and columns in the table
-        num_rows = len(values)
-        num_columns = len(values[0]) if num_rows > 0 else 0
-        self.value_table.setRowCount(num_rows)
-        self.value_table.setColumnCount(num_columns)
-
-        # Set column headers based on the retrieved data
-        if num_rows > 0:
-            column_headers = [desc[0] for desc in self.cursor.description]
-            self.value_table.setHorizontalHeaderLabels(column_headers)
-
-        # Populate the table with data
-        for i, value in enumerate(values):
-            for j, column in enumerate(value):
-                item = QTableWidgetItem(str(column))
-                self.value_table.setItem(i, j, item)
-
-        def update_table_value(self, item):
-            table_item = self.table_tree.currentItem()
-            if table_item is None:
+        database_name = db
+
+        def fetch_tables(connection, job):
+            cursor = connection.cursor()
+            cursor.execute("SELECT SCHEMA_NAME FROM information_schema.SCHEMATA ORDER BY SCHEMA_NAME")
+            database_names = [row[0] for row in cursor.fetchall()]
+            return database_names, read_schema_tables(cursor, database_name)
+
+        def fill_tree(result):
+            database_names, tables = result
+            self.tree_model.set_databases(database_names, database_name)
+            startup_profile.mark("tables listed")
+            startup_profile.report()
+            self.tree_model.set_tables(database_name, tables)
+            database_item = self.tree_model.database_item(database_name)
+            if database_item is not None:
+                self.table_tree.expand(self.tree_proxy.mapFromSource(database_item.index()))
+            if self.table_model.table_name is not None:
+                self.select_table(self.table_model.table_name)
+
+        self.run_query("Loading tables", fetch_tables, fill_tree, error_message="Failed to load tables",
+                       feature="tree population")
+
+    def load_database_tables(self, database_name):
+        def loaded(tables):
+            self.tree_model.set_tables(database_name, tables)
+            self.search_tables()
+
+        self.run_query(f"Loading tables of {database_name}",
+                       lambda connection, job: read_schema_tables(connection.cursor(), database_name),
+                       loaded, error_message="Failed to load tables", feature="tree population")
+
+    def load_table_details(self, item):
+        _, database_name, table_name = item.data(NODE_ROLE)
+
+        def read_details(connection, job):
+            cursor = connection.cursor()
+            if database_name == db:
+                return self.schema_cache.get(cursor, table_name)
+            return self.schema_cache.load(cursor, table_name, database_name)
+
+        def loaded(schema):
+            # The tree may have been rebuilt in the meantime
+            if self.tree_model.table_item(database_name, table_name) is item:
+                self.tree_model.set_table_details(item, schema)
+
+        self.run_query(f"Loading details of {table_name}", read_details, loaded,
+                       error_message="Failed to load table details", feature="tree population")
+
+    def table_details_changed(self, table_name):
+        item = self.tree_model.table_item(db, table_name)
+        if item is None or not self.tree_model.is_loaded(item):
+            return
+        if self.table_tree.isExpanded(self.tree_proxy.mapFromSource(item.index())):
+            self.load_table_details(item)
+        else:
+            self.tree_model.forget_details(item)
+
+    def tree_expanded(self, index):
+        index = self.tree_proxy.mapToSource(index)
+        item = self.tree_model.itemFromIndex(index.sibling(index.row(), 0))
+        if item is None or self.tree_model.is_loaded(item):
+            return
+        node = item.data(NODE_ROLE)
+        if node[0] == "database":
+            self.load_database_tables(node[1])
+        elif node[0] == "table":
+            self.load_table_details(item)
+
+    def search_tables(self):
+        text = self.table_search_input.text()
+        self.tree_proxy.set_text(text)
+        if text.strip():
+            self.table_tree.expandToDepth(0)
+
+    def tree_clicked(self, index):
+        index = self.tree_proxy.mapToSource(index)
+        item = self.tree_model.itemFromIndex(index.sibling(index.row(), 0))
+        if item is None or item.data(NODE_ROLE)[0] != "table":
+            return
+        _, database_name, table_name = item.data(NODE_ROLE)
+        if database_name != db and not self.use_database(database_name):
+            self.select_table(self.table_model.table_name)
+            return
+        self.show_table_values(table_name)
+
+    def use_database(self, database_name):
+        # Tables of another database are browsed by switching every connection over to it
+        global db
+        if not self.confirm_discard_pending():
+            return False
+        self.refresh_tracker.stop()
+        self.table_model.clear()
+        db = database_name
+        self.executor.reset()
+        self.schema_cache.invalidate()
+        self.result_cache.invalidate()
+        self.tree_model.set_current_database(database_name)
+        return True
+
+    def show_table_values(self, table_name):
+        if table_name == self.table_model.table_name and self.table_model.has_pending():
+            return
+        if not self.confirm_discard_pending():
+            # Keep the tree pointing at the table that owns the pending changes
+            self.select_table(self.table_model.table_name)
+            return
+        self.remember_result()
+        self.refresh_tracker.stop()
+        snapshot = self.snapshot_info(table_name)
+        if snapshot is not None:
+            # Everything the grid needs is in the snapshot, so nothing goes to the server
+            if table_name != self.table_model.table_name:
+                self.sort_column = None
+                self.sort_descending = False
+                self.filters = []
+            self.open_table(table_name, snapshot["key_columns"])
+            return
+
+        def prepare(connection, job):
+            cursor = connection.cursor()
+            key_columns = self.get_primary_key_columns(cursor, table_name)
+            signature = self.refresh_tracker.read_signature(cursor, table_name)
+            return key_columns, signature
+
+        def load(result):
+            key_columns, signature = result
+            if self.current_table_name() != table_name:
+                # Another table was picked while this one was being prepared
+                return
+            self.refresh_tracker.start(table_name, *signature)
+            if table_name != self.table_model.table_name:
+                self.sort_column = None
+                self.sort_descending = False
+                self.filters = []
+            self.open_table(table_name, key_columns, signature=signature)
+
+        self.run_query(f"Opening {table_name}", prepare, load, error_message="Failed to load table",
+                       feature="table load")
+
+    def order_columns(self, key_columns):
+        # Columns the grid is ordered by; with a header sort the key follows to make the order unique
+        if self.sort_column is None:
+            return list(key_columns)
+        return [self.sort_column] + [key for key in key_columns if key != self.sort_column]
+
+    def open_table(self, table_name, key_columns, direction="first", boundary=None, signature=None):
+        # signature is a freshly read (signature, hot) pair when the caller has one; otherwise a cached result
+        # for the query costs one round trip to check
+        if signature is None:
+            self.remember_result()
+        snapshot = self.snapshot_info(table_name)
+        if snapshot is not None:
+            # Nothing on the server to watch while the grid reads the snapshot
+            self.refresh_tracker.stop()
+        self.table_model.connect = self.snapshot_store().connect if snapshot is not None \
+            else self.open_display_connection
+        self.table_model.read_only = snapshot is not None
+        self.page_direction = direction
+        where_sql, where_params = filter_clause(self.filters)
+        order_columns = self.order_columns(key_columns)
+        descending = self.sort_column is not None and self.sort_descending
+        key_ordered = bool(key_columns) and order_columns == list(key_columns) and not descending
+        load_options = dict(key_columns=key_columns, table_name=table_name, key_ordered=key_ordered,
+                            where_sql=where_sql, where_params=where_params)
+        if self.paged_checkbox.isChecked():
+            page_size = self.page_size_input.value()
+            load_options["page_size"] = page_size
+            if key_columns:
+                # Without a cached definition the sort column is taken to be nullable, which is only slower
+                schema = self.schema_cache.peek(table_name)
+                nullable_columns = [column_name for column_name in order_columns if column_name not in key_columns
+                                    and (schema is None or schema.nullable.get(column_name, True))]
+                sql, params = keyset_page_query(table_name, order_columns, page_size, direction, boundary,
+                                                descending, where_sql, where_params, nullable_columns)
+                load_options["extra_at_start"] = direction in ("prev", "last")
+            else:
+                # Nothing to seek on, so only a bounded first page can be shown
+                sql, params = select_query(table_name, where_sql, where_params, order_columns, descending,
+                                           limit=page_size + 1)
+        else:
+            # Key order lets the refresh tracker patch rows in place
+            sql, params = select_query(table_name, where_sql, where_params, order_columns, descending)
+        if snapshot is not None:
+            self.table_model.load(sql, params, **load_options)
+        else:
+            if direction == "first":
+                self.workload.record_filters(db, table_name, self.filters,
+                                             [self.sort_column] if self.sort_column is not None else [], sql,
+                                             params)
+            self.load_result(sql, params, signature, load_options)
+        self.update_snapshot_status()
+        self.update_page_controls()
+        self.update_view_hints()
+
+    def result_key(self, sql, params):
+        return sql, tuple(params or ())
+
+    def remember_result(self):
+        # Keeps the grid's rows in the result cache before it loads something else. Only rows the refresh
+        # tracker has been keeping in step with a signature it trusts are worth keeping.
+        model = self.table_model
+        tracker = self.refresh_tracker
+        if model.table_name is None or model.table_name != tracker.table_name or tracker.signature is None \
+                or tracker.hot:
+            return
+        state = model.cache_state()
+        if state is None:
+            return
+        key = self.result_key(model.sql, model.params)
+        # A shallow copy, so rows the grid adds or patches later cannot end up in the cache behind the saved
+        # state's back while the worker compacts it
+        rows = list(model.rows)
+        if self.result_cache.put(key, model.table_name, tracker.signature, state, rows):
+            # Storing by column saves the per-row tuples, but copying a big result would hold up the window
+            self.executor.submit("Compacting cached result", lambda connection, job: self.result_cache.compact(key),
+                                 background=True, connection=False, feature="result cache")
+
+    def load_result(self, sql, params, signature, load_options):
+        key = self.result_key(sql, params)
+        table_name = load_options["table_name"]
+        self.load_generation += 1
+        generation = self.load_generation
+
+        def restore(current):
+            if generation != self.load_generation:
                 return
-            table_name = table_item.text(0)
-            row = item.row()
-            column = item.column()
-            column_name = self.value_table.horizontalHeaderItem(column).text()
-
-            primary_key = self.get_primary_key(table_name)
-            primary_key_value = self.value_table.item(row, 0).text()
-            primary_key_col = self.get_columns(table_name).index(primary_key) + 1
-
-            if column == primary_key_col:
-                # Do not update primary key column
-                item.setFlags(item.flags() & ~Qt.ItemIsEditable)
+            cached = self.result_cache.take(key, *current)
+            if cached is None:
+                self.table_model.load(sql, params, **load_options)
                 return
-
-            # Build the SQL query
-            value = item.text()
-            primary_key_name = self.get_primary_key(table_name)
-
-            if column_name is None or value is None:
-                print("none")
-                pass
-            elif isinstance(column_name, PyQt5.QtWidgets.QTableWidgetItem):
-                print("oops")
-                pass
+            state, rows = cached
+            continuation = None
+            if not state["exhausted"]:
+                last_key = tuple(rows[-1][state["columns"].index(column_name)] for column_name in state["key_columns"])
+                continuation = continuation_query(table_name, state["key_columns"], last_key, state["where_sql"],
+                                                  state["where_params"])
+            self.table_model.restore(state, rows, continuation)
+            self.update_query_status()
+
+        if key not in self.result_cache:
+            self.table_model.load(sql, params, **load_options)
+        elif signature is not None:
+            restore(signature)
+        else:
+            self.table_model.clear()
+            self.run_query(f"Checking cached {table_name}",
+                           lambda connection, job: self.refresh_tracker.read_signature(connection.cursor(),
+                                                                                       table_name),
+                           restore, error_message="Failed to load table", feature="table load")
+
+    def result_cache_budget_changed(self, value):
+        self.settings.setValue("cache/budget_mb", value)
+        self.result_cache.set_budget(value * 1024 * 1024)
+        self.update_query_status()
+
+    def reopen_table(self):
+        # Reload the current table from its first page after the sort or filter changed
+        model = self.table_model
+        if model.table_name is None or not self.confirm_discard_pending():
+            return False
+        self.refresh_tracker.forget_rows()
+        self.open_table(model.table_name, model.key_columns)
+        return True
+
+    def load_page(self, direction, boundary=None):
+        model = self.table_model
+        if model.table_name is None or not model.key_indexes or model.fetching:
+            return
+        if direction == "next" or direction == "prev":
+            if not model.rows:
+                return
+            row = len(model.rows) - 1 if direction == "next" else 0
+            boundary = model.raw_values(row, self.order_columns(model.key_columns))
+        if not self.confirm_discard_pending():
+            return
+        self.refresh_tracker.forget_rows()
+        self.open_table(model.table_name, model.key_columns, direction, boundary)
+
+    def jump_to_key(self):
+        key_columns = self.table_model.key_columns
+        text = self.jump_key_input.text().strip()
+        if not text or not self.table_model.key_indexes or not self.paged_checkbox.isChecked():
+            return
+        if self.sort_column is not None:
+            show_error_message("Jumping to a key only works while the table is in key order.")
+            return
+        values = [value.strip() for value in text.split(",")] if len(key_columns) > 1 else [text]
+        if len(values) != len(key_columns):
+            show_error_message(f"Enter {len(key_columns)} comma-separated values for the key "
+                               f"({', '.join(key_columns)}).")
+            return
+        self.load_page("seek", values)
+
+    def header_clicked(self, section):
+        if section >= len(self.table_model.columns) or self.table_model.fetching:
+            return
+        column_name = self.table_model.columns[section]
+        previous = self.sort_column, self.sort_descending
+        # Each click moves the column through ascending, descending and back to key order
+        if self.sort_column != column_name:
+            self.sort_column, self.sort_descending = column_name, False
+        elif not self.sort_descending:
+            self.sort_descending = True
+        else:
+            self.sort_column, self.sort_descending = None, False
+        if not self.reopen_table():
+            self.sort_column, self.sort_descending = previous
+
+    def add_filter(self):
+        column_name = self.filter_column_input.currentText()
+        operator = self.filter_operator_input.currentText()
+        if not column_name:
+            return
+        self.filters.append((column_name, operator, self.filter_value_input.text()))
+        if self.reopen_table():
+            self.filter_value_input.clear()
+        else:
+            self.filters.pop()
+
+    def clear_filters(self):
+        if not self.filters:
+            return
+        previous = self.filters
+        self.filters = []
+        if not self.reopen_table():
+            self.filters = previous
+
+    def update_filter_columns(self):
+        columns = self.table_model.columns
+        if [self.filter_column_input.itemText(i) for i in range(self.filter_column_input.count())] != columns:
+            self.filter_column_input.clear()
+            self.filter_column_input.addItems(columns)
+        self.update_view_hints()
+
+    def update_view_hints(self):
+        header = self.value_table.horizontalHeader()
+        sort_section = self.table_model.column_index(self.sort_column) if self.sort_column is not None else None
+        header.setSortIndicatorShown(sort_section is not None)
+        if sort_section is not None:
+            header.setSortIndicator(sort_section, Qt.DescendingOrder if self.sort_descending else Qt.AscendingOrder)
+
+        descriptions = []
+        for column_name, operator, value in self.filters:
+            if operator in ("IS NULL", "IS NOT NULL"):
+                descriptions.append(f"{column_name} {operator}")
             else:
-                sql = f"UPDATE {table_name} SET {column_name} = %s WHERE {primary_key_name} = %s"
-                params = (value, primary_key_value)
-
-                # Execute the query
-                try:
-                    self.cursor.execute(sql, params)
-                    self.db.commit()
-                except pymysql.Error as e:
-                    print("Error updating table value: " + str(e))
-                    self.refresh_table()
+                descriptions.append(f"{column_name} {operator} '{value}'")
+        self.filters_label.setText(" AND ".join(descriptions))
+
+        # Tell whether MySQL can use an index for the filters and the sort, from the cached SHOW KEYS data
+        schema = self.schema_cache.peek(self.table_model.table_name) if self.table_model.table_name else None
+        hints = []
+        if schema is not None:
+            equality_columns = [column_name for column_name, operator, _ in self.filters
+                                if operator in ("=", "IS NULL")]
+            for column_name, operator, value in self.filters:
+                index_name = index_for_column(schema, column_name)
+                if operator in ("LIKE", "NOT LIKE") and value.startswith(("%", "_")):
+                    hints.append(f"{column_name}: leading wildcard, full scan")
+                elif operator in ("!=", "NOT LIKE", "IS NOT NULL") or index_name is None:
+                    hints.append(f"{column_name}: no usable index, full scan")
+                else:
+                    hints.append(f"{column_name}: index {index_name}")
+            if self.sort_column is not None:
+                index_name = index_for_column(schema, self.sort_column, equality_columns)
+                if index_name is None:
+                    hints.append(f"sort {self.sort_column}: no index, sorts every matching row")
+                else:
+                    hints.append(f"sort {self.sort_column}: index {index_name}")
+        self.index_hint_label.setText("; ".join(hints))
+        full_scan = any("full scan" in hint or "sorts every" in hint for hint in hints)
+        self.index_hint_label.setStyleSheet("color: #b00000" if full_scan else "")
+
+    def paged_mode_toggled(self, checked):
+        self.settings.setValue("browse/paged", checked)
+        model = self.table_model
+        if model.table_name is None:
+            self.update_page_controls()
+            return
+        if not self.reopen_table():
+            self.paged_checkbox.blockSignals(True)
+            self.paged_checkbox.setChecked(not checked)
+            self.paged_checkbox.blockSignals(False)
+
+    def update_page_controls(self):
+        model = self.table_model
+        paged = model.page_size is not None
+        keyed = paged and bool(model.key_indexes)
+        if self.page_direction in ("first", "next", "seek"):
+            has_next = model.has_more
+            has_prev = self.page_direction != "first"
+        else:
+            has_prev = model.has_more
+            has_next = self.page_direction != "last"
+        self.first_page_button.setEnabled(keyed)
+        self.last_page_button.setEnabled(keyed)
+        self.prev_page_button.setEnabled(keyed and has_prev and bool(model.rows))
+        self.next_page_button.setEnabled(keyed and has_next and bool(model.rows))
+        self.jump_key_input.setEnabled(keyed and self.sort_column is None)
+
+        if keyed and model.rows and model.key_ordered:
+            first_key = ", ".join(str(value) for value in model.row_key(0))
+            last_key = ", ".join(str(value) for value in model.row_key(len(model.rows) - 1))
+            self.page_label.setText(f"Keys {first_key} to {last_key}")
+        elif keyed and model.rows:
+            self.page_label.setText(f"{len(model.rows)} rows")
+        elif paged and model.columns and not model.rows:
+            self.page_label.setText("No rows")
+        else:
+            self.page_label.setText("")
 
-                self.show_table_values(self.table_tree.currentItem(), 0)
+        if paged and model.columns and not model.key_indexes:
+            self.page_warning_label.setText(f"No primary key: only the first {model.page_size} rows are shown")
+        else:
+            self.page_warning_label.setText("")
 
-    def get_primary_key_name(self, table_name):
-        sql = f"SHOW KEYS FROM {table_name} WHERE Key_name = 'PRIMARY'"
-        self.cursor.execute(sql)
-        result = self.cursor.fetchone()
-        if result:
-            return result[4]
+    def table_load_failed(self, error):
+        self.refresh_tracker.stop()
+        if isinstance(error, QueryCancelled):
+            self.statusBar().showMessage("Cancelled loading rows", 5000)
         else:
-            return None
+            print(f"Error loading table: {error}")
+            show_error_message(f"Failed to load table: {error}")
+
+    def get_primary_key_name(self, cursor, table_name):
+        return self.get_primary_key(cursor, table_name)
 
     def add_table(self):
         table_name, ok = QInputDialog.getText(self, "Add Table", "Table Name:")
         if ok and table_name:
-            sql = f"CREATE TABLE {table_name} (id INT AUTO_INCREMENT PRIMARY KEY)"
-            try:
-                self.cursor.execute(sql)
-                self.db.commit()
-                table_item = QTreeWidgetItem([table_name])
-                self.table_tree.addTopLevelItem(table_item)
-            except Exception as e:
-                print(f"Error creating table: {e}")
-                self.db.rollback()
-                show_error_message(f"Failed to create table: {e}")
+            sql = f"CREATE TABLE {quote_ident(table_name)} (id INT AUTO_INCREMENT PRIMARY KEY)"
+
+            def created(result):
+                self.tree_model.add_table(db, table_name)
+
+            self.queue_schema_change(f"Creating {table_name}", sql, [table_name], created,
+                                     "Failed to create table")
 
     def edit_table(self):
-        current_table = self.table_tree.currentItem()
-        if current_table:
-            new_table_name, ok = QInputDialog.getText(self, "Edit Table", "New Table Name:", text=current_table.text(0))
+        old_table_name = self.current_table_name()
+        if old_table_name is not None:
+            new_table_name, ok = QInputDialog.getText(self, "Edit Table", "New Table Name:", text=old_table_name)
             if ok and new_table_name:
-                old_table_name = current_table.text(0)
-                sql = f"ALTER TABLE {old_table_name} RENAME TO {new_table_name}"
-                try:
-                    self.cursor.execute(sql)
-                    self.db.commit()
-                    current_table.setText(0, new_table_name)
-                except Exception as e:
-                    print(f"Error renaming table: {e}")
-                    self.db.rollback()
-                    show_error_message(f"Failed to rename table: {e}")
+                sql = f"ALTER TABLE {quote_ident(old_table_name)} RENAME TO {quote_ident(new_table_name)}"
+
+                def renamed(result):
+                    self.tree_model.rename_table(db, old_table_name, new_table_name)
+                    if self.refresh_tracker.table_name == old_table_name:
+                        self.select_table(new_table_name)
+                        self.show_table_values(new_table_name)
+
+                self.queue_schema_change(f"Renaming {old_table_name}", sql, [old_table_name, new_table_name],
+                                         renamed, "Failed to rename table")
         else:
             show_error_message("No table selected.")
 
     def remove_table(self):
-        current_table = self.table_tree.currentItem()
-        if current_table:
-            table_name = current_table.text(0)
+        table_name = self.current_table_name()
+        if table_name is not None:
             confirm = QMessageBox.question(self, "Delete Table",
                                            f"Are you sure you want to delete the table '{table_name}'?",
                                            QMessageBox.Yes | QMessageBox.No)
             if confirm == QMessageBox.Yes:
-                sql = f"DROP TABLE {table_name}"
-                try:
-                    self.cursor.execute(sql)
-                    self.db.commit()
-                    self.table_tree.takeTopLevelItem(self.table_tree.indexOfTopLevelItem(current_table))
-                    self.value_table.setRowCount(0)
-                except Exception as e:
-                    print(f"Error deleting table: {e}")
-                    self.db.rollback()
-                    show_error_message(f"Failed to delete table: {e}")
+                sql = f"DROP TABLE {quote_ident(table_name)}"
+
+                def dropped(result):
+                    self.tree_model.remove_table(db, table_name)
+                    if self.refresh_tracker.table_name == table_name:
+                        self.refresh_tracker.stop()
+                        self.table_model.clear()
+
+                self.queue_schema_change(f"Dropping {table_name}", sql, [table_name], dropped,
+                                         "Failed to delete table")
         else:
             show_error_message("No table selected.")
 
+    def check_editable(self):
+        if self.table_model.read_only:
+            show_error_message(f"Table '{self.table_model.table_name}' is shown from its snapshot. Turn off "
+                               f"Snapshot > Browse Snapshots to change it.")
+            return False
+        return True
+
     def add_value(self):
-        current_table = self.table_tree.currentItem()
-        if current_table:
-            table_name = self.table_tree.currentItem().text(0)
-            print(table_name)
-            columns = self.get_columns(table_name)
-            print(columns)
+        table_name = self.current_table_name()
+        if table_name is not None and self.check_editable():
+            if self.table_model.table_name != table_name or not self.table_model.columns:
+                show_error_message(f"Table '{table_name}' has not finished loading yet.")
+                return
             values = []
-            for column in columns:
-                print(column)
+            for column in self.table_model.columns:
                 value, ok = QInputDialog.getText(self, f"Add Value - {column}", f"Enter value for {column}:")
-
                 if ok:
-                    print(value)
                     values.append(value)
                 else:
                     return
-            values_str = ", ".join([f"'{value}'" for value in values])
-            columns_str = ", ".join(columns)
-            sql = f"INSERT INTO {table_name} ({columns_str}) VALUES ({values_str})"
-            try:
-                self.cursor.execute(sql)
-                self.db.commit()
-                show_success_message(f"Success! Added {values_str} to {columns_str} in {table_name}")
-            except Exception as e:
-                print(f"Error adding value: {e}")
-                show_error_message(str(e))
+            self.table_model.add_pending_row(values)
+            self.statusBar().showMessage("Row staged, click Apply Changes to write it", 5000)
         else:
             show_error_message("No table Selected")
 
     def remove_value(self):
-        current_table = self.table_tree.currentItem()
-        if current_table:
-            item = self.value_table.currentItem()
-            if item:
-                row = item.row()
-                primary_key_name = self.get_primary_key_name(self.table_tree.currentItem().text(0))
-                primary_key_value = self.value_table.item(row, 0).text()
-                sql = \
-                    f"DELETE FROM {self.table_tree.currentItem().text(0)} WHERE {primary_key_name} = {primary_key_value} "
-                try:
-                    self.cursor.execute(sql)
-                    self.db.commit()
-                    self.value_table.removeRow(row)
-                except Exception as e:
-                    print(f"Error deleting value: {e}")
-                    self.db.rollback()
-                    show_error_message(f"Failed to delete value: {e}")
-
+        if self.current_table_name() is not None and self.check_editable():
+            rows = sorted({index.row() for index in self.value_table.selectionModel().selectedIndexes()},
+                          reverse=True)
+            if rows:
+                for row in rows:
+                    if not self.table_model.stage_delete(row):
+                        show_error_message(f"Table '{self.table_model.table_name}' has no primary key, "
+                                           f"so its values cannot be removed.")
+                        return
             else:
                 show_error_message("No value selected.")
         else:
             show_error_message("No table selected.")
 
     def edit_value(self):
-        current_table = self.table_tree.currentItem()
-        if current_table:
-            selected_items = self.value_table.selectedItems()
-            if selected_items:
-                if len(selected_items) == 1:
-                    row = selected_items[0].row()
-                    column = selected_items[0].column()
-                    item = self.value_table.item(row, column)
-                    new_value, ok = QInputDialog.getText(self, "Edit Value", "New Value:", text=item.text())
+        if self.current_table_name() is not None and self.check_editable():
+            selected_indexes = self.value_table.selectionModel().selectedIndexes()
+            if selected_indexes:
+                if len(selected_indexes) == 1:
+                    index = selected_indexes[0]
+                    if not self.table_model.flags(index) & Qt.ItemIsEditable:
+                        show_error_message(f"Table '{self.table_model.table_name}' has no primary key, "
+                                           f"so its values cannot be edited.")
+                        return
+                    new_value, ok = QInputDialog.getText(self, "Edit Value", "New Value:",
+                                                         text=self.table_model.data(index))
                     if ok:
-                        item.setText(new_value)
-                        self.update_table_value(item)
+                        # Staged until Apply Changes
+                        self.table_model.setData(index, new_value)
             else:
                 show_error_message("No items selected.")
         else:
             show_error_message("No tables selected.")
 
     def add_column(self):
-        current_table = self.table_tree.currentItem()
-        if current_table:
+        if self.current_table_name() is not None:
             self.add_column_dialog.show()
+        else:
+            show_error_message("No table selected!")
 
-            def ok_pressed(default_value=None):
-                table_name = self.table_tree.currentItem().text(0)
-                column_name = self.column_name_input.text()
-                column_type = self.column_type_dropdown.currentText()
-                if column_type == 'INT':
-                    default_value = 0
-                elif column_type == 'VARCHAR(255)':
-                    default_value = 'NULL'
-                else:
-                    show_error_message("What did you even do?")
-                sql = f"ALTER TABLE {table_name} ADD COLUMN {column_name} {column_type} DEFAULT {default_value}"
-                try:
-                    self.cursor.execute(sql)
-                    self.db.commit()
-                    self.add_column_dialog.close()
-                    self.populate_table_tree()
-                    self.refresh_table()
-                    print('success')
-                    # self.show_success_message(f"Success, Column '{column_name}' added to table '{table_name}'.")
-                except Exception as e:
-                    print(f"Error adding column: {e}")
-                    self.db.rollback()
-                    show_error_message(f"Failed to add column: {e}")
-
-            ok_button = QPushButton("OK")
-            ok_button.clicked.connect(ok_pressed)
-            self.add_column_dialog_layout.addWidget(ok_button, 2, 0, 1, 2)
-
-        elif current_table is None:
+    def add_column_ok(self, default_value=None):
+        table_name = self.current_table_name()
+        if table_name is None:
             show_error_message("No table selected!")
+            return
+        column_name = self.column_name_input.text()
+        column_type = self.column_type_dropdown.currentText()
+        if column_type == 'INT':
+            default_value = 0
+        elif column_type in ('VARCHAR(255)', 'DATE', 'DATETIME'):
+            default_value = 'NULL'
         else:
-            show_error_message("No table selected!")
+            show_error_message(f"Unsupported column type: {column_type}")
+            return
+        sql = f"ALTER TABLE {quote_ident(table_name)} ADD COLUMN {quote_ident(column_name)} {column_type} " \
+              f"DEFAULT {default_value}"
+
+        def added(result):
+            self.add_column_dialog.close()
+            self.table_details_changed(table_name)
+            self.refresh_table()
+
+        self.queue_schema_change(f"Adding column {column_name}", sql, [table_name], added, "Failed to add column")
 
     def remove_column(self):
-        current_table = self.table_tree.currentItem()
-        if current_table:
-            table_name = current_table.text(0)
+        table_name = self.current_table_name()
+        if table_name is not None:
             column_name = self.column_name_input.text()
             if column_name:
                 confirm = QMessageBox.question(self, "Delete Column",
                                                f"Are you sure you want to delete the column '{column_name}'?",
                                                QMessageBox.Yes | QMessageBox.No)
                 if confirm == QMessageBox.Yes:
-                    sql = f"ALTER TABLE {table_name} DROP COLUMN {column_name}"
-                    try:
-                        self.cursor.execute(sql)
-                        self.db.commit()
+                    sql = f"ALTER TABLE {quote_ident(table_name)} DROP COLUMN {quote_ident(column_name)}"
+
+                    def dropped(result):
+                        self.table_details_changed(table_name)
                         self.refresh_table()
-                    except Exception as e:
-                        print(f"Error deleting column: {e}")
-                        self.db.rollback()
-                        show_error_message(f"Failed to delete column: {e}")
+
+                    self.queue_schema_change(f"Dropping column {column_name}", sql, [table_name], dropped,
+                                             "Failed to delete column")
             else:
                 show_error_message("No column selected.")
         else:
             show_error_message("No table selected.")
 
-    def get_column_names(self, table_name):
-        sql = f"SHOW COLUMNS FROM {table_name}"
-        self.cursor.execute(sql)
-        result = self.cursor.fetchall()
-        if result:
-            column_names = []
-            for column in result:
-                column_names.append(column[0])
-            return column_names
+    def import_resume_key(self, path, table_name):
+        return "import/resume/" + (os.path.abspath(path) + "|" + table_name).replace("/", "\\")
+
+    def import_file(self):
+        table_name = self.current_table_name()
+        if table_name is None:
+            show_error_message("No table selected.")
+            return
+
+        def prepare(connection, job):
+            cursor = connection.cursor()
+            return self.get_columns(cursor, table_name), local_infile_enabled(cursor)
+
+        self.run_query(f"Preparing import into {table_name}", prepare,
+                       lambda result: self.show_import_dialog(table_name, *result),
+                       error_message="Failed to prepare import", feature="import")
+
+    def show_import_dialog(self, table_name, columns, local_infile_available):
+        dialog = ImportDialog(self, table_name, columns, local_infile_available,
+                              lambda path: int(self.settings.value(self.import_resume_key(path, table_name), 0)))
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        options = dialog.get_options()
+        if not options["mapping"]:
+            show_error_message("No file columns are mapped to table columns.")
+            return
+        self.start_import(table_name, options)
+
+    def start_import(self, table_name, options):
+        path = options["path"]
+        resume_key = self.import_resume_key(path, table_name)
+        started = time.monotonic()
+        progress = QProgressDialog(f"Importing {os.path.basename(path)}...", "Cancel", 0, 1000, self)
+        progress.setWindowTitle(f"Import into {table_name}")
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+
+        if options["load_data"]:
+            progress.setRange(0, 0)
+
+            def run(connection, job):
+                # LOAD DATA LOCAL needs a connection that allows it, so it gets one of its own
+                connection = self.executor.open_dedicated("bulk", self.open_connection, local_infile=True)
+                try:
+                    job.connection_id = connection.thread_id()
+                    return load_data_local_infile(connection, path, table_name, options["mapping"],
+                                                  options["file_column_count"], options["delimiter"],
+                                                  options["has_header"], options["start_row"],
+                                                  options["empty_as_null"])
+                finally:
+                    connection.close()
         else:
+            def run(connection, job):
+                return import_delimited_file(connection, path, table_name, options["mapping"], options["delimiter"],
+                                             options["has_header"], options["start_row"], options["batch_size"],
+                                             options["empty_as_null"], job)
+
+        def progressed(progress_job, rows):
+            if progress_job is not job:
+                return
+            imported = rows - options["start_row"]
+            rate = imported / max(time.monotonic() - started, 0.001)
+            progress.setLabelText(f"Imported {imported} rows ({rate:,.0f} rows/s)")
+            if progress_job.total:
+                progress.setValue(int(1000 * progress_job.done / progress_job.total))
+
+        def finished(rows):
+            self.executor.job_progress.disconnect(progressed)
+            progress.close()
+            self.settings.remove(resume_key)
+            elapsed = time.monotonic() - started
+            show_success_message(f"Imported {rows} rows into {table_name} in {elapsed:.1f} s "
+                                 f"({rows / max(elapsed, 0.001):,.0f} rows/s).")
+            if self.table_model.table_name == table_name:
+                self.refresh_table()
+
+        def failed(error):
+            self.executor.job_progress.disconnect(progressed)
+            progress.close()
+            # Batches are committed one by one, so the next run can carry on after the last one written
+            committed = max(job.rows, options["start_row"])
+            if committed > options["start_row"]:
+                self.settings.setValue(resume_key, committed)
+            if isinstance(error, QueryCancelled):
+                message = f"Import cancelled after data row {committed}."
+            else:
+                message = f"Import failed after data row {committed}: {error}"
+            if committed > options["start_row"]:
+                message += f" Importing the same file again will resume from row {committed}."
+            print(message)
+            show_error_message(message)
+            if self.table_model.table_name == table_name:
+                self.refresh_table()
+
+        job = self.executor.submit(f"Importing into {table_name}", run, finished, failed,
+                                   connection=not options["load_data"], feature="import", bulk=True)
+        self.executor.job_progress.connect(progressed)
+        progress.canceled.connect(lambda: self.executor.cancel(job))
+        progress.show()
+
+    def export_table(self):
+        table_name = self.current_table_name()
+        if table_name is None:
+            show_error_message("No table selected.")
+            return
+        where_sql, where_params = "", ()
+        order_columns, descending = [], False
+        if self.table_model.table_name == table_name:
+            if self.filters:
+                answer = QMessageBox.question(self, "Export", "Export only the rows matching the current filters?",
+                                              QMessageBox.Yes | QMessageBox.No | QMessageBox.Cancel)
+                if answer == QMessageBox.Cancel:
+                    return
+                if answer == QMessageBox.Yes:
+                    where_sql, where_params = filter_clause(self.filters)
+            if self.sort_column is not None:
+                order_columns = self.order_columns(self.table_model.key_columns)
+                descending = self.sort_descending
+        directory = self.settings.value("export/directory", "")
+        path, selected_filter = QFileDialog.getSaveFileName(self, "Export", os.path.join(directory, table_name),
+                                                            ";;".join(EXPORT_FORMATS))
+        if not path:
+            return
+        extension = selected_filter[selected_filter.index("*") + 1:-1] if "*" in selected_filter else ""
+        if not path.lower().endswith(extension):
+            path += extension
+        self.settings.setValue("export/directory", os.path.dirname(path))
+        sql, params = select_query(table_name, where_sql, where_params, order_columns, descending)
+        self.start_export(table_name, sql, params, path)
+
+    def start_export(self, label, sql, params, path):
+        started = time.monotonic()
+        progress = QProgressDialog(f"Exporting {label}...", "Cancel", 0, 0, self)
+        progress.setWindowTitle(f"Export to {os.path.basename(path)}")
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+
+        def run(connection, job):
+            return export_result(lambda: self.executor.open_dedicated("bulk", self.open_connection), sql, params,
+                                 path, job=job)
+
+        def progressed(progress_job, rows):
+            if progress_job is not job:
+                return
+            rate = rows / max(time.monotonic() - started, 0.001)
+            progress.setLabelText(f"Exported {rows} rows ({rate:,.0f} rows/s)")
+
+        def finished(rows):
+            self.executor.job_progress.disconnect(progressed)
+            progress.close()
+            elapsed = time.monotonic() - started
+            show_success_message(f"Exported {rows} rows to {path} in {elapsed:.1f} s "
+                                 f"({rows / max(elapsed, 0.001):,.0f} rows/s).")
+
+        def failed(error):
+            self.executor.job_progress.disconnect(progressed)
+            progress.close()
+            if isinstance(error, QueryCancelled):
+                self.statusBar().showMessage(f"Export of {label} cancelled after {job.rows} rows", 5000)
+            else:
+                print(f"Export failed: {error}")
+                show_error_message(f"Export failed: {error}")
+
+        job = self.executor.submit(f"Exporting {label}", run, finished, failed, connection=False,
+                                   feature="export", bulk=True)
+        self.executor.job_progress.connect(progressed)
+        progress.canceled.connect(lambda: self.executor.cancel(job))
+        progress.show()
+
+    def compare_table(self):
+        table_name = self.current_table_name()
+        if table_name is None:
+            show_error_message("No table selected.")
+            return
+        profiles = load_profiles(self.settings)
+        dialog = CompareDialog(self, table_name, profiles)
+        if dialog.exec_() != QDialog.Accepted:
+            return
+        profile_name, target_db, target_table, chunk_size, workers = dialog.get_details()
+        if profile_name is None:
+            connect_target = self.open_connection
+            target_label = f"{target_db}.{target_table}"
+        else:
+            profile = profiles[profile_name]
+            target_password = profile["password"]
+            if target_password is None:
+                target_password, ok = QInputDialog.getText(self, "Password",
+                                                           f"Password for {profile['user']}@{profile['host']}:",
+                                                           QLineEdit.Password)
+                if not ok:
+                    return
+            connect_target = lambda: connect(profile["host"], profile["user"], target_password, target_db or None)
+            target_label = f"{profile_name}: {target_db}.{target_table}"
+        source_database = db
+        started = time.monotonic()
+        progress = QProgressDialog(f"Comparing {table_name} with {target_label}...", "Cancel", 0, 0, self)
+        progress.setWindowTitle("Compare")
+        progress.setMinimumDuration(0)
+        progress.setAutoClose(False)
+        progress.setAutoReset(False)
+
+        def run(connection, job):
+            return compare_tables(self.schema_cache, lambda: self.executor.open_dedicated("bulk", self.open_connection),
+                                  lambda: self.executor.open_dedicated("bulk", connect_target), source_database,
+                                  table_name, target_db, target_table, chunk_size, workers, job)
+
+        def progressed(progress_job, rows):
+            if progress_job is not job:
+                return
+            progress.setLabelText(f"Compared {rows} rows, {job.done} of {job.total} chunks")
+
+        def finished(outcome):
+            self.executor.job_progress.disconnect(progressed)
+            progress.close()
+            columns, skipped, result = outcome
+            elapsed = time.monotonic() - started
+            summary = (f"{result['rows']} rows in {result['chunks']} chunks compared in {elapsed:.1f} s, "
+                       f"{result['mismatched']} chunks differ, {result['bytes'] / 1024:,.0f} KB transferred.")
+            if result["truncated"]:
+                summary += f" Only the first {len(result['differences'])} differences are listed."
+            if skipped:
+                summary += f"\nColumns not in both tables, not compared: {', '.join(sorted(set(skipped)))}"
+            if not result["mismatched"]:
+                show_success_message(f"The tables match. {summary}")
+                return
+            DiffResultDialog(self, f"{table_name} / {target_label}", summary, columns, result).exec_()
+
+        def failed(error):
+            self.executor.job_progress.disconnect(progressed)
+            progress.close()
+            if isinstance(error, QueryCancelled):
+                self.statusBar().showMessage(f"Comparing {table_name} cancelled", 5000)
+            else:
+                print(f"Compare failed: {error}")
+                show_error_message(f"Compare failed: {error}")
+
+        job = self.executor.submit(f"Comparing {table_name}", run, finished, failed, connection=False,
+                                   feature="compare", bulk=True)
+        self.executor.job_progress.connect(progressed)
+        progress.canceled.connect(lambda: self.executor.cancel(job))
+        progress.show()
+
+    def get_column_names(self, cursor, table_name):
+        column_names = self.get_columns(cursor, table_name)
+        return column_names or None
+
+    def execute_ddl(self, connection, sql, *table_names, allow_copy=False):
+        # Statements that change table definitions go through here so the schema cache never serves stale ones
+        try:
+            return online_ddl(connection.cursor(), sql, allow_copy)
+        finally:
+            self.schema_cache.invalidate(*table_names)
+            self.result_cache.invalidate(*table_names)
+
+    def queue_schema_change(self, label, sql, table_names, on_done=None, error_message=None, allow_copy=False,
+                            first=False):
+        change = {"label": label, "sql": sql, "table_names": table_names, "on_done": on_done,
+                  "error_message": error_message, "allow_copy": allow_copy}
+        if first:
+            self.schema_changes.insert(0, change)
+        else:
+            self.schema_changes.append(change)
+        self.start_schema_change()
+
+    def start_schema_change(self):
+        if self.schema_change_job is not None or not self.schema_changes:
+            self.update_schema_change_status()
+            return
+        change = self.schema_changes.pop(0)
+        label = change["label"]
+
+        def finished(algorithm):
+            self.schema_change_done()
+            self.statusBar().showMessage(f"{label}: done" + (f" ({algorithm})" if algorithm else ""), 5000)
+            if change["on_done"] is not None:
+                change["on_done"](algorithm)
+
+        def failed(error):
+            self.schema_change_done()
+            if isinstance(error, CopyRebuildRequired):
+                confirm = QMessageBox.question(self, "Copying Rebuild",
+                                               f"{label} cannot be done in place and would copy the whole table, "
+                                               f"blocking writes to it until it is done.\n\n{error}\n\n"
+                                               f"Run it anyway?", QMessageBox.Yes | QMessageBox.No)
+                if confirm == QMessageBox.Yes:
+                    self.queue_schema_change(label, change["sql"], change["table_names"], change["on_done"],
+                                             change["error_message"], allow_copy=True, first=True)
+            elif isinstance(error, QueryCancelled):
+                self.statusBar().showMessage(f"Cancelled: {label}", 5000)
+            elif change["error_message"] is not None:
+                print(f"{change['error_message']}: {error}")
+                show_error_message(f"{change['error_message']}: {error}")
+
+        self.schema_change_job = self.executor.submit(
+            label, lambda connection, job: self.execute_ddl(connection, change["sql"], *change["table_names"],
+                                                            allow_copy=change["allow_copy"]),
+            finished, failed, feature="schema change")
+        self.schema_change_progress = None
+        self.schema_change_timer.start()
+        self.update_schema_change_status()
+
+    def schema_change_done(self):
+        self.schema_change_job = None
+        self.schema_change_timer.stop()
+        # Runs the next one once the callbacks of this one have updated the tree
+        QTimer.singleShot(0, self.start_schema_change)
+
+    def poll_schema_change_progress(self):
+        job = self.schema_change_job
+        connection_id = job.connection_id if job is not None else None
+        if connection_id is None:
+            return
+
+        def read(connection, job):
+            import pymysql
+            try:
+                return read_ddl_progress(connection.cursor(), connection_id)
+            except pymysql.Error:
+                # No access to performance_schema
+                return None
+
+        def show(progress):
+            if self.schema_change_job is job:
+                self.schema_change_progress = progress
+                self.update_schema_change_status()
+
+        self.executor.submit("Reading schema change progress", read, show, background=True, feature="schema change")
+
+    def update_schema_change_status(self):
+        job = self.schema_change_job
+        if job is None:
+            self.schema_change_label.setText("")
+            return
+        text = job.label
+        progress = self.schema_change_progress
+        if progress is not None:
+            stage, completed, estimated = progress
+            text += f": {stage.rsplit('/', 1)[-1]}"
+            if estimated:
+                text += f" {min(100, (completed or 0) * 100 // estimated)}%"
+        if self.schema_changes:
+            text += f" (+{len(self.schema_changes)} queued)"
+        self.schema_change_label.setText(text)
+
+    def snapshot_store(self):
+        store = self.snapshot_stores.get(db)
+        if store is None:
+            directory = self.settings.value("snapshot/directory", "") or os.path.join(
+                QStandardPaths.writableLocation(QStandardPaths.AppDataLocation), "snapshots")
+            store = SnapshotStore(os.path.join(directory, re.sub(r"[^\w.-]", "_", f"{host}_{db}") + ".sqlite"))
+            self.snapshot_stores[db] = store
+        return store
+
+    def snapshot_info(self, table_name):
+        # The snapshot the grid reads table_name from, or None when it goes to the server
+        if not self.browse_snapshots_action.isChecked() or not db or table_name is None:
             return None
+        return self.snapshot_store().info(table_name)
+
+    def browse_snapshots_toggled(self, checked):
+        self.settings.setValue("snapshot/browse", checked)
+        table_name = self.table_model.table_name
+        if table_name is not None and self.snapshot_store().info(table_name) is not None:
+            self.show_table_values(table_name)
+
+    def mirror_current_table(self):
+        table_name = self.current_table_name()
+        if table_name is None:
+            show_error_message("No table selected.")
+            return
+        store = self.snapshot_store()
+
+        def run(connection, job):
+            cursor = connection.cursor()
+            return mirror_table(cursor, store, self.schema_cache.get(cursor, table_name), job=job)
+
+        self.run_query(f"Mirroring {table_name}", run, self.snapshot_refreshed,
+                       error_message=f"Failed to mirror {table_name}", feature="snapshot")
+
+    def refresh_snapshots(self, table_names=None):
+        # No names refreshes every snapshot of the current database
+        if table_names is not None and None in table_names:
+            show_error_message("No table selected.")
+            return
+        store = self.snapshot_store()
+        table_names = table_names or list(store.tables)
+        missing = [table_name for table_name in table_names if store.info(table_name) is None]
+        if missing or not table_names:
+            show_error_message(f"There is no snapshot of {', '.join(missing) or 'any table'} yet. "
+                               f"Use Snapshot > Mirror Table first.")
+            return
+
+        def run(connection, job):
+            cursor = connection.cursor()
+            return [refresh_snapshot(cursor, store, self.schema_cache.get(cursor, table_name), job=job)
+                    for table_name in table_names]
+
+        def refreshed(infos):
+            for info in infos:
+                self.snapshot_refreshed(info)
+
+        self.run_query(f"Refreshing snapshot of {', '.join(table_names)}", run, refreshed,
+                       error_message="Failed to refresh snapshot", feature="snapshot")
+
+    def snapshot_refreshed(self, info):
+        self.statusBar().showMessage(f"Snapshot of {info['table']}: {info['copied']} rows copied, "
+                                     f"{info['rows']} rows in total", 5000)
+        if info["table"] == self.table_model.table_name and self.browse_snapshots_action.isChecked():
+            if self.table_model.read_only:
+                if info["copied"]:
+                    self.table_model.refresh()
+                self.update_snapshot_status()
+            elif not self.table_model.has_pending():
+                # The grid switches from the server to the new snapshot
+                self.show_table_values(info["table"])
+
+    def remove_snapshot(self):
+        table_name = self.current_table_name()
+        store = self.snapshot_store()
+        if table_name is None or store.info(table_name) is None:
+            show_error_message("The selected table has no snapshot.")
+            return
+        showing = self.table_model.table_name == table_name and self.table_model.read_only
+        try:
+            store.remove(table_name)
+        except Exception as e:
+            print(f"Error removing snapshot: {e}")
+            show_error_message(f"Failed to remove the snapshot: {e}")
+            return
+        if showing:
+            self.table_model.clear()
+            self.show_table_values(table_name)
+        self.update_snapshot_status()
+
+    def update_snapshot_status(self):
+        info = self.snapshot_info(self.table_model.table_name) if self.table_model.read_only else None
+        if info is None:
+            self.snapshot_label.setText("")
+            self.snapshot_label.setToolTip("")
+            self.snapshot_timer.stop()
+            return
+        age = time.time() - info["refreshed_at"]
+        self.snapshot_label.setText(f"Snapshot, {format_age(age)} old")
+        self.snapshot_label.setStyleSheet("color: #b00000" if age > SNAPSHOT_STALE_AFTER else "")
+        caught = {"changes": f"new and changed rows by {info['refresh_column']}",
+                  "inserts": f"new rows by {info['refresh_column']}",
+                  "full": "everything by copying the table again"}[info["mode"]]
+        self.snapshot_label.setToolTip(
+            f"{info['rows']} rows of {info['table']} read from a local copy, last refreshed "
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info['refreshed_at']))}, last copied in full "
+            f"{time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(info['full_at']))}.\n"
+            f"Refreshing picks up {caught}; Mirror Table copies it again in full.")
+        if not self.snapshot_timer.isActive():
+            self.snapshot_timer.start()
 
 
 if __name__ == '__main__':
-    app = QApplication(sys.argv)
-    window = MainWindow()
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--profile", help="saved connection profile to connect with")
+    parser.add_argument("--profile-startup", action="store_true", help="print how long each startup phase takes")
+    args, qt_args = parser.parse_known_args()
+    startup_profile.enabled = args.profile_startup
+    app = QApplication(sys.argv[:1] + qt_args)
+    startup_profile.mark("application")
+    window = MainWindow(args.profile)
+    startup_profile.mark("window built")
     window.setWindowIcon(QIcon(resource_path('images/sql.ico')))
     app.setWindowIcon(QIcon(resource_path('images/sql.ico')))
     window.show()
+    startup_profile.mark("window shown")
+    QTimer.singleShot(0, lambda: startup_profile.mark("first event loop pass"))
     app.setWindowIcon(QIcon(resource_path("images/sql.ico")))
     sys.exit(app.exec_())
@@ -7,7 +7,8 @@ import sys
 base = 'Win32GUI' if sys.platform == 'win32' else None
 
 executables = [
-    Executable('main.py', base=base, icon='images/sql.ico')
+    Executable('main.py', base=base, icon='images/sql.ico'),
+    Executable('cli.py')
 ]
 
 setup(name='SQL Editor',
@@ -0,0 +1,390 @@
+import os
+import sqlite3
+import sys
+import zlib
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from engine import flush_pending_changes, keyset_page_query, WorkloadRecorder, refresh_column, snapshot_affinity, \
+    diff_tables, table_ref, count_rows, filter_clause, split_statements, plan_from_json, plan_from_tree, \
+    import_delimited_file, export_result, select_query, QueryCancelled
+
+
+def sqlite_sql(sql):
+    # ISNULL is an operator in SQLite, so the function of that name is registered as IS_NULL
+    return sql.replace("%s", "?").replace("ISNULL(", "IS_NULL(")
+
+
+class SqliteCursor:
+    def __init__(self, connection, statements):
+        self.cursor = connection.cursor()
+        self.statements = statements
+
+    def execute(self, sql, params=()):
+        self.statements.append(sql)
+        self.cursor.execute(sqlite_sql(sql), params)
+
+    def executemany(self, sql, rows):
+        self.statements.append(sql)
+        self.cursor.executemany(sqlite_sql(sql), rows)
+
+    def fetchone(self):
+        return self.cursor.fetchone()
+
+    def fetchmany(self, count):
+        return self.cursor.fetchmany(count)
+
+    def fetchall(self):
+        return self.cursor.fetchall()
+
+    @property
+    def description(self):
+        return self.cursor.description
+
+    @property
+    def rowcount(self):
+        return self.cursor.rowcount
+
+
+class BitXor:
+    def __init__(self):
+        self.value = None
+
+    def step(self, value):
+        if value is not None:
+            self.value = (self.value or 0) ^ value
+
+    def finalize(self):
+        return self.value
+
+
+class SqliteConnection:
+    # Enough of a pymysql connection for flush_pending_changes, exports and the diff, with the MySQL functions
+    # the chunk checksums use
+    def __init__(self, path=":memory:"):
+        self.connection = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self.connection.create_function("CRC32", 1, lambda text: zlib.crc32(str(text).encode()))
+        self.connection.create_function("CONCAT_WS", -1, lambda separator, *values: str(separator).join(
+            str(value) for value in values if value is not None))
+        self.connection.create_function("CONCAT", -1, lambda *values: None if None in values else "".join(
+            str(value) for value in values))
+        self.connection.create_function("IS_NULL", 1, lambda value: int(value is None))
+        self.connection.create_aggregate("BIT_XOR", 1, BitXor)
+        self.statements = []
+
+    def cursor(self, cursor_class=None):
+        return SqliteCursor(self.connection, self.statements)
+
+    def begin(self):
+        self.connection.execute("BEGIN")
+
+    def commit(self):
+        self.connection.execute("COMMIT")
+
+    def rollback(self):
+        self.connection.execute("ROLLBACK")
+
+    def rows(self, sql):
+        return self.connection.execute(sql).fetchall()
+
+    def thread_id(self):
+        return 0
+
+    def close(self):
+        self.connection.close()
+
+
+def make_table():
+    connection = SqliteConnection()
+    connection.connection.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT, price INTEGER)")
+    connection.connection.executemany("INSERT INTO items VALUES (?, ?, ?)", [(1, "a", 10), (2, "b", 20), (3, "c", 30)])
+    return connection
+
+
+def changes(updates):
+    return {"table_name": "items", "key_columns": ["id"], "columns": ["id", "name", "price"], "updates": updates,
+            "inserts": [], "deletes": []}
+
+
+def test_key_edit_and_other_edit_on_the_same_row_both_land():
+    connection = make_table()
+    done = flush_pending_changes(connection, changes({(1,): {"id": 10, "name": "x"}, (2,): {"price": 25}}), 100)
+    assert done == 2
+    assert connection.rows("SELECT id, name, price FROM items ORDER BY id") == [(2, "b", 25), (3, "c", 30),
+                                                                                (10, "x", 10)]
+
+
+def test_key_edits_are_written_after_the_batched_update():
+    connection = make_table()
+    flush_pending_changes(connection, changes({(1,): {"id": 10, "price": 15}, (3,): {"id": 30}}), 100)
+    updates = [sql for sql in connection.statements if sql.startswith("UPDATE")]
+    assert len(updates) == 3
+    assert "CASE" in updates[0] and "`id` =" not in updates[0].split(" WHERE ")[0]
+    assert updates[1] == updates[2] == "UPDATE `items` SET `id` = %s WHERE `id` IN (%s)"
+    assert connection.rows("SELECT id, price FROM items ORDER BY id") == [(2, 20), (10, 15), (30, 30)]
+
+
+def test_count_rows_with_a_filter():
+    connection = make_table()
+    assert count_rows(connection.cursor(), "items") == 3
+    assert count_rows(connection.cursor(), "items", *filter_clause([("price", ">", 15)])) == 2
+
+
+def diff_items(tmp_path, changed, row_limit, chunk_size=100):
+    # Compares two copies of a 50 row table where the target's price differs on the first changed rows
+    for name in ("source", "target"):
+        connection = SqliteConnection(str(tmp_path / name))
+        connection.connection.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, price INTEGER)")
+        connection.connection.executemany("INSERT INTO items VALUES (?, ?)",
+                                          [(i, i + (name == "target" and i <= changed)) for i in range(1, 51)])
+        connection.close()
+    return diff_tables(lambda: SqliteConnection(str(tmp_path / "source")),
+                       lambda: SqliteConnection(str(tmp_path / "target")), table_ref("main", "items"),
+                       table_ref("main", "items"), ["id", "price"], ["id"], chunk_size, 2, row_limit)
+
+
+def test_diff_lists_every_difference_within_the_limit(tmp_path):
+    result = diff_items(tmp_path, 5, 5)
+    assert [difference["key"] for difference in result["differences"]] == [(i,) for i in range(1, 6)]
+    assert not result["truncated"]
+
+
+def test_diff_is_truncated_when_one_chunk_has_more_differences_than_the_limit(tmp_path):
+    result = diff_items(tmp_path, 8, 5)
+    assert result["chunks"] == 1 and result["mismatched"] == 1
+    assert len(result["differences"]) == 5
+    assert result["truncated"]
+
+
+def walk_pages(connection, descending, direction, page_size=3):
+    # Every row of the table, page by page from the first or the last page
+    def page(direction, boundary=None):
+        sql, params = keyset_page_query("items", ["name", "id"], page_size, direction, boundary, descending,
+                                        nullable_columns=["name"])
+        rows = connection.execute(sql.replace("%s", "?"), params).fetchall()
+        if direction in ("prev", "last"):
+            return rows[-page_size:], len(rows) > page_size
+        return rows[:page_size], len(rows) > page_size
+
+    rows, more = page(direction)
+    seen = list(rows)
+    while more:
+        if direction == "first":
+            rows, more = page("next", rows[-1])
+            seen += rows
+        else:
+            rows, more = page("prev", rows[0])
+            seen = list(rows) + seen
+    return seen
+
+
+def test_keyset_pages_include_rows_with_a_null_sort_column():
+    connection = sqlite3.connect(":memory:")
+    connection.execute("CREATE TABLE items (name TEXT, id INTEGER PRIMARY KEY)")
+    connection.executemany("INSERT INTO items VALUES (?, ?)",
+                           [(None if i % 3 == 0 else f"n{i % 4}", i) for i in range(1, 20)])
+    for descending in (False, True):
+        direction = " DESC" if descending else ""
+        expected = connection.execute(f"SELECT name, id FROM items ORDER BY name{direction}, id{direction}").fetchall()
+        for start in ("first", "last"):
+            assert walk_pages(connection, descending, start) == expected
+
+
+def recorded(sql):
+    recorder = WorkloadRecorder()
+    recorder.record_statement("shop", sql)
+    return [(pattern["schema"], pattern["table"], pattern["equality"], pattern["range"], pattern["sort"])
+            for pattern in recorder.snapshot()]
+
+
+def test_record_statement_with_an_alias():
+    assert recorded("SELECT * FROM t AS x WHERE x.a = 1 ORDER BY x.b") == [("shop", "t", ["a"], [], ["b"])]
+    assert recorded("SELECT x.* FROM `t` x WHERE `x`.`a` > 5 AND x.c = 'y' ORDER BY `x`.`b` DESC LIMIT 10") == \
+        [("shop", "t", ["c"], ["a"], ["b"])]
+
+
+def test_record_statement_with_qualified_columns():
+    assert recorded("SELECT * FROM t WHERE t.a IN (1, 2) ORDER BY t.b") == [("shop", "t", ["a"], [], ["b"])]
+    assert recorded("SELECT * FROM other.t WHERE t.a = 1") == [("other", "t", ["a"], [], [])]
+    # Not a column of the table
+    assert recorded("SELECT * FROM t AS x WHERE y.a = 1 ORDER BY x.b") == [("shop", "t", [], [], ["b"])]
+
+
+class ColumnsCursor:
+    # Answers refresh_column's information_schema query with the given (name, extra, nullable) rows
+    def __init__(self, rows):
+        self.rows = rows
+
+    def execute(self, sql, params=()):
+        pass
+
+    def fetchall(self):
+        return self.rows
+
+
+def test_refresh_column_picks_by_ordinal():
+    assert refresh_column(ColumnsCursor([("id", "auto_increment", "NO"), ("a", "on update current_timestamp", "NO"),
+                                         ("b", "on update current_timestamp", "NO")]), "t") == ("a", "changes")
+    assert refresh_column(ColumnsCursor([("id", "auto_increment", "NO")]), "t") == ("id", "inserts")
+    assert refresh_column(ColumnsCursor([]), "t") == (None, "full")
+
+
+def test_refresh_column_with_a_nullable_on_update_column():
+    assert refresh_column(ColumnsCursor([("id", "auto_increment", "NO"), ("a", "on update current_timestamp", "YES")]),
+                          "t") == (None, "full")
+    assert refresh_column(ColumnsCursor([("a", "on update current_timestamp", "YES"),
+                                         ("b", "on update current_timestamp", "NO")]), "t") == ("b", "changes")
+
+
+def test_snapshot_affinity_matches_whole_type_names():
+    assert [snapshot_affinity(column_type) for column_type in ("int(11) unsigned", "bigint", "year", "decimal(10,2)",
+                                                               "double precision", "point", "varchar(5)", None)] == \
+        ["INTEGER", "INTEGER", "INTEGER", "REAL", "REAL", "", "", ""]
+
+
+def test_snapshot_affinity_folds_case_like_the_collation():
+    assert snapshot_affinity("varchar(20)", "utf8mb4_general_ci") == "COLLATE NOCASE"
+    assert snapshot_affinity("text", "utf8mb4_0900_as_cs") == ""
+    assert snapshot_affinity("varchar(20)", "utf8mb4_bin") == ""
+    assert snapshot_affinity("int", None) == "INTEGER"
+
+
+
+def test_split_statements_ignores_semicolons_in_quotes_and_comments():
+    script = "SELECT 'a;b', \"c;d\", `e;f` FROM t; -- one; two\nSELECT 'it\\'s;' # three;\n" \
+             "; /* four; five */ UPDATE t SET a = 1;"
+    assert split_statements(script) == ["SELECT 'a;b', \"c;d\", `e;f` FROM t",
+                                        "-- one; two\nSELECT 'it\\'s;' # three;",
+                                        "/* four; five */ UPDATE t SET a = 1"]
+    assert split_statements("  ;; SELECT 1") == ["SELECT 1"]
+
+
+def outline(steps):
+    return [(step["step"], step["rows"], step["warning"], outline(step["children"])) for step in steps]
+
+
+def test_plan_from_json_with_nested_steps():
+    mysql = {"select_id": 1, "cost_info": {"query_cost": "12.5"},
+             "ordering_operation": {"using_filesort": True, "nested_loop": [
+                 {"table": {"table_name": "o", "access_type": "ALL", "rows_examined_per_scan": 1000,
+                            "cost_info": {"prefix_cost": "101"}, "attached_condition": "(o.total > 5)"}},
+                 {"table": {"table_name": "c", "access_type": "eq_ref", "key": "PRIMARY",
+                            "rows_examined_per_scan": 1, "cost_info": {"prefix_cost": "120"}}}]}}
+    steps = plan_from_json(mysql)
+    assert outline(steps) == [("query_block", None, None, [
+        ("ordering_operation", None, "Sorts rows in a file", [
+            ("table o", 1000, "Full table scan", []),
+            ("table c", 1, None, [])])])]
+    assert steps[0]["cost"] == "12.5"
+    assert steps[0]["children"][0]["children"][1]["key"] == "PRIMARY"
+    mariadb = {"select_id": 1, "r_loops": 1,
+               "table": {"table_name": "t", "access_type": "ref", "rows": 10, "r_rows": 7, "r_filtered": 100}}
+    steps = plan_from_json(mariadb)
+    assert outline(steps) == [("query_block", None, None, [("table t", 10, None, [])])]
+    assert steps[0]["children"][0]["actual_rows"] == 7
+
+
+def test_plan_from_tree_with_nested_steps():
+    text = "-> Sort: o.total  (cost=120 rows=1000) (actual time=5.1..5.3 rows=990 loops=1)\n" \
+           "    -> Nested loop inner join  (cost=110 rows=1000) (actual time=0.2..4.9 rows=990 loops=1)\n" \
+           "        -> Filter: (o.total > 5)  (cost=101 rows=333)\n" \
+           "            -> Table scan on o  (cost=101 rows=1000)\n" \
+           "        -> Single-row index lookup on c using PRIMARY (id=o.customer_id)  (cost=0.25 rows=1)\n" \
+           "-> Other root\n"
+    steps = plan_from_tree(text)
+    assert outline(steps) == [
+        ("Sort: o.total", 1000, "Sorts or buffers rows", [
+            ("Nested loop inner join", 1000, None, [
+                ("Filter: (o.total > 5)", 333, None, [("Table scan on o", 1000, "Full table scan", [])]),
+                ("Single-row index lookup on c using PRIMARY (id=o.customer_id)", 1, None, [])])]),
+        ("Other root", None, None, [])]
+    assert steps[0]["actual_rows"] == 990 and steps[0]["details"] == "5.3 ms, 1 loops"
+
+
+class ImportJob:
+    cancelled = False
+    rows = 0
+
+    def report(self, rows, done=None, total=None):
+        self.rows = rows
+
+
+def write_import_file(tmp_path, ids):
+    path = tmp_path / "items.csv"
+    path.write_text("id,name,price\n" + "".join(f"{i},n{i},{i * 10}\n" for i in ids), encoding="utf-8")
+    return str(path)
+
+
+def test_import_resumes_after_the_last_committed_batch(tmp_path):
+    connection = make_table()
+    # Row 7 clashes with the key of an existing row, so the third batch fails and the first two stay
+    path = write_import_file(tmp_path, [4, 5, 6, 7, 8, 9, 1, 10, 11])
+    mapping = [(0, "id"), (1, "name"), (2, "price")]
+    job = ImportJob()
+    try:
+        import_delimited_file(connection, path, "items", mapping, batch_size=3, job=job)
+    except sqlite3.IntegrityError:
+        pass
+    else:
+        raise AssertionError("the duplicate key was imported")
+    assert job.rows == 6
+    assert connection.rows("SELECT MAX(id), COUNT(*) FROM items") == [(9, 9)]
+
+    connection.connection.execute("DELETE FROM items WHERE id = 1")
+    resume_row = job.rows
+    job = ImportJob()
+    assert import_delimited_file(connection, path, "items", mapping, start_row=resume_row, batch_size=3,
+                                 job=job) == 3
+    assert job.rows == 9
+    assert [row[0] for row in connection.rows("SELECT id FROM items ORDER BY id")] == list(range(1, 12))
+
+
+def test_import_without_a_header_maps_by_position(tmp_path):
+    connection = make_table()
+    path = tmp_path / "items.tsv"
+    path.write_text("4\tn4\t\n5\tn5\t50\n", encoding="utf-8")
+    assert import_delimited_file(connection, str(path), "items", [(0, "id"), (1, "name"), (2, "price")], "\t",
+                                 has_header=False) == 2
+    assert connection.rows("SELECT id, price FROM items WHERE id > 3 ORDER BY id") == [(4, None), (5, 50)]
+
+
+def make_export_table(tmp_path):
+    path = str(tmp_path / "source")
+    connection = SqliteConnection(path)
+    connection.connection.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+    connection.connection.executemany("INSERT INTO items VALUES (?, ?)", [(i, f"n{i}") for i in range(1, 8)])
+    connection.close()
+    return lambda: SqliteConnection(path)
+
+
+def test_export_is_renamed_into_place_when_complete(tmp_path):
+    connect = make_export_table(tmp_path)
+    path = tmp_path / "items.jsonl"
+    sql, params = select_query("items", order_columns=["id"])
+    assert export_result(connect, sql, params, str(path), chunk_size=3) == 7
+    lines = path.read_text(encoding="utf-8").splitlines()
+    assert len(lines) == 7 and lines[0] == '{"id": 1, "name": "n1"}'
+    assert sorted(os.listdir(tmp_path)) == ["items.jsonl", "source"]
+
+
+def test_cancelled_export_leaves_the_old_file_alone(tmp_path):
+    connect = make_export_table(tmp_path)
+    path = tmp_path / "items.csv"
+    path.write_text("old\n", encoding="utf-8")
+
+    class Job:
+        cancelled = False
+
+        def report(self, rows, done=None, total=None):
+            # Stops after the first chunk has been written to the .part file
+            self.cancelled = rows >= 3
+
+    sql, params = select_query("items", order_columns=["id"])
+    try:
+        export_result(connect, sql, params, str(path), chunk_size=3, job=Job())
+    except QueryCancelled:
+        pass
+    else:
+        raise AssertionError("the export was not cancelled")
+    assert path.read_text(encoding="utf-8") == "old\n"
+    assert sorted(os.listdir(tmp_path)) == ["items.csv", "source"]
@@ -0,0 +1,135 @@
+import array
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from main import TableChangeTracker, ResultCache, compact_column
+from test_engine import SqliteConnection
+
+
+class GridModel:
+    # The parts of LazyTableModel the change tracker reads
+    def __init__(self, rows, key_ordered=True):
+        self.sql = "SELECT * FROM `items`"
+        self.fetching = False
+        self.columns = ["id", "name"]
+        self.key_columns = ["id"]
+        self.key_indexes = [0]
+        self.key_ordered = key_ordered
+        self.where_sql = ""
+        self.where_params = []
+        self.rows = rows
+        self.exhausted = True
+        self.page_size = None
+
+    def row_key(self, row):
+        return (self.rows[row][0],)
+
+
+class LostSignatureTracker(TableChangeTracker):
+    # A server that stops reporting anything cheap for the table
+    def read_signature(self, cursor, table_name):
+        return None, True
+
+
+def make_items():
+    connection = SqliteConnection()
+    connection.connection.execute("CREATE TABLE items (id INTEGER PRIMARY KEY, name TEXT)")
+    connection.connection.executemany("INSERT INTO items VALUES (?, ?)", [(i, f"n{i}") for i in range(1, 101)])
+    return connection, connection.rows("SELECT id, name FROM items ORDER BY id")
+
+
+def poll(tracker, connection, model, visible):
+    connection.statements.clear()
+    result = tracker.check(connection.cursor(), tracker.snapshot(model, visible))
+    tracker.apply(model, result)
+    return result
+
+
+def test_unsigned_table_only_checks_the_rows_in_view():
+    connection, rows = make_items()
+    model = GridModel(rows)
+    model.patch_rows = lambda changed, deleted: None
+    tracker = TableChangeTracker()
+    tracker.start("items", None)
+    result = poll(tracker, connection, model, (10, 19))
+    assert sorted(result["digests"]) == [(i,) for i in range(11, 21)]
+    connection.connection.execute("UPDATE items SET name = 'x' WHERE id IN (5, 15)")
+    result = poll(tracker, connection, model, (10, 19))
+    assert [row[0] for row in result["rows"]] == [15]
+    assert len(result["digests"]) == 10
+
+
+def test_table_that_loses_its_signature_only_checks_the_rows_in_view():
+    connection, rows = make_items()
+    model = GridModel(rows)
+    model.patch_rows = lambda changed, deleted: None
+    tracker = LostSignatureTracker()
+    tracker.start("items", ("update time", 100, 101))
+    result = poll(tracker, connection, model, (0, 9))
+    assert sorted(result["digests"]) == [(i,) for i in range(1, 11)]
+    assert tracker.unsigned
+    assert tracker.snapshot(model, (0, 9))["bounded"]
+
+
+def test_unsigned_table_in_another_order_checks_the_keys_in_view():
+    connection, rows = make_items()
+    model = GridModel(list(reversed(rows)), key_ordered=False)
+    model.patch_rows = lambda changed, deleted: None
+    tracker = TableChangeTracker()
+    tracker.start("items", None)
+    poll(tracker, connection, model, (0, 4))
+    connection.connection.execute("UPDATE items SET name = 'x' WHERE id IN (50, 99)")
+    result = poll(tracker, connection, model, (0, 4))
+    assert not result["reload"]
+    assert [row[0] for row in result["rows"]] == [99]
+    assert "IN" in [sql for sql in connection.statements if "CRC32" in sql][0]
+
+
+def test_compact_column_round_trips():
+    for values, typecode in (([1, -2, 3], "q"), ([0.5, 1.0], "d")):
+        column = compact_column(values)
+        assert isinstance(column, array.array) and column.typecode == typecode and list(column) == values
+    for values in ([1, 2 ** 70], [1, 2.5], [True, False], [1, None], ["a", b"b"], []):
+        column = compact_column(values)
+        assert column == tuple(values) and [type(value) for value in column] == [type(value) for value in values]
+    # Raw columns are bytes still to be decoded and are kept as they are
+    assert compact_column([b"1", b"2"], raw=True) == (b"1", b"2")
+
+
+def cache_state(decoders=None):
+    return {"columns": ["id", "name", "price"], "key_columns": ["id"], "decoders": decoders}
+
+
+def test_result_cache_gives_back_the_rows_it_compacted():
+    rows = [(i, f"n{i}", i / 4) for i in range(1, 101)]
+    cache = ResultCache()
+    assert cache.put("key", "items", ("signature",), cache_state(), rows)
+    cache.compact("key")
+    state, cached = cache.take("key", ("signature",), False)
+    assert cached == rows and state == cache_state()
+    assert "key" not in cache
+
+
+def test_result_cache_before_compaction_and_with_a_new_signature():
+    rows = [(1, b"a", b"1.5")]
+    cache = ResultCache()
+    cache.put("key", "items", ("signature",), cache_state(decoders=[None, None, None]), rows)
+    assert cache.take("key", ("signature",), False)[1] is rows
+    cache.put("key", "items", ("signature",), cache_state(), rows)
+    cache.compact("key")
+    assert cache.take("key", ("changed",), False) is None
+    assert cache.misses == 1
+
+
+def test_result_cache_evicts_the_least_recently_stored_result():
+    rows = [(i, "x" * 100, 0.0) for i in range(100)]
+    cache = ResultCache(budget=1)
+    assert not cache.put("too big", "items", ("signature",), cache_state(), rows)
+    cache.set_budget(10 ** 9)
+    for key in ("a", "b", "c"):
+        cache.put(key, "items", ("signature",), cache_state(), list(rows))
+        cache.compact(key)
+    cache.set_budget(cache.size - 1)
+    assert "a" not in cache and "b" in cache and "c" in cache